@@ -5,17 +5,27 @@ from . import preprocessors
 from . import manipulations
 from .utils import tsv_reader
 from .preprocessors.bin_genome import Chromosomes
+from .manipulations.region_sum import AXES
+from .manipulations.convert_to_tsv import COMPRESSIONS
+from .generators.cohort import GENERATORS
+from .generators.checkpoint import Checkpoint
 from . import cli_common
+from .profiling import profile_subcommand
 
 
 @click.group()
 @cli_common.quiet
 @cli_common.debug
-def cli(quiet, debug):
+@cli_common.profile
+@click.pass_context
+def cli(ctx, quiet, debug, profile):
     cli_common.setup_debugger(quiet, debug)
+    if profile:
+        profile_subcommand(ctx, profile)
 
 
 @cli.command()
+@cli_common.telemetry
 @click.argument("annotation_input_file")
 @click.option(
     "-k",
@@ -26,14 +36,18 @@ def cli(quiet, debug):
 )
 @click.option("--bed-output-file", default="transcription_start_sites.bed")
 @click.option("--tss-output-file", default="transcription_start_sites.tsv")
-def find_tss(annotation_input_file, region_size, bed_output_file, tss_output_file):
-    """Finds all Transcription Start Sites given an annotation file."""
+@cli_common.workers
+def find_tss(
+    annotation_input_file, region_size, bed_output_file, tss_output_file, workers
+):
+    """Finds all Transcription Start Sites given an annotation file, which can be gzip compressed."""
     preprocessors.find_tss(
-        annotation_input_file, region_size, bed_output_file, tss_output_file
+        annotation_input_file, region_size, bed_output_file, tss_output_file, workers
     )
 
 
 @cli.command()
+@cli_common.telemetry
 @click.argument("genome_ref_file")
 @click.option("-o", "--output-file")
 @cli_common.mbp
@@ -45,6 +59,7 @@ def bin_genome(genome_ref_file, output_file, mbp, include_x):
 
 
 @cli.command()
+@cli_common.telemetry
 @click.argument("genome-ref-file")
 @click.option("-o", "--output_file")
 @cli_common.include_x
@@ -55,17 +70,64 @@ def bin_genome_chromosome(genome_ref_file, output_file, include_x):
 
 
 @cli.command()
+@cli_common.telemetry
+@click.argument("bam_file")
+@click.option("-o", "--output-dir", default="fragments")
+@cli_common.map_quality
+@cli_common.workers
+@cli_common.threads
+@cli_common.cram_reference
+def extract_fragments(
+    bam_file, output_dir, map_quality, workers, threads, cram_reference
+):
+    """Extracts the fragments of a bam file to a fragment store, which can be given to the generate commands in place of the bam file. The store gives the same counts as the bam file, with and without --single-sweep, and the report of the output is that of the extraction."""
+    generators.extract_fragments(
+        bam_file, output_dir, map_quality, workers, threads, cram_reference
+    )
+
+
+@cli.command()
+@cli_common.telemetry
 @click.argument("bam_file")
 @click.argument("bed_file")
 @click.option("-o", "--output-file", default="length_matrix.pickle")
 @cli_common.max_length
 @cli_common.map_quality
-def generate_length(bam_file, bed_file, output_file, max_length, map_quality):
+@cli_common.workers
+@cli_common.sweep
+@cli_common.threads
+@cli_common.cram_reference
+@cli_common.checkpoint
+def generate_length(
+    bam_file,
+    bed_file,
+    output_file,
+    max_length,
+    map_quality,
+    workers,
+    sweep,
+    threads,
+    cram_reference,
+    checkpoint_regions,
+    resume,
+):
     """Creates a tensor with fragment length data"""
-    generators.length_matrix(bam_file, bed_file, output_file, max_length, map_quality)
+    generators.length_matrix(
+        bam_file,
+        bed_file,
+        output_file,
+        max_length,
+        map_quality,
+        workers,
+        sweep,
+        threads=threads,
+        cram_reference=cram_reference,
+        checkpoint=Checkpoint.for_output(output_file, checkpoint_regions, resume),
+    )
 
 
 @cli.command()
+@cli_common.telemetry
 @click.argument("bam_file")
 @click.argument("bed_file")
 @click.argument("reference_genome")
@@ -73,8 +135,25 @@ def generate_length(bam_file, bed_file, output_file, max_length, map_quality):
 @cli_common.max_length
 @cli_common.flank
 @cli_common.map_quality
+@cli_common.workers
+@cli_common.sweep
+@cli_common.threads
+@cli_common.cram_reference
+@cli_common.checkpoint
 def generate_length_end_seq(
-    bam_file, bed_file, reference_genome, output_file, max_length, flank, map_quality
+    bam_file,
+    bed_file,
+    reference_genome,
+    output_file,
+    max_length,
+    flank,
+    map_quality,
+    workers,
+    sweep,
+    threads,
+    cram_reference,
+    checkpoint_regions,
+    resume,
 ):
     """Creates a tensor with length and end sequence data"""
     generators.length_end_seqs(
@@ -85,10 +164,16 @@ def generate_length_end_seq(
         max_length,
         flank,
         map_quality,
+        workers,
+        sweep,
+        threads=threads,
+        cram_reference=cram_reference,
+        checkpoint=Checkpoint.for_output(output_file, checkpoint_regions, resume),
     )
 
 
 @cli.command()
+@cli_common.telemetry
 @click.argument("bam_file")
 @click.argument("bed_file")
 @click.argument("reference_genome")
@@ -96,8 +181,27 @@ def generate_length_end_seq(
 @cli_common.max_length
 @cli_common.flank
 @cli_common.map_quality
+@cli_common.workers
+@cli_common.sweep
+@cli_common.threads
+@cli_common.cram_reference
+@cli_common.checkpoint
+@cli_common.dense
 def generate_length_end_seq_marginal(
-    bam_file, bed_file, reference_genome, output_file, max_length, flank, map_quality
+    bam_file,
+    bed_file,
+    reference_genome,
+    output_file,
+    max_length,
+    flank,
+    map_quality,
+    workers,
+    sweep,
+    threads,
+    cram_reference,
+    dense,
+    checkpoint_regions,
+    resume,
 ):
     """Creates a tensor with length and marginal end sequence data"""
     generators.length_end_seqs_marginal(
@@ -108,10 +212,17 @@ def generate_length_end_seq_marginal(
         max_length,
         flank,
         map_quality,
+        workers,
+        sweep,
+        threads=threads,
+        cram_reference=cram_reference,
+        checkpoint=Checkpoint.for_output(output_file, checkpoint_regions, resume),
+        dense=dense,
     )
 
 
 @cli.command()
+@cli_common.telemetry
 @click.argument("bam_file")
 @click.argument("bed_file")
 @click.argument("reference_genome")
@@ -119,8 +230,25 @@ def generate_length_end_seq_marginal(
 @cli_common.max_length
 @cli_common.flank
 @cli_common.map_quality
+@cli_common.workers
+@cli_common.sweep
+@cli_common.threads
+@cli_common.cram_reference
+@cli_common.checkpoint
 def generate_mate_length_end_seq(
-    bam_file, bed_file, reference_genome, output_file, max_length, flank, map_quality
+    bam_file,
+    bed_file,
+    reference_genome,
+    output_file,
+    max_length,
+    flank,
+    map_quality,
+    workers,
+    sweep,
+    threads,
+    cram_reference,
+    checkpoint_regions,
+    resume,
 ):
     """Create a tensor with length and end sequence data, where the first dimension represents whether a read came from the first or the second mate"""
     generators.mate_length_end_seqs(
@@ -131,43 +259,160 @@ def generate_mate_length_end_seq(
         max_length,
         flank,
         map_quality,
+        workers,
+        sweep,
+        threads=threads,
+        cram_reference=cram_reference,
+        checkpoint=Checkpoint.for_output(output_file, checkpoint_regions, resume),
     )
 
 
 @cli.command()
+@cli_common.telemetry
+@click.argument("bed_file")
+@click.argument("bam_files", nargs=-1)
+@click.option("--file-of-files", help="File containing the bam files")
+@click.option("-o", "--output-dir", default="cohort")
+@click.option(
+    "-g",
+    "--generator",
+    default="length",
+    type=click.Choice(GENERATORS),
+    help="The generator to run on each sample",
+)
+@click.option(
+    "-r", "--reference-genome", help="2bit reference genome, for end sequences"
+)
+@click.option(
+    "-c",
+    "--combined-file",
+    help="Combine the samples into this file when all samples are done",
+)
+@cli_common.max_length
+@cli_common.flank
+@cli_common.map_quality
+@cli_common.workers
+@cli_common.sweep
+@cli_common.threads
+@cli_common.cram_reference
+def generate_cohort(
+    bed_file,
+    bam_files,
+    file_of_files,
+    output_dir,
+    generator,
+    reference_genome,
+    combined_file,
+    max_length,
+    flank,
+    map_quality,
+    workers,
+    sweep,
+    threads,
+    cram_reference,
+):
+    """Runs a generator on each bam file of a cohort, a sample per worker, and skips samples whose output is complete"""
+    if file_of_files:
+        bam_files = cli_common.get_files_from_file(file_of_files)
+    if len(bam_files) > 0:
+        generators.generate_cohort(
+            bam_files,
+            bed_file,
+            output_dir,
+            generator,
+            reference_genome,
+            max_length,
+            flank,
+            map_quality,
+            workers,
+            sweep,
+            threads,
+            cram_reference,
+            combined_file,
+        )
+
+
+@cli.command()
+@cli_common.telemetry
 @click.argument("sample_files", nargs=-1)
 @cli_common.file_of_files
 @click.option("-o", "--output-file", default="collapsed_samples.pickle")
 @click.option("--uint32", is_flag=True)
-def sample_sum(sample_files, file_of_files, output_file, uint32):
+@cli_common.workers
+@click.option(
+    "--fan-in",
+    default=8,
+    type=click.IntRange(min=1),
+    help="Number of samples summed per worker task",
+)
+def sample_sum(sample_files, file_of_files, output_file, uint32, workers, fan_in):
     """Collapses the samples value by value"""
     if file_of_files:
         files = cli_common.get_files_from_file(file_of_files)
-        manipulations.sample_sum(files, output_file, uint32)
+        manipulations.sample_sum(files, output_file, uint32, workers, fan_in)
     else:
         if len(sample_files) > 0:
-            manipulations.sample_sum(sample_files, output_file, uint32)
+            manipulations.sample_sum(sample_files, output_file, uint32, workers, fan_in)
 
 
 @cli.command()
+@cli_common.telemetry
+@click.argument("sample_files", nargs=-1)
+@click.option("--file-of-files", help="File containing the sample files")
+@click.option("-o", "--output-file", default="summaries.tsv")
+@cli_common.flank
+@cli_common.workers
+def summaries(sample_files, file_of_files, output_file, flank, workers):
+    """Counts the nucleotides in each position of the end sequences of the samples"""
+    if file_of_files:
+        sample_files = cli_common.get_files_from_file(file_of_files)
+    if len(sample_files) > 0:
+        manipulations.summaries_table(sample_files, output_file, flank, workers)
+
+
+@cli.command()
+@cli_common.telemetry
 @click.argument("sample_file")
 @click.option("-o", "--output-file", default="collapsed_sample.pickle")
-def region_sum(sample_file, output_file):
+@click.option(
+    "--axis",
+    default="region",
+    type=click.Choice(AXES),
+    help="The axis to sum over",
+)
+def region_sum(sample_file, output_file, axis):
     """Sums the regions of the sample file"""
-    manipulations.region_sum(sample_file, output_file)
+    manipulations.region_sum(sample_file, output_file, axis)
 
 
 @cli.command()
+@cli_common.telemetry
 @click.argument("input_file")
 @click.option("-o", "--output-file", default="tsv_length_matrix.csv")
 @cli_common.min_length
 @cli_common.max_length
-def convert_to_tsv_length(input_file, output_file, min_length, max_length):
+@click.option(
+    "--compression",
+    type=click.Choice(COMPRESSIONS),
+    help="Compress the output with gzip or bgzip",
+)
+@click.option(
+    "--long",
+    "long_format",
+    is_flag=True,
+    help="Write a line per region and length with a non-zero count",
+)
+def convert_to_tsv_length(
+    input_file, output_file, min_length, max_length, compression, long_format
+):
     """Converts a .pickle file containing length data to a .tsv file"""
-    manipulations.convert_to_tsv_length(input_file, output_file, min_length, max_length)
+    manipulations.convert_to_tsv_length(
+        input_file, output_file, min_length, max_length, compression, long_format
+    )
 
 
 @cli.command()
+@cli_common.telemetry
 @click.option("-o", "--output-file", default="combined_data.pickle")
 @cli_common.file_of_files
 @click.argument("input_files", nargs=-1)
@@ -182,6 +427,7 @@ def combine_data(output_file, file_of_files, input_files):
 
 
 @cli.command()
+@cli_common.telemetry
 @click.argument("input_sample")
 @click.argument("ids_file")
 @click.option("-o", "--output-file", default="subset_sample.pickle")
@@ -197,6 +443,7 @@ def pick_subset(input_sample, ids_file, output_file):
 
 
 @cli.command()
+@cli_common.telemetry
 @click.argument("input_matrix")
 @click.option("-o", "--output-file", default="binned_matrix.pickle")
 @click.option(
@@ -1,5 +1,12 @@
 import click
 import logging
+import functools
+
+from . import telemetry as telemetry_module
+
+# Parameters naming the output of a command, next to which the telemetry is
+# written
+OUTPUT_PARAMS = ("output_file", "output_dir", "bed_output_file")
 
 
 def include_x(function):
@@ -94,6 +101,51 @@ def stride(function):
     return function
 
 
+def workers(function):
+    function = click.option(
+        "-w",
+        "--workers",
+        default=1,
+        type=click.IntRange(min=1),
+        help="Number of worker processes",
+    )(function)
+
+    return function
+
+
+def sweep(function):
+    function = click.option(
+        "--single-sweep",
+        "sweep",
+        is_flag=True,
+        help="Read each chromosome once and assign fragments to all regions they overlap",
+    )(function)
+
+    return function
+
+
+def threads(function):
+    function = click.option(
+        "-t",
+        "--threads",
+        default=1,
+        type=click.IntRange(min=1),
+        help="Number of threads used for decompressing and indexing the bam file",
+    )(function)
+
+    return function
+
+
+def cram_reference(function):
+    function = click.option(
+        "--cram-reference",
+        type=click.Path(exists=True, dir_okay=False),
+        help="Fasta reference genome used for decoding cram files",
+    )(function)
+
+    return function
+
+
 def file_of_files(function):
     function = click.option(
         "-f", "--file-of-files", help="File containing files to be combined"
@@ -118,6 +170,64 @@ def debug(function):
     return function
 
 
+def dense(function):
+    function = click.option(
+        "--dense",
+        is_flag=True,
+        help="Store the tensor as a dense array instead of a sparse matrix per region",
+    )(function)
+
+    return function
+
+
+def checkpoint(function):
+    function = click.option(
+        "--checkpoint-regions",
+        type=click.IntRange(min=1),
+        help="Keep counted blocks of this many regions in OUTPUT_FILE.checkpoint",
+    )(function)
+    function = click.option(
+        "--resume",
+        is_flag=True,
+        help="Resume from the blocks in OUTPUT_FILE.checkpoint",
+    )(function)
+
+    return function
+
+
+def telemetry(function):
+    """Add a --telemetry flag, which writes the telemetry of the command to
+    a JSON file next to its output"""
+
+    @functools.wraps(function)
+    def wrapper(*args, telemetry=False, **kwargs):
+        if not telemetry:
+            return function(*args, **kwargs)
+        command = function.__name__.replace("_", "-")
+        output = next(
+            (kwargs[name] for name in OUTPUT_PARAMS if kwargs.get(name)), command
+        )
+        sidecar_file = output.rstrip("/") + telemetry_module.SIDECAR_SUFFIX
+        with telemetry_module.record(command, sidecar_file):
+            return function(*args, **kwargs)
+
+    return click.option(
+        "--telemetry",
+        is_flag=True,
+        help="Write timings, throughput and memory use to OUTPUT.telemetry.json",
+    )(wrapper)
+
+
+def profile(function):
+    function = click.option(
+        "--profile",
+        type=click.Path(file_okay=False),
+        help="Write a cProfile dump and a sampled hot path summary of the command to this directory",
+    )(function)
+
+    return function
+
+
 def setup_debugger(quiet_flag, debug_flag):
     logging.basicConfig(level=logging.INFO)
     logger = logging.getLogger()
@@ -1,16 +1,10 @@
 import click
-import tempfile
 import logging
 
-from .cli import (
-    bin_genome,
-    bin_genome_chromosome,
-    generate_length,
-    generate_length_end_seq,
-    region_sum,
-    convert_to_tsv_length,
-)
 from . import cli_common
+from . import flows
+from .data import Data
+from .profiling import profile_subcommand
 
 logger = logging.getLogger()
 
@@ -18,7 +12,9 @@ logger = logging.getLogger()
 @click.group()
 @cli_common.quiet
 @cli_common.debug
-def cli_flow(quiet, debug):
+@cli_common.profile
+@click.pass_context
+def cli_flow(ctx, quiet, debug, profile):
     """ctDNAflow is a tool for running workflows based on the commands found in ctDNAtool.
 
     The workflows are compositions of multiple commands from ctDNAtool, and are design for ease of use.
@@ -30,9 +26,12 @@ def cli_flow(quiet, debug):
         ctDNAflow length-data-chr-bin <reference_genome_path> <BAM_file_path>
     """
     cli_common.setup_debugger(quiet, debug)
+    if profile:
+        profile_subcommand(ctx, profile)
 
 
 @cli_flow.command()
+@cli_common.telemetry
 @click.argument("genome_ref_file")
 @click.argument("bam_file")
 @click.option(
@@ -46,9 +45,7 @@ def cli_flow(quiet, debug):
 @cli_common.max_length
 @cli_common.map_quality
 @cli_common.pickle_output
-@click.pass_context
 def length_data(
-    ctx,
     genome_ref_file,
     bam_file,
     output_file,
@@ -66,45 +63,19 @@ def length_data(
 
           ctDNAflow length-data <reference_genome_path> <BAM_file_path>
     """
-    temp_bed_file = tempfile.NamedTemporaryFile().name
-    temp_pickle_file = tempfile.NamedTemporaryFile().name
-    temp_output_file = tempfile.NamedTemporaryFile().name
-
-    if pickle_output:
-        logger.info("Exporting to .pickle file")
-
-    ctx.invoke(
-        bin_genome_chromosome,
-        genome_ref_file=genome_ref_file,
-        output_file=temp_bed_file,
+    data = flows.length_data(
+        genome_ref_file,
+        bam_file,
+        collapse=True,
         include_x=include_x,
-    )
-
-    ctx.invoke(
-        generate_length,
-        bam_file=bam_file,
-        bed_file=temp_bed_file,
-        output_file=temp_pickle_file,
         max_length=max_length,
-        map_quality=map_quality,
+        mapq=map_quality,
     )
-
-    if pickle_output:
-        ctx.invoke(region_sum, sample_file=temp_pickle_file, output_file=output_file)
-    else:
-        ctx.invoke(
-            region_sum, sample_file=temp_pickle_file, output_file=temp_output_file
-        )
-        ctx.invoke(
-            convert_to_tsv_length,
-            input_file=temp_output_file,
-            output_file=output_file,
-            min_length=min_length,
-            max_length=max_length,
-        )
+    flows.write_length_output(data, output_file, pickle_output, min_length, max_length)
 
 
 @cli_flow.command()
+@cli_common.telemetry
 @click.argument("genome_ref_file")
 @click.argument("bam_file")
 @click.option(
@@ -118,9 +89,7 @@ def length_data(
 @cli_common.max_length
 @cli_common.map_quality
 @cli_common.pickle_output
-@click.pass_context
 def length_data_chr_bin(
-    ctx,
     genome_ref_file,
     bam_file,
     output_file,
@@ -138,47 +107,18 @@ def length_data_chr_bin(
 
           ctDNAflow length-data-chr-bin <reference_genome_path> <BAM_file_path>
     """
-    temp_bed_file = tempfile.NamedTemporaryFile().name
-    temp_output_file = tempfile.NamedTemporaryFile().name
-
-    if pickle_output:
-        logger.info("Exporting to .pickle file")
-
-    ctx.invoke(
-        bin_genome_chromosome,
-        genome_ref_file=genome_ref_file,
-        output_file=temp_bed_file,
+    data = flows.length_data(
+        genome_ref_file,
+        bam_file,
         include_x=include_x,
+        max_length=max_length,
+        mapq=map_quality,
     )
-
-    if pickle_output:
-        ctx.invoke(
-            generate_length,
-            bam_file=bam_file,
-            bed_file=temp_bed_file,
-            output_file=output_file,
-            max_length=max_length,
-            map_quality=map_quality,
-        )
-    else:
-        ctx.invoke(
-            generate_length,
-            bam_file=bam_file,
-            bed_file=temp_bed_file,
-            output_file=temp_output_file,
-            max_length=max_length,
-            map_quality=map_quality,
-        )
-        ctx.invoke(
-            convert_to_tsv_length,
-            input_file=temp_output_file,
-            output_file=output_file,
-            min_length=min_length,
-            max_length=max_length,
-        )
+    flows.write_length_output(data, output_file, pickle_output, min_length, max_length)
 
 
 @cli_flow.command()
+@cli_common.telemetry
 @click.argument("genome_ref_file")
 @click.argument("bam_file")
 @click.option(
@@ -193,9 +133,7 @@ def length_data_chr_bin(
 @cli_common.max_length
 @cli_common.map_quality
 @cli_common.pickle_output
-@click.pass_context
 def length_data_bed_bin(
-    ctx,
     genome_ref_file,
     bam_file,
     output_file,
@@ -213,49 +151,19 @@ def length_data_bed_bin(
     EXAMPLE:
 
         ctDNAflow length-data-bed-bin <reference_genome_path> <BAM_file_path>"""
-
-    if pickle_output:
-        logger.info("Exporting to .pickle file")
-
-    temp_bed_file = tempfile.NamedTemporaryFile().name
-    temp_output_file = tempfile.NamedTemporaryFile().name
-
-    ctx.invoke(
-        bin_genome,
-        genome_ref_file=genome_ref_file,
-        output_file=temp_bed_file,
+    data = flows.length_data(
+        genome_ref_file,
+        bam_file,
         mbp=mbp,
         include_x=include_x,
+        max_length=max_length,
+        mapq=map_quality,
     )
-
-    if pickle_output:
-        ctx.invoke(
-            generate_length,
-            bam_file=bam_file,
-            bed_file=temp_bed_file,
-            output_file=output_file,
-            max_length=max_length,
-            map_quality=map_quality,
-        )
-    else:
-        ctx.invoke(
-            generate_length,
-            bam_file=bam_file,
-            bed_file=temp_bed_file,
-            output_file=temp_output_file,
-            max_length=max_length,
-            map_quality=map_quality,
-        )
-        ctx.invoke(
-            convert_to_tsv_length,
-            input_file=temp_output_file,
-            output_file=output_file,
-            min_length=min_length,
-            max_length=max_length,
-        )
+    flows.write_length_output(data, output_file, pickle_output, min_length, max_length)
 
 
 @cli_flow.command()
+@cli_common.telemetry
 @click.argument("genome_ref_file")
 @click.argument("bam_file")
 @click.option(
@@ -268,9 +176,7 @@ def length_data_bed_bin(
 @cli_common.max_length
 @cli_common.map_quality
 @click.option("-f", "--flank", default=1, type=click.IntRange(min=1))
-@click.pass_context
 def length_seq_data(
-    ctx,
     genome_ref_file,
     bam_file,
     output_file,
@@ -286,30 +192,20 @@ def length_seq_data(
 
           ctDNAflow length-seq-data <reference_genome_path> <BAM_file_path>
     """
-    temp_bed_file = tempfile.NamedTemporaryFile().name
-    temp_pickle_file = tempfile.NamedTemporaryFile().name
-
-    ctx.invoke(
-        bin_genome_chromosome,
-        genome_ref_file=genome_ref_file,
-        output_file=temp_bed_file,
+    data = flows.length_seq_data(
+        genome_ref_file,
+        bam_file,
+        collapse=True,
         include_x=include_x,
-    )
-
-    ctx.invoke(
-        generate_length_end_seq,
-        bam_file=bam_file,
-        bed_file=temp_bed_file,
-        output_file=temp_pickle_file,
         max_length=max_length,
         flank=flank,
-        map_quality=map_quality,
+        mapq=map_quality,
     )
-
-    ctx.invoke(region_sum, sample_file=temp_pickle_file, output_file=output_file)
+    Data.write(data, output_file)
 
 
 @cli_flow.command()
+@cli_common.telemetry
 @click.argument("genome_ref_file")
 @click.argument("bam_file")
 @click.option(
@@ -322,9 +218,7 @@ def length_seq_data(
 @cli_common.max_length
 @cli_common.map_quality
 @click.option("-f", "--flank", default=1, type=click.IntRange(min=1))
-@click.pass_context
 def length_seq_data_chr_bin(
-    ctx,
     genome_ref_file,
     bam_file,
     output_file,
@@ -340,26 +234,19 @@ def length_seq_data_chr_bin(
 
           ctDNAflow length-seq-data-chr-bin <reference_genome_path> <BAM_file_path>
     """
-    temp_bed_file = tempfile.NamedTemporaryFile().name
-
-    ctx.invoke(
-        bin_genome_chromosome,
-        genome_ref_file=genome_ref_file,
-        output_file=temp_bed_file,
+    data = flows.length_seq_data(
+        genome_ref_file,
+        bam_file,
         include_x=include_x,
-    )
-    ctx.invoke(
-        generate_length_end_seq,
-        bam_file=bam_file,
-        bed_file=temp_bed_file,
-        output_file=output_file,
         max_length=max_length,
         flank=flank,
-        map_quality=map_quality,
+        mapq=map_quality,
     )
+    Data.write(data, output_file)
 
 
 @cli_flow.command()
+@cli_common.telemetry
 @click.argument("genome_ref_file")
 @click.argument("bam_file")
 @click.option(
@@ -372,9 +259,8 @@ def length_seq_data_chr_bin(
 @cli_common.include_x
 @cli_common.max_length
 @cli_common.map_quality
-@click.pass_context
 def length_seq_data_bed_bin(
-    ctx, genome_ref_file, bam_file, output_file, mbp, include_x, max_length, map_quality
+    genome_ref_file, bam_file, output_file, mbp, include_x, max_length, map_quality
 ):
     """This command outputs the length data of a sample to a .pickle file, given a genome reference file.
     The data is binned in the provided mpb size
@@ -382,20 +268,12 @@ def length_seq_data_bed_bin(
     EXAMPLE:
 
         ctDNAflow length-data-bed-bin <reference_genome_path> <BAM_file_path>"""
-    temp_bed_file = tempfile.NamedTemporaryFile().name
-
-    ctx.invoke(
-        bin_genome,
-        genome_ref_file=genome_ref_file,
-        output_file=temp_bed_file,
+    data = flows.length_seq_data(
+        genome_ref_file,
+        bam_file,
         mbp=mbp,
         include_x=include_x,
-    )
-    ctx.invoke(
-        generate_length_end_seq,
-        bam_file=bam_file,
-        bed_file=temp_bed_file,
-        output_file=output_file,
         max_length=max_length,
-        map_quality=map_quality,
+        mapq=map_quality,
     )
+    Data.write(data, output_file)
@@ -1,4 +1,16 @@
-from .utils import pickle_read, pickle_write
+import numpy as np
+import logging
+
+from .utils import pickle_read
+from .container import (
+    ContainerReader,
+    ContainerWriter,
+    is_container,
+    read_values,
+    write_values,
+)
+
+logger = logging.getLogger()
 
 
 class CombinedData:
@@ -8,14 +20,128 @@ class CombinedData:
         self.data = data
 
     @staticmethod
-    def read(file_path):
-        return pickle_read(file_path)
+    def read(file_path, mmap=False):
+        """Read a CombinedData object from a container file, or from a pickle
+        file written by earlier versions.
+
+        :param file_path: File path to the combined data file
+        :type file_path: str
+        :param mmap: Memory-map the values if they were stored uncompressed
+        :type mmap: bool
+        """
+        if not is_container(file_path):
+            logger.debug(f"Reading legacy pickle file {file_path}")
+            return pickle_read(file_path)
+        with ContainerReader(file_path) as reader:
+            if reader.kind != "CombinedData":
+                raise ValueError(f"{file_path} holds {reader.kind}, not CombinedData")
+            return CombinedData(
+                np.array(reader.meta["IDs"], dtype=object),
+                reader.meta["region_ids"],
+                read_values(reader, reader.meta["values"], "", mmap),
+            )
+
+    @staticmethod
+    def write(data, file_path, compress=True):
+        """Write a CombinedData object to a container file
+
+        :param data: Combined data to write
+        :type data: CombinedData
+        :param file_path: File path to the combined data file
+        :type file_path: str
+        :param compress: Compress the values, otherwise they can be memory-mapped
+        :type compress: bool
+        """
+        with ContainerWriter(file_path, "CombinedData") as writer:
+            writer.meta["values"] = write_values(writer, data.data, "", compress)
+            writer.meta["IDs"] = list(data.IDs)
+            writer.meta["region_ids"] = list(data.region_ids)
 
     @staticmethod
-    def write(data, file_path):
-        pickle_write(data, file_path)
+    def writer(file_path, n_samples, region_ids, sample_shape, dtype, is_sparse):
+        """Return a CombinedDataWriter, writing the samples one at a time"""
+        return CombinedDataWriter(
+            file_path, n_samples, region_ids, sample_shape, dtype, is_sparse
+        )
 
     def __str__(self):
         return "CombinedData instance containing the following IDs: " + ", ".join(
             self.IDs
         )
+
+
+class CombinedDataWriter:
+    """Writes a CombinedData file one sample at a time, so only one sample
+    has to be in memory.
+
+    Dense samples are copied into an uncompressed (samples, ...) array,
+    allocated in the file up front and filled through a memory map. Sparse
+    samples are compressed and appended as they are added. The file is only
+    complete once the writer is closed, after all samples are added.
+    """
+
+    def __init__(
+        self, file_path, n_samples, region_ids, sample_shape, dtype, is_sparse
+    ):
+        self.n_samples = n_samples
+        self.IDs = list()
+        self.is_sparse = is_sparse
+        self._writer = ContainerWriter(file_path, "CombinedData")
+        self._writer.meta["region_ids"] = list(region_ids)
+        shape = (n_samples,) + tuple(sample_shape)
+        if is_sparse:
+            self._layout = {"layout": "samples", "shape": list(shape), "samples": []}
+        else:
+            self._layout = {"layout": "dense", "shape": list(shape)}
+            self._values = self._writer.allocate("values", shape, dtype)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._writer.__exit__(exc_type, exc_val, exc_tb)
+
+    def add(self, sample_id, values):
+        """Add the values of the next sample"""
+        index = len(self.IDs)
+        if index >= self.n_samples:
+            raise ValueError(f"All {self.n_samples} samples are already added")
+        if self.is_sparse:
+            self._layout["samples"].append(
+                write_values(self._writer, values, f"{index}/")
+            )
+        else:
+            if not np.can_cast(values.dtype, self._values.dtype, "safe"):
+                raise ValueError(
+                    f"Values of {sample_id} with dtype {values.dtype} can not be "
+                    f"stored as {self._values.dtype}"
+                )
+            np.copyto(self._values[index], values)
+        self.IDs.append(sample_id)
+
+    def widen(self, dtype):
+        """Store the dense values as the given wider dtype from now on. The
+        samples added so far are copied to a new array in the file, and the
+        space of the old array is left unused."""
+        dtype = np.dtype(dtype)
+        if self.is_sparse or dtype == self._values.dtype:
+            return
+        if not np.can_cast(self._values.dtype, dtype, "safe"):
+            raise ValueError(f"{self._values.dtype} can not be widened to {dtype}")
+        values = self._writer.allocate("values", self._values.shape, dtype)
+        for index in range(len(self.IDs)):
+            values[index] = self._values[index]
+        self._values = values
+
+    def close(self):
+        if len(self.IDs) != self.n_samples:
+            raise ValueError(
+                f"Only {len(self.IDs)} of {self.n_samples} samples were added"
+            )
+        self._writer.meta["values"] = self._layout
+        self._writer.meta["IDs"] = self.IDs
+        self._values = None
+        self._writer.close()
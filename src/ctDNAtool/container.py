@@ -0,0 +1,389 @@
+import json
+import zlib
+import struct
+import logging
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+
+from .telemetry import timed
+
+logger = logging.getLogger()
+
+# A container file starts with MAGIC, followed by the array payloads and a
+# JSON header describing them. The file ends with the length of the header
+# and MAGIC again, so a file whose writing was interrupted is recognized.
+MAGIC = b"CTDNADAT"
+FORMAT_VERSION = 1
+FOOTER = struct.Struct("<Q8s")
+# Uncompressed arrays are aligned, so they can be memory-mapped
+ALIGNMENT = 64
+# Compressed arrays are split in chunks of about CHUNK_BYTES along the first
+# axis, so a range of rows can be read without decompressing the whole array
+CHUNK_BYTES = 1 << 16
+COMPRESSION_LEVEL = 1
+
+
+def is_container(file_path):
+    """Return whether the file starts like a container file"""
+    with open(file_path, "rb") as fp:
+        return fp.read(len(MAGIC)) == MAGIC
+
+
+def is_complete(file_path):
+    """Return whether the file is a container file that was completely
+    written"""
+    try:
+        ContainerReader(file_path).close()
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+class ContainerWriter:
+    """Writes numpy arrays and a JSON serializable dict of metadata to a
+    container file.
+
+    Arrays are either zlib compressed in chunks along the first axis or
+    stored raw and aligned. Raw arrays can also be allocated up front and
+    filled through a memory map. The header is written when the writer is
+    closed, and a file without it is treated as incomplete.
+    """
+
+    def __init__(self, file_path, kind):
+        self.file_path = file_path
+        self.kind = kind
+        self.meta = dict()
+        self.arrays = dict()
+        self._memmaps = list()
+        self._fp = open(file_path, "wb")
+        self._fp.write(MAGIC)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._memmaps = list()
+            self._fp.close()
+
+    def _align(self):
+        position = self._fp.tell()
+        padding = -position % ALIGNMENT
+        self._fp.write(bytes(padding))
+        return position + padding
+
+    @timed("write")
+    def add_array(self, name, array, compress=True):
+        """Write an array to the file
+
+        :param name: Name of the array in the file
+        :type name: str
+        :param array: Array with a fixed-size dtype
+        :type array: numpy.ndarray
+        :param compress: Whether to compress the array, or store it raw to
+                         allow memory mapping
+        :type compress: bool
+        """
+        array = np.ascontiguousarray(array)
+        if array.dtype.hasobject:
+            raise ValueError(f"Array {name} with dtype object can not be stored")
+        if array.ndim == 0:
+            array = array.reshape(1)
+        entry = {"dtype": array.dtype.str, "shape": list(array.shape)}
+        if compress:
+            row_bytes = max(1, array[:1].nbytes)
+            chunk_rows = max(1, CHUNK_BYTES // row_bytes)
+            chunks = list()
+            for start in range(0, len(array), chunk_rows):
+                payload = zlib.compress(
+                    array[start : start + chunk_rows].tobytes(), COMPRESSION_LEVEL
+                )
+                chunks.append([self._fp.tell(), len(payload)])
+                self._fp.write(payload)
+            entry.update(codec="zlib", chunk_rows=chunk_rows, chunks=chunks)
+        else:
+            entry.update(codec="raw", offset=self._align())
+            self._fp.write(array.tobytes())
+        self.arrays[name] = entry
+
+    @timed("write")
+    def allocate(self, name, shape, dtype):
+        """Reserve space for a raw array in the file and return it as a
+        writable memory map, which can be filled until the writer is closed"""
+        dtype = np.dtype(dtype)
+        shape = tuple(int(n) for n in shape)
+        offset = self._align()
+        nbytes = dtype.itemsize * int(np.prod(shape))
+        self._fp.truncate(offset + nbytes)
+        self._fp.seek(offset + nbytes)
+        self._fp.flush()
+        self.arrays[name] = {
+            "dtype": dtype.str,
+            "shape": list(shape),
+            "codec": "raw",
+            "offset": offset,
+        }
+        if nbytes == 0:
+            return np.zeros(shape, dtype=dtype)
+        array = np.memmap(self.file_path, dtype, "r+", offset, shape)
+        self._memmaps.append(array)
+        return array
+
+    @timed("write")
+    def close(self):
+        for array in self._memmaps:
+            array.flush()
+        self._memmaps = list()
+        header = {
+            "version": FORMAT_VERSION,
+            "kind": self.kind,
+            "meta": self.meta,
+            "arrays": self.arrays,
+        }
+        header = json.dumps(header, default=_json_default).encode("utf-8")
+        self._fp.write(header)
+        self._fp.write(FOOTER.pack(len(header), MAGIC))
+        self._fp.close()
+        logger.debug(f"Wrote {self.kind} container to {self.file_path}")
+
+
+class ContainerReader:
+    """Reads the metadata and arrays of a container file. Arrays can be read
+    whole, memory-mapped if stored raw, or a range of rows at a time."""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._fp = open(file_path, "rb")
+        try:
+            header = self._read_header()
+        except Exception:
+            self._fp.close()
+            raise
+        if header["version"] > FORMAT_VERSION:
+            self._fp.close()
+            raise ValueError(
+                f"{file_path} has format version {header['version']}, "
+                f"only versions up to {FORMAT_VERSION} are supported"
+            )
+        self.kind = header["kind"]
+        self.meta = header["meta"]
+        self.arrays = header["arrays"]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._fp.close()
+
+    def _read_header(self):
+        if self._fp.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{self.file_path} is not a container file")
+        size = self._fp.seek(0, 2)
+        if size < len(MAGIC) + FOOTER.size:
+            raise ValueError(f"{self.file_path} is incomplete")
+        self._fp.seek(size - FOOTER.size)
+        length, magic = FOOTER.unpack(self._fp.read(FOOTER.size))
+        if magic != MAGIC or length > size - len(MAGIC) - FOOTER.size:
+            raise ValueError(f"{self.file_path} is incomplete")
+        self._fp.seek(size - FOOTER.size - length)
+        return json.loads(self._fp.read(length).decode("utf-8"))
+
+    def shape(self, name):
+        return tuple(self.arrays[name]["shape"])
+
+    def dtype(self, name):
+        return np.dtype(self.arrays[name]["dtype"])
+
+    @timed("read")
+    def read_array(self, name, mmap=False):
+        """Read an array. With mmap, a raw array is returned as a read-only
+        memory map instead of being loaded"""
+        entry = self.arrays[name]
+        if mmap and entry["codec"] == "raw" and np.prod(entry["shape"]) > 0:
+            return np.memmap(
+                self.file_path,
+                np.dtype(entry["dtype"]),
+                "r",
+                entry["offset"],
+                tuple(entry["shape"]),
+            )
+        return self.read_range(name, 0, entry["shape"][0])
+
+    @timed("read")
+    def read_range(self, name, start, stop):
+        """Read the rows [start, stop) of an array, only decompressing the
+        chunks holding them"""
+        entry = self.arrays[name]
+        dtype = np.dtype(entry["dtype"])
+        shape = tuple(entry["shape"])
+        start, stop = max(0, start), min(stop, shape[0])
+        row_shape = shape[1:]
+        row_size = dtype.itemsize * int(np.prod(row_shape))
+        rows = np.empty((max(0, stop - start),) + row_shape, dtype=dtype)
+        if len(rows) == 0:
+            return rows
+        if entry["codec"] == "raw":
+            self._fp.seek(entry["offset"] + start * row_size)
+            self._fp.readinto(rows.reshape(-1).view(np.uint8))
+            return rows
+        chunk_rows = entry["chunk_rows"]
+        first, last = start // chunk_rows, (stop - 1) // chunk_rows
+        for i in range(first, last + 1):
+            chunk = self._read_chunk(name, i)
+            chunk_start = i * chunk_rows
+            lo, hi = max(start, chunk_start), min(stop, chunk_start + len(chunk))
+            rows[lo - start : hi - start] = chunk[lo - chunk_start : hi - chunk_start]
+        return rows
+
+    @timed("read")
+    def read_rows(self, name, rows):
+        """Read the given rows of an array in the given order, only reading
+        the chunks holding them"""
+        entry = self.arrays[name]
+        dtype = np.dtype(entry["dtype"])
+        shape = tuple(entry["shape"])
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) and (rows.min() < 0 or rows.max() >= shape[0]):
+            raise IndexError(f"Row index out of range for {name} of shape {shape}")
+        if entry["codec"] == "raw":
+            if len(rows) == 0:
+                return np.empty((0,) + shape[1:], dtype=dtype)
+            return np.array(self.read_array(name, mmap=True)[rows])
+        selected = np.empty((len(rows),) + shape[1:], dtype=dtype)
+        chunk_ids = rows // entry["chunk_rows"]
+        order = np.argsort(chunk_ids, kind="stable")
+        chunk_ids_sorted = chunk_ids[order]
+        chunks, bounds = np.unique(chunk_ids_sorted, return_index=True)
+        bounds = np.append(bounds, len(rows))
+        for chunk_id, lo, hi in zip(chunks.tolist(), bounds[:-1], bounds[1:]):
+            chunk = self._read_chunk(name, chunk_id)
+            index = order[lo:hi]
+            selected[index] = chunk[rows[index] - chunk_id * entry["chunk_rows"]]
+        return selected
+
+    def _read_chunk(self, name, i):
+        entry = self.arrays[name]
+        offset, length = entry["chunks"][i]
+        self._fp.seek(offset)
+        return np.frombuffer(
+            zlib.decompress(self._fp.read(length)), dtype=np.dtype(entry["dtype"])
+        ).reshape((-1,) + tuple(entry["shape"][1:]))
+
+
+def write_values(writer, values, prefix, compress=True):
+    """Write the values of a Data or CombinedData object, which can be a
+    dense array, an array of sparse matrices of the same shape or a single
+    sparse matrix, and return the metadata needed to read them back"""
+    if issparse(values):
+        matrix = csr_matrix(values)
+        _write_csr(writer, prefix, matrix, compress)
+        return {"layout": "sparse_matrix", "shape": list(matrix.shape)}
+    if values.dtype.hasobject:
+        matrices = [csr_matrix(matrix) for matrix in values.ravel()]
+        matrix_shape = matrices[0].shape
+        if any(matrix.shape != matrix_shape for matrix in matrices):
+            raise ValueError("All sparse matrices must have the same shape")
+        # The matrices are stored as one csr matrix stacked along the rows
+        indptr = np.zeros(len(matrices) * matrix_shape[0] + 1, dtype=np.int64)
+        nnz = 0
+        for i, matrix in enumerate(matrices):
+            rows = slice(i * matrix_shape[0] + 1, (i + 1) * matrix_shape[0] + 1)
+            indptr[rows] = matrix.indptr[1:] + nnz
+            nnz += matrix.nnz
+        writer.add_array(prefix + "indptr", indptr, compress)
+        writer.add_array(
+            prefix + "indices",
+            np.concatenate([matrix.indices for matrix in matrices]),
+            compress,
+        )
+        writer.add_array(
+            prefix + "values",
+            np.concatenate([matrix.data for matrix in matrices]),
+            compress,
+        )
+        return {
+            "layout": "sparse_array",
+            "shape": list(values.shape),
+            "matrix_shape": list(matrix_shape),
+        }
+    writer.add_array(prefix + "values", values, compress)
+    return {"layout": "dense", "shape": list(values.shape)}
+
+
+def _write_csr(writer, prefix, matrix, compress):
+    writer.add_array(prefix + "indptr", matrix.indptr.astype(np.int64), compress)
+    writer.add_array(prefix + "indices", matrix.indices, compress)
+    writer.add_array(prefix + "values", matrix.data, compress)
+
+
+def read_values(reader, layout, prefix, mmap=False):
+    """Read back the values written by write_values"""
+    if layout["layout"] == "dense":
+        return reader.read_array(prefix + "values", mmap)
+    if layout["layout"] == "samples":
+        # Values written one sample at a time, see CombinedDataWriter
+        values = np.empty(tuple(layout["shape"]), dtype=object)
+        for i, sample_layout in enumerate(layout["samples"]):
+            values[i] = read_values(reader, sample_layout, f"{prefix}{i}/", mmap)
+        return values
+    indptr = reader.read_array(prefix + "indptr")
+    indices = reader.read_array(prefix + "indices", mmap)
+    values = reader.read_array(prefix + "values", mmap)
+    if layout["layout"] == "sparse_matrix":
+        return csr_matrix((values, indices, indptr), shape=tuple(layout["shape"]))
+    shape = tuple(layout["shape"])
+    n_rows, n_columns = layout["matrix_shape"]
+    matrices = np.empty(int(np.prod(shape)), dtype=object)
+    for i in range(len(matrices)):
+        matrix_indptr = indptr[i * n_rows : (i + 1) * n_rows + 1]
+        start, stop = matrix_indptr[0], matrix_indptr[-1]
+        matrices[i] = csr_matrix(
+            (values[start:stop], indices[start:stop], matrix_indptr - start),
+            shape=(n_rows, n_columns),
+        )
+    return matrices.reshape(shape)
+
+
+def read_value_rows(reader, layout, prefix, rows):
+    """Read the values of the given rows, the first axis, written by
+    write_values, without reading the other rows of dense values or of
+    arrays of sparse matrices"""
+    rows = np.asarray(rows, dtype=np.int64)
+    if layout["layout"] == "dense":
+        return reader.read_rows(prefix + "values", rows)
+    if layout["layout"] == "sparse_matrix":
+        return read_values(reader, layout, prefix)[rows]
+    if len(layout["shape"]) != 1:
+        return read_values(reader, layout, prefix)[rows]
+    n_rows, n_columns = layout["matrix_shape"]
+    indptr = reader.read_rows(
+        prefix + "indptr",
+        (rows[:, None] * n_rows + np.arange(n_rows + 1)).ravel(),
+    ).reshape((len(rows), n_rows + 1))
+    starts, nnz = indptr[:, 0], indptr[:, -1] - indptr[:, 0]
+    # Positions of the non-zero elements of the selected matrices
+    offsets = np.cumsum(nnz) - nnz
+    positions = np.arange(nnz.sum()) + np.repeat(starts - offsets, nnz)
+    indices = reader.read_rows(prefix + "indices", positions)
+    values = reader.read_rows(prefix + "values", positions)
+    matrices = np.empty(len(rows), dtype=object)
+    for i in range(len(rows)):
+        elements = slice(offsets[i], offsets[i] + nnz[i])
+        matrices[i] = csr_matrix(
+            (values[elements], indices[elements], indptr[i] - starts[i]),
+            shape=(n_rows, n_columns),
+        )
+    return matrices
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not serializable")
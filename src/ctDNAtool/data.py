@@ -1,6 +1,16 @@
+import attr
 import logging
+import numpy as np
 from scipy.sparse import issparse
-from .utils import pickle_read, pickle_write
+from .utils import pickle_read
+from .container import (
+    ContainerReader,
+    ContainerWriter,
+    is_container,
+    read_value_rows,
+    read_values,
+    write_values,
+)
 
 logger = logging.getLogger()
 
@@ -24,12 +34,90 @@ class Data:
         self.is_sparse, self.dtype = self.__determine_structure_and_dtype(data)
 
     @staticmethod
-    def read(file_path):
-        return pickle_read(file_path)
+    def read(file_path, mmap=False):
+        """Read a Data object from a container file, or from a pickle file
+        written by earlier versions.
+
+        :param file_path: File path to the data file
+        :type file_path: str
+        :param mmap: Memory-map the values if they were stored uncompressed
+        :type mmap: bool
+        """
+        if not is_container(file_path):
+            logger.debug(f"Reading legacy pickle file {file_path}")
+            return pickle_read(file_path)
+        with ContainerReader(file_path) as reader:
+            if reader.kind != "Data":
+                raise ValueError(f"{file_path} holds {reader.kind}, not Data")
+            values = read_values(reader, reader.meta["values"], "", mmap)
+            return Data(
+                values,
+                reader.meta["region_ids"],
+                report_from_dict(reader.meta["bam_report"]),
+            )
+
+    @staticmethod
+    def read_dtype(file_path):
+        """Read the dtype of the values of a data file from its metadata, or
+        return None for a legacy pickle file, whose dtype is only known once
+        the whole file is read.
+
+        :param file_path: File path to the data file
+        :type file_path: str
+        """
+        if not is_container(file_path):
+            return None
+        with ContainerReader(file_path) as reader:
+            if reader.kind != "Data":
+                raise ValueError(f"{file_path} holds {reader.kind}, not Data")
+            return reader.dtype("values")
+
+    @staticmethod
+    def write(data, file_path, compress=True):
+        """Write a Data object to a container file
+
+        :param data: Data to write
+        :type data: Data
+        :param file_path: File path to the data file
+        :type file_path: str
+        :param compress: Compress the values, otherwise they can be memory-mapped
+        :type compress: bool
+        """
+        with ContainerWriter(file_path, "Data") as writer:
+            writer.meta["values"] = write_values(writer, data.data, "", compress)
+            writer.meta["region_ids"] = list(data.region_ids)
+            writer.meta["bam_report"] = report_to_dict(data.bam_report)
+            order = region_order(writer.meta["region_ids"])
+            if order is not None:
+                writer.add_array("region_order", order, compress)
 
     @staticmethod
-    def write(data, file_path):
-        pickle_write(data, file_path)
+    def read_rows(file_path, region_ids):
+        """Read the rows of the given regions, in the given order, from a
+        data file. For container files only the chunks holding the rows are
+        read, and the rows are found through the sorted region id index
+        stored with the data.
+
+        :param file_path: File path to the data file
+        :type file_path: str
+        :param region_ids: List of region ids to read
+        :type region_ids: List[str]
+        :raises KeyError: If a region id is not in the data
+        """
+        region_ids = list(region_ids)
+        if not is_container(file_path):
+            sample = Data.read(file_path)
+            rows = find_rows(sample.region_ids, region_ids)
+            return Data(sample.data[rows], region_ids, sample.bam_report)
+        with ContainerReader(file_path) as reader:
+            if reader.kind != "Data":
+                raise ValueError(f"{file_path} holds {reader.kind}, not Data")
+            order = None
+            if "region_order" in reader.arrays:
+                order = reader.read_array("region_order")
+            rows = find_rows(reader.meta["region_ids"], region_ids, order)
+            values = read_value_rows(reader, reader.meta["values"], "", rows)
+            return Data(values, region_ids, report_from_dict(reader.meta["bam_report"]))
 
     @staticmethod
     def __determine_structure_and_dtype(data):
@@ -42,3 +130,69 @@ class Data:
 
     def __str__(self):
         return f"is sparse: {self.is_sparse}, data shape {self.data.shape}"
+
+
+def region_order(region_ids):
+    """Return the permutation sorting the region ids, or None if they can
+    not be sorted as numpy strings or integers"""
+    ids = np.asarray(region_ids)
+    if ids.ndim != 1 or ids.dtype.kind not in "iuU":
+        return None
+    return np.argsort(ids, kind="stable")
+
+
+def find_rows(region_ids, requested_ids, order=None):
+    """Find the rows of the requested region ids by binary search in the
+    sorted region ids
+
+    :param region_ids: Region ids of the rows
+    :type region_ids: List[str]
+    :param requested_ids: Region ids to find
+    :type requested_ids: List[str]
+    :param order: Permutation sorting region_ids, see region_order
+    :type order: numpy.ndarray
+    :raises KeyError: If a requested region id is not in region_ids
+    :returns: numpy.ndarray with the row of each requested region id
+    """
+    ids = np.asarray(region_ids)
+    requested = np.asarray(requested_ids)
+    if order is None:
+        order = region_order(region_ids)
+    if order is None or not _comparable(ids, requested):
+        index_map = {region_id: i for i, region_id in enumerate(region_ids)}
+        missing = [i for i in requested_ids if i not in index_map]
+        if missing:
+            raise KeyError(f"Region ids not found: {missing[:10]}")
+        return np.array([index_map[i] for i in requested_ids], dtype=np.int64)
+    sorted_ids = ids[order]
+    positions = np.searchsorted(sorted_ids, requested)
+    found = positions < len(sorted_ids)
+    found[found] = sorted_ids[positions[found]] == requested[found]
+    if not found.all():
+        raise KeyError(f"Region ids not found: {requested[~found][:10].tolist()}")
+    return order[positions]
+
+
+def _comparable(ids, requested):
+    return (ids.dtype.kind == "U") == (requested.dtype.kind == "U") and (
+        requested.dtype.kind in "iuU"
+    )
+
+
+def report_to_dict(report):
+    if report is None:
+        return None
+    if not attr.has(type(report)):
+        logger.warning(f"Report of type {type(report).__name__} is not stored")
+        return None
+    # Only fields taking part in comparisons are stored, not telemetry
+    return attr.asdict(report, filter=lambda field, _: field.eq)
+
+
+def report_from_dict(report):
+    if report is None:
+        return None
+    # Imported here, as the generators depend on this module
+    from .generators.bam import Report
+
+    return Report(**report)
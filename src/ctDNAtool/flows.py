@@ -0,0 +1,111 @@
+import logging
+
+from . import generators
+from . import preprocessors
+from . import manipulations
+from .data import Data
+from .preprocessors.bin_genome import Chromosomes
+
+logger = logging.getLogger()
+
+# The workflows of ctDNAflow. The steps hand regions as lists of BED objects
+# and samples as Data objects to each other, so only the final output of a
+# flow is written.
+
+
+def genome_regions(genome_ref_file, mbp=None, include_x=False):
+    """Split the genome in bins, either of whole chromosomes or of mbp size
+
+    :param genome_ref_file: File path to a .2bit file
+    :type genome_ref_file: str
+    :param mbp: Bin size in Mbp. If None, each chromosome is a bin.
+    :type mbp: float
+    :param include_x: Include the X chromosome
+    :type include_x: bool
+    :returns: List[BED]
+    """
+    chromosomes = Chromosomes.AUTOSOMES_X if include_x else Chromosomes.AUTOSOMES
+    if mbp is None:
+        return preprocessors.chromosome_regions(genome_ref_file, chromosomes)
+    return preprocessors.mbp_regions(genome_ref_file, mbp, chromosomes)
+
+
+def length_data(
+    genome_ref_file,
+    bam_file,
+    mbp=None,
+    collapse=False,
+    include_x=False,
+    max_length=500,
+    mapq=20,
+):
+    """Count the fragment lengths of a sample in bins of the genome
+
+    :param genome_ref_file: File path to a .2bit file
+    :type genome_ref_file: str
+    :param bam_file: File path to the bam sample file or a fragment store
+    :type bam_file: str
+    :param mbp: Bin size in Mbp. If None, each chromosome is a bin.
+    :type mbp: float
+    :param collapse: Count all bins into one, without a row per bin
+    :type collapse: bool
+    :returns: Data
+    """
+    region_lst = genome_regions(genome_ref_file, mbp, include_x)
+    return generators.length_matrix_data(
+        bam_file, region_lst, max_length, mapq, collapse=collapse
+    )
+
+
+def length_seq_data(
+    genome_ref_file,
+    bam_file,
+    mbp=None,
+    collapse=False,
+    include_x=False,
+    max_length=500,
+    flank=1,
+    mapq=20,
+):
+    """Count the fragment lengths and end sequences of a sample in bins of
+    the genome. The genome reference is also used for the end sequences.
+
+    :param genome_ref_file: File path to a .2bit file
+    :type genome_ref_file: str
+    :param bam_file: File path to the bam sample file or a fragment store
+    :type bam_file: str
+    :param mbp: Bin size in Mbp. If None, each chromosome is a bin.
+    :type mbp: float
+    :param collapse: Count all bins into one, without a row per bin
+    :type collapse: bool
+    :returns: Data
+    """
+    region_lst = genome_regions(genome_ref_file, mbp, include_x)
+    return generators.length_end_seqs_data(
+        bam_file,
+        region_lst,
+        genome_ref_file,
+        max_length,
+        flank,
+        mapq,
+        collapse=collapse,
+    )
+
+
+def write_length_output(
+    data, output_file, pickle_output=False, min_length=None, max_length=None
+):
+    """Write length data to a tsv file, or to a data file if pickle_output
+
+    :param data: The length data
+    :type data: Data
+    :param output_file: Output file
+    :type output_file: str
+    :param pickle_output: Write a data file instead of a tsv file
+    :type pickle_output: bool
+    """
+    if pickle_output:
+        logger.info("Exporting to .pickle file")
+        Data.write(data, output_file)
+    else:
+        manipulations.write_tsv_length(data, output_file, min_length, max_length)
@@ -1,14 +1,21 @@
-from .length_matrix import length_matrix
-from .length_end_seqs import length_end_seqs
+from .length_matrix import length_matrix, length_matrix_data
+from .length_end_seqs import length_end_seqs, length_end_seqs_data
 from .length_end_seqs_marginal import length_end_seqs_marginal
 from .mate_length_end_seqs import mate_length_end_seqs
+from .fragment_store import extract_fragments, FragmentStore
 from .bam import BAM
+from .cohort import generate_cohort
 
 
 __all__ = [
     "length_matrix",
+    "length_matrix_data",
     "length_end_seqs",
+    "length_end_seqs_data",
     "length_end_seqs_marginal",
     "mate_length_end_seqs",
+    "extract_fragments",
+    "FragmentStore",
     "BAM",
+    "generate_cohort",
 ]
@@ -4,10 +4,37 @@
 import pysam
 import os
 import attr
+import heapq
 import logging
+import numpy as np
+from itertools import islice
+from time import perf_counter
+
+from ..telemetry import SLOWEST_REGIONS
 
 logger = logging.getLogger()
 
+# Column layout of the fragment batches yielded by BAM.pair_batches. The
+# forward_end and reverse_start columns are the inner ends of the two reads,
+# which decide whether both reads of a fragment overlap a region.
+FRAGMENT_DTYPE = np.dtype(
+    [
+        ("start", np.int32),
+        ("end", np.int32),
+        ("length", np.int32),
+        ("start_is_first", np.bool_),
+        ("chrom_id", np.int32),
+        ("forward_end", np.int32),
+        ("reverse_start", np.int32),
+    ]
+)
+BATCH_SIZE = 65536
+# Number of reads fetched at a time, which the fetch time is measured over
+FETCH_BLOCK = 4096
+INDEX_SUFFIXES = (".bai", ".csi", ".crai")
+# Positions beyond 2^29 - 1 can not be indexed by a .bai index
+BAI_MAX_LENGTH = 536870911
+
 
 @attr.s
 class ReadPair:
@@ -26,6 +53,56 @@ class Report:
     paired_reads = attr.ib(default=0)
     paired_reads_passed_qual_check = attr.ib(default=0)
     paired_reads_yielded = attr.ib(default=0)
+    orphan_reads = attr.ib(default=0)
+    evicted_reads = attr.ib(default=0)
+    # Telemetry, which is neither compared nor stored with the counters
+    fetch_seconds = attr.ib(default=0.0, eq=False)
+    pair_seconds = attr.ib(default=0.0, eq=False)
+    count_seconds = attr.ib(default=0.0, eq=False)
+    slowest_regions = attr.ib(factory=list, eq=False)
+    peak_rss = attr.ib(default=0, eq=False)
+    bytes_read = attr.ib(default=0, eq=False)
+
+    def merge(self, other):
+        """Add the counters of another report, collected from the same file,
+        to this report"""
+        for field in attr.fields(Report):
+            if field.name in ("file_name", "slowest_regions"):
+                continue
+            if field.name == "peak_rss":
+                self.peak_rss = max(self.peak_rss, other.peak_rss)
+            else:
+                value = getattr(self, field.name) + getattr(other, field.name)
+                setattr(self, field.name, value)
+        for region in other.slowest_regions:
+            self._keep_slowest(region)
+        return self
+
+    def __setstate__(self, state):
+        """Restore a pickled report, giving the fields added since it was
+        pickled their defaults"""
+        for field in attr.fields(Report):
+            if field.name not in state:
+                default = field.default
+                if isinstance(default, attr.Factory):
+                    default = default.factory()
+                state[field.name] = default
+        self.__dict__.update(state)
+
+    def counters(self):
+        """Return the read counters as a dict, without the telemetry"""
+        return attr.asdict(self, filter=lambda field, _: field.eq)
+
+    def add_region_time(self, region_id, seconds, fragments):
+        """Add the time spent on a region, keeping only the slowest regions"""
+        self._keep_slowest((seconds, region_id, fragments))
+
+    def _keep_slowest(self, region):
+        region = tuple(region)
+        if len(self.slowest_regions) < SLOWEST_REGIONS:
+            heapq.heappush(self.slowest_regions, region)
+        elif region > self.slowest_regions[0]:
+            heapq.heapreplace(self.slowest_regions, region)
 
     def __str__(self):
         return "\n".join(
@@ -37,8 +114,10 @@ class Report:
                 "Reads paired:{3: >34}",
                 "Paired reads passed quality check:{4: >13}",
                 "Paired reads emmitted:{5: >25}",
+                "Orphan reads:{6: >34}",
+                "Unpaired reads evicted:{7: >24}",
                 "",
-                "bam file: {6}",
+                "bam file: {8}",
             ]
         ).format(
             "BAM Report:",
@@ -47,28 +126,122 @@ class Report:
             self.paired_reads,
             self.paired_reads_passed_qual_check,
             self.paired_reads_yielded,
+            self.orphan_reads,
+            self.evicted_reads,
             self.file_name,
         )
 
 
+def is_cram(filename):
+    return filename.endswith(".cram")
+
+
+def find_index(filename):
+    """Return the path of the .bai, .csi or .crai index of the alignment file,
+    named either <file>.bai or with the extension replaced, or None"""
+    for suffix in INDEX_SUFFIXES:
+        for index_filename in (
+            filename + suffix,
+            os.path.splitext(filename)[0] + suffix,
+        ):
+            if os.path.exists(index_filename):
+                return index_filename
+    return None
+
+
+def ensure_index(filename, threads=1):
+    """Check if an index exists for the bam or cram file, if not create an
+    index file using the given number of threads. A .csi index is created
+    for bam files with contigs too long for a .bai index."""
+    index_filename = find_index(filename)
+    if index_filename is None:
+        logger.warning(f"No index file found for {filename}, generating...")
+        args = ["-@", str(threads)]
+        if not is_cram(filename) and _has_long_contigs(filename):
+            args.append("-c")
+        pysam.index(*args, filename)
+        index_filename = find_index(filename)
+    return index_filename
+
+
+def _has_long_contigs(filename):
+    with pysam.AlignmentFile(filename, "rb", require_index=False) as fp:
+        return max(fp.lengths, default=0) > BAI_MAX_LENGTH
+
+
 class BAM:
-    def __init__(self, filename):
-        bai_filename = f"{filename}.bai"
+    def __init__(self, filename, threads=1, cram_reference=None):
+        """Open a bam or cram file for pairing reads.
 
-        # Check if index exists, if not create an index file
-        if not os.path.exists(bai_filename):
-            logger.warning(f"No index file found ({bai_filename}), generating...")
-            pysam.index(filename)
+        :param filename: File path to the bam or cram file
+        :type filename: str
+        :param threads: Number of threads used for BGZF decompression
+        :type threads: int > 0
+        :param cram_reference: File path to the fasta reference of a cram file
+        :type cram_reference: str
+        """
+        index_filename = ensure_index(filename, threads)
 
-        self.bam_file = pysam.AlignmentFile(filename, "rb")
+        self.bam_file = pysam.AlignmentFile(
+            filename,
+            "rc" if is_cram(filename) else "rb",
+            index_filename=index_filename,
+            reference_filename=cram_reference,
+            threads=threads,
+        )
         self.report = Report(filename)
 
     def pair_generator(self, chrom, region_start, region_end, mapq=20):
+        """Yield a ReadPair for each fragment fetched from the region, which
+        pass the quality checks"""
+        for start, end, length, start_is_first, *_ in self._fragments(
+            chrom, region_start, region_end, mapq
+        ):
+            yield ReadPair(chrom, start, end, start_is_first, length)
+
+    def pair_batches(
+        self, chrom, region_start, region_end, mapq=20, batch_size=BATCH_SIZE
+    ):
+        """Yield the fragments fetched from the region, which pass the quality
+        checks, as structured arrays of at most batch_size fragments with the
+        columns of FRAGMENT_DTYPE. The chrom_id column is the reference id of
+        the chromosome in the bam header.
+
+        This avoids creating a ReadPair per fragment, so the fragments of a
+        batch can be counted with array operations.
+        """
+        fragments = self._fragments(chrom, region_start, region_end, mapq)
+        while True:
+            # The time spent pairing is the time spent building the batch,
+            # minus the time spent fetching reads for it
+            start = perf_counter()
+            fetch_seconds = self.report.fetch_seconds
+            batch = list(islice(fragments, batch_size))
+            if batch:
+                batch = np.array(batch, dtype=FRAGMENT_DTYPE)
+            self.report.pair_seconds += (
+                perf_counter() - start - (self.report.fetch_seconds - fetch_seconds)
+            )
+            if len(batch) == 0:
+                return
+            yield batch
+
+    def _fragments(self, chrom, region_start, region_end, mapq):
+        """Yield (start, end, length, start_is_first, chrom_id, forward_end,
+        reverse_start) of the read pairs fetched from the region, which pass
+        the quality checks.
+
+        Reads are fetched in coordinate order, so an unpaired read is kept in
+        memory only until the scan passes the expected position of its mate.
+        Reads whose mate is unmapped, on another chromosome or already passed
+        are counted as orphans, and reads whose mate never showed up are
+        counted as evicted. Memory use is thereby bounded by the fragment
+        lengths, not by the size of the region.
+        """
         mem = {}
+        expected_mates = []
 
-        for read in self.bam_file.fetch(
-            contig=chrom, start=region_start, stop=region_end
-        ):
+        for read in self._fetch(chrom, region_start, region_end):
             self.report.fetched_reads += 1
             if (
                 read.is_duplicate
@@ -81,13 +254,27 @@ class BAM:
             query_name = read.query_name
             self.report.reads_passed_qual_check += 1
 
+            while expected_mates and expected_mates[0][0] < read.reference_start:
+                _, expected_name = heapq.heappop(expected_mates)
+                if expected_name in mem:
+                    del mem[expected_name]
+                    self.report.evicted_reads += 1
+
             if query_name not in mem:
+                if (
+                    read.mate_is_unmapped
+                    or read.next_reference_id != read.reference_id
+                    or read.next_reference_start < read.reference_start
+                ):
+                    self.report.orphan_reads += 1
+                    continue
                 mem[query_name] = (
                     read.reference_start,
                     read.reference_end,
                     read.is_reverse,
                     read.is_read1,
                 )
+                heapq.heappush(expected_mates, (read.next_reference_start, query_name))
             else:
                 mem_start, mem_end, mem_reverse, mem_is_read1 = mem[query_name]
                 del mem[query_name]
@@ -105,19 +292,43 @@ class BAM:
                     start = mem_start
                     end = read.reference_end
                     start_is_first = mem_is_read1
+                    forward_end = mem_end
+                    reverse_start = read.reference_start
                 else:
                     start = read.reference_start
                     end = mem_end
                     start_is_first = not mem_is_read1
+                    forward_end = read.reference_end
+                    reverse_start = mem_start
                 length = abs(read.template_length)
 
                 if start >= end or length == 0:
                     continue
                 self.report.paired_reads_yielded += 2
-                yield ReadPair(
-                    read.reference_name, int(start), int(end), start_is_first, length
+                yield (
+                    start,
+                    end,
+                    length,
+                    start_is_first,
+                    read.reference_id,
+                    forward_end,
+                    reverse_start,
                 )
 
+        self.report.evicted_reads += len(mem)
+
+    def _fetch(self, chrom, region_start, region_end):
+        """Yield the reads of the region, fetched a block at a time to
+        measure the time spent fetching"""
+        reads = self.bam_file.fetch(contig=chrom, start=region_start, stop=region_end)
+        while True:
+            start = perf_counter()
+            block = list(islice(reads, FETCH_BLOCK))
+            self.report.fetch_seconds += perf_counter() - start
+            if not block:
+                return
+            yield from block
+
     def __str__(self):
         return str(self.report)
 
@@ -0,0 +1,126 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os
+import json
+import attr
+import shutil
+import hashlib
+import logging
+
+from .parallel import split_chromosome_runs, split_regions
+from ..container import ContainerReader, ContainerWriter, is_complete
+from ..container import read_values, write_values
+from ..data import report_from_dict, report_to_dict
+
+logger = logging.getLogger()
+
+# Number of regions per checkpointed block, if not given
+CHECKPOINT_REGIONS = 1000
+MANIFEST = "checkpoint.json"
+
+
+@attr.s
+class Checkpoint:
+    """Counts the regions in blocks and keeps each completed block, with its
+    report, in a file of the checkpoint directory. When resuming, the blocks
+    already in the directory are read instead of counted again, so the result
+    is the same as that of an uninterrupted run.
+
+    The directory records the counting function, its arguments and the
+    regions, and resuming from a directory written by another run is an error.
+    """
+
+    directory = attr.ib()
+    block_size = attr.ib(default=None)
+    resume = attr.ib(default=False)
+
+    @staticmethod
+    def for_output(output_file, block_size=None, resume=False):
+        """The checkpoint of an output file, kept in the directory
+        output_file.checkpoint, or None if neither a block size nor resume is
+        given"""
+        if not block_size and not resume:
+            return None
+        return Checkpoint(f"{output_file}.checkpoint", block_size or None, resume)
+
+    def map(self, count_func, region_lst, workers=1, sweep=False):
+        """Apply count_func to blocks of the region list, like
+        map_region_chunks, and return the results of the blocks in region
+        order"""
+        manifest = self._prepare(count_func, region_lst)
+        block_size = manifest["block_size"]
+        n_blocks = -(-len(region_lst) // block_size)
+        if sweep:
+            blocks = split_chromosome_runs(region_lst, n_blocks)
+        else:
+            blocks = split_regions(region_lst, n_blocks)
+
+        todo = [i for i in range(len(blocks)) if not is_complete(self._block_file(i))]
+        if len(todo) < len(blocks):
+            first_region = sum(len(block) for block in blocks[: todo[0]]) if todo else 0
+            logger.info(
+                f"Resuming from {self.directory}, {len(blocks) - len(todo)} of "
+                f"{len(blocks)} blocks are done, starting at region {first_region}"
+            )
+        if workers <= 1:
+            for i in todo:
+                self._write_block(i, *count_func(blocks[i]))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(count_func, blocks[i]): i for i in todo}
+                for future in as_completed(futures):
+                    self._write_block(futures[future], *future.result())
+        return [self._read_block(i) for i in range(len(blocks))]
+
+    def remove(self):
+        """Remove the checkpoint directory, once the output is written"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _prepare(self, count_func, region_lst):
+        manifest_file = os.path.join(self.directory, MANIFEST)
+        run = _fingerprint(count_func, region_lst)
+        if self.resume and os.path.exists(manifest_file):
+            with open(manifest_file) as fp:
+                manifest = json.load(fp)
+            if manifest["run"] != run:
+                raise ValueError(
+                    f"The checkpoint in {self.directory} is from another run"
+                )
+            if self.block_size and self.block_size != manifest["block_size"]:
+                logger.warning(
+                    f"Resuming with the block size {manifest['block_size']} "
+                    f"of the checkpoint"
+                )
+            return manifest
+
+        self.remove()
+        os.makedirs(self.directory)
+        manifest = {"run": run, "block_size": self.block_size or CHECKPOINT_REGIONS}
+        with open(manifest_file, "w") as fp:
+            json.dump(manifest, fp)
+        return manifest
+
+    def _block_file(self, i):
+        return os.path.join(self.directory, f"block_{i:06d}")
+
+    def _write_block(self, i, values, report):
+        with ContainerWriter(self._block_file(i), "Block") as writer:
+            writer.meta["values"] = write_values(writer, values, "")
+            writer.meta["report"] = report_to_dict(report)
+
+    def _read_block(self, i):
+        with ContainerReader(self._block_file(i)) as reader:
+            values = read_values(reader, reader.meta["values"], "")
+            return values, report_from_dict(reader.meta["report"])
+
+
+def _fingerprint(count_func, region_lst):
+    """Describe a run by its counting function, arguments and regions"""
+    regions = hashlib.sha1()
+    for region in region_lst:
+        regions.update(f"{region.chrom}\t{region.start}\t{region.end}\n".encode())
+    return {
+        "function": count_func.func.__name__,
+        "args": [repr(arg) for arg in count_func.args],
+        "keywords": {key: repr(value) for key, value in count_func.keywords.items()},
+        "regions": regions.hexdigest(),
+    }
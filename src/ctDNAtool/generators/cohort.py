@@ -0,0 +1,178 @@
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import os
+import logging
+
+from .bed import load_bed_file
+from .length_matrix import length_matrix_data
+from .length_end_seqs import length_end_seqs_data
+from ..container import is_complete
+from ..data import Data
+from ..manipulations.combine_data import combine_data
+
+logger = logging.getLogger()
+
+GENERATORS = ("length", "length-end-seq")
+# Number of samples queued per worker, bounding the number of pending tasks
+TASKS_PER_WORKER = 2
+
+
+def generate_cohort(
+    bam_files,
+    bed_file,
+    output_dir,
+    generator="length",
+    ref_genome_file=None,
+    max_length=500,
+    flank=1,
+    mapq=20,
+    workers=1,
+    sweep=False,
+    threads=1,
+    cram_reference=None,
+    combined_file=None,
+):
+    """Run a generator on each sample of a cohort and write a data file per
+    sample, named by the sample id, to the output directory.
+
+    The bed file is read once. The samples are counted by a pool of worker
+    processes, which write their own output files, so writing overlaps with
+    the counting of the other samples. Samples whose output file is complete
+    are skipped, so an interrupted run can be started again. A sample is
+    written to a temporary file, which is renamed when it is complete.
+
+    If combined_file is given, the samples are combined into it with
+    combine_data when all samples are done.
+
+    :param bam_files: List of bam sample files or fragment stores
+    :type bam_files: List[str]
+    :param bed_file: File path to the bed file
+    :type bed_file: str
+    :param output_dir: Directory of the output files
+    :type output_dir: str
+    :param generator: The generator to run, one of GENERATORS
+    :type generator: str
+    :param ref_genome_file: File path to the 2bit reference genome, needed
+                            for the end sequences
+    :type ref_genome_file: str
+    :param workers: Number of samples counted at the same time
+    :type workers: int > 0
+    :param combined_file: File path to a combined data file of all samples
+    :type combined_file: str
+    :returns: List of the output files, in the order of the bam files
+    """
+    if generator not in GENERATORS:
+        raise ValueError(f"generator must be one of {', '.join(GENERATORS)}")
+    if generator == "length-end-seq" and ref_genome_file is None:
+        raise ValueError(f"The {generator} generator needs a reference genome")
+
+    output_files = [
+        os.path.join(output_dir, f"{sample_id(bam_file)}.pickle")
+        for bam_file in bam_files
+    ]
+    if len(set(output_files)) < len(output_files):
+        raise ValueError("The sample ids of the bam files are not unique")
+    os.makedirs(output_dir, exist_ok=True)
+
+    tasks = [
+        (bam_file, output_file)
+        for bam_file, output_file in zip(bam_files, output_files)
+        if not is_complete(output_file)
+    ]
+    logger.info(
+        f"Generating {len(tasks)} of {len(bam_files)} samples, "
+        f"{len(bam_files) - len(tasks)} are already complete"
+    )
+    options = dict(
+        generator=generator,
+        region_lst=load_bed_file(bed_file),
+        ref_genome_file=ref_genome_file,
+        max_length=max_length,
+        flank=flank,
+        mapq=mapq,
+        sweep=sweep,
+        threads=threads,
+        cram_reference=cram_reference,
+    )
+    failed = _run_tasks(tasks, options, workers)
+    if failed:
+        raise RuntimeError(
+            f"{len(failed)} of {len(tasks)} samples failed: {', '.join(failed)}"
+        )
+
+    if combined_file is not None:
+        combine_data(combined_file, output_files)
+    return output_files
+
+
+def sample_id(file_path):
+    """The sample id of a file, its file name up to the first dot, as used by
+    combine_data"""
+    return os.path.basename(file_path).split(".")[0]
+
+
+def _run_tasks(tasks, options, workers):
+    """Run the tasks in at most workers processes, with a bounded number of
+    tasks queued, and return the bam files that failed"""
+    failed = list()
+    tasks = iter(tasks)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = dict()
+        while True:
+            while len(pending) < workers * TASKS_PER_WORKER:
+                task = next(tasks, None)
+                if task is None:
+                    break
+                future = executor.submit(_generate_sample, *task, **options)
+                pending[future] = task[0]
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                bam_file = pending.pop(future)
+                try:
+                    logger.info(f"Wrote {future.result()}")
+                except Exception:
+                    logger.exception(f"Generating {bam_file} failed")
+                    failed.append(bam_file)
+    return failed
+
+
+def _generate_sample(
+    bam_file,
+    output_file,
+    generator,
+    region_lst,
+    ref_genome_file,
+    max_length,
+    flank,
+    mapq,
+    sweep,
+    threads,
+    cram_reference,
+):
+    if generator == "length":
+        data = length_matrix_data(
+            bam_file,
+            region_lst,
+            max_length,
+            mapq,
+            sweep=sweep,
+            threads=threads,
+            cram_reference=cram_reference,
+        )
+    else:
+        data = length_end_seqs_data(
+            bam_file,
+            region_lst,
+            ref_genome_file,
+            max_length,
+            flank,
+            mapq,
+            sweep=sweep,
+            threads=threads,
+            cram_reference=cram_reference,
+        )
+    tmp_file = f"{output_file}.tmp"
+    Data.write(data, tmp_file)
+    os.replace(tmp_file, output_file)
+    return output_file
@@ -0,0 +1,252 @@
+import os
+import json
+import attr
+import logging
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from time import perf_counter
+
+from .bam import BAM, Report, BATCH_SIZE, FRAGMENT_DTYPE, ensure_index
+from ..telemetry import add_report
+
+logger = logging.getLogger()
+
+STORE_VERSION = 2
+METADATA_FILE = "metadata.json"
+# On-disk layout of the fragments of a chromosome, sorted by start position.
+# Bit 0 of flags is set when the fragment start came from the first mate.
+# Stores of version 1 lack the forward_end and reverse_start columns.
+STORE_DTYPE = np.dtype(
+    [
+        ("start", "<i4"),
+        ("end", "<i4"),
+        ("length", "<u2"),
+        ("flags", "u1"),
+        ("forward_end", "<i4"),
+        ("reverse_start", "<i4"),
+    ]
+)
+START_IS_FIRST = 1
+MAX_STORED_LENGTH = np.iinfo(np.uint16).max
+
+
+def is_fragment_store(path):
+    return os.path.isfile(os.path.join(path, METADATA_FILE))
+
+
+def open_fragments(path, threads=1, cram_reference=None):
+    """Open a fragment store or a bam/cram file as a source of fragments.
+    Both provide pair_batches and a report"""
+    if is_fragment_store(path):
+        return FragmentStore(path)
+    return BAM(path, threads, cram_reference)
+
+
+class FragmentStore:
+    """Read access to the fragments extracted from a bam file by
+    extract_fragments.
+
+    The store is a directory holding one memory-mapped .npy file per
+    chromosome and a metadata.json with the mapq used for the extraction and
+    the Report of the bam file. Since the quality filtering happened at
+    extraction, only the same mapq can be requested.
+
+    Like a region fetched from the bam file, a region yields the fragments
+    whose two reads both overlap it. Stores of version 1 do not hold the
+    inner ends of the reads, so they yield every fragment overlapping the
+    region, as a single sweep over the bam file does.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, METADATA_FILE)) as fp:
+            self.metadata = json.load(fp)
+        if self.metadata["version"] > STORE_VERSION:
+            raise ValueError(
+                f"Fragment store {path} has version {self.metadata['version']}, "
+                f"only versions up to {STORE_VERSION} are supported"
+            )
+        self.mapq = self.metadata["mapq"]
+        self.chroms = self.metadata["chromosomes"]
+        self.chrom_ids = {chrom: i for i, chrom in enumerate(self.chroms)}
+        self.bam_report = Report(**self.metadata["report"])
+        # Counts the fragments read from the store
+        self.report = Report(path)
+        self.has_mates = self.metadata["version"] >= 2
+        if not self.has_mates:
+            logger.warning(
+                f"Fragment store {path} has version {self.metadata['version']}, "
+                f"so fragments are counted in every region they overlap, as with "
+                f"a single sweep. Extract it again to count like the bam file."
+            )
+        self._fragments = dict()
+
+    def fragments(self, chrom):
+        """Return the memory-mapped fragments of the chromosome"""
+        if chrom not in self._fragments:
+            chrom_id = self.chrom_ids[chrom]
+            file_path = os.path.join(self.path, f"{chrom_id}.npy")
+            if os.path.exists(file_path):
+                self._fragments[chrom] = np.load(file_path, mmap_mode="r")
+            else:
+                self._fragments[chrom] = np.empty(0, dtype=STORE_DTYPE)
+        return self._fragments[chrom]
+
+    def pair_batches(
+        self, chrom, region_start, region_end, mapq=20, batch_size=BATCH_SIZE
+    ):
+        """Yield the fragments of the region as batches with the columns of
+        FRAGMENT_DTYPE, like BAM.pair_batches"""
+        if mapq != self.mapq:
+            raise ValueError(
+                f"Fragment store {self.path} was extracted with map quality "
+                f"{self.mapq}, but map quality {mapq} was requested"
+            )
+        fragments = self.fragments(chrom)
+        max_span = self.metadata["max_span"].get(chrom, 0)
+        if region_start is None:
+            region_start = 0
+        lo = np.searchsorted(fragments["start"], region_start - max_span, "left")
+        if region_end is None:
+            hi = len(fragments)
+        else:
+            hi = np.searchsorted(fragments["start"], region_end, "left")
+        chrom_id = self.chrom_ids[chrom]
+        for batch_start in range(lo, hi, batch_size):
+            start = perf_counter()
+            stored = fragments[batch_start : min(batch_start + batch_size, hi)]
+            overlaps = stored["end"] > region_start
+            if self.has_mates:
+                # Both reads must overlap the region, as in a region fetch
+                overlaps &= stored["forward_end"] > region_start
+                if region_end is not None:
+                    overlaps &= stored["reverse_start"] < region_end
+            stored = stored[overlaps]
+            if len(stored) == 0:
+                continue
+            batch = np.empty(len(stored), dtype=FRAGMENT_DTYPE)
+            batch["start"] = stored["start"]
+            batch["end"] = stored["end"]
+            batch["length"] = stored["length"]
+            batch["start_is_first"] = (stored["flags"] & START_IS_FIRST) != 0
+            batch["chrom_id"] = chrom_id
+            if self.has_mates:
+                batch["forward_end"] = stored["forward_end"]
+                batch["reverse_start"] = stored["reverse_start"]
+            else:
+                batch["forward_end"] = stored["end"]
+                batch["reverse_start"] = stored["start"]
+            self.report.paired_reads_yielded += 2 * len(batch)
+            self.report.fetch_seconds += perf_counter() - start
+            yield batch
+
+    def extraction_report(self, report):
+        """Return the report of the extraction, with the read counters of the
+        bam file, and the telemetry of a report of reads from the store
+
+        :param report: Report of fragments read from the store
+        :type report: Report
+        """
+        result = Report(**self.metadata["report"])
+        for field in attr.fields(Report):
+            if not field.eq:
+                setattr(result, field.name, getattr(report, field.name))
+        return result
+
+    def __str__(self):
+        return str(self.bam_report)
+
+
+def extract_fragments(
+    bam_file, output_dir, mapq=20, workers=1, threads=1, cram_reference=None
+):
+    """Extract the fragments of a bam file, passing the quality checks, to a
+    fragment store, which can be given to the generators in place of the bam
+    file. Fragments are stored per chromosome, sorted by start position, with
+    int32 start and end, uint16 length (saturated at 65535), a flag byte and
+    the int32 inner ends of the forward and reverse reads.
+
+    :param bam_file: File path to the bam sample file
+    :type bam_file: str
+    :param output_dir: Directory path of the fragment store
+    :type output_dir: str
+    :param mapq: map quality. Ignores all reads below the threshold.
+    :type mapq: Int
+    :param workers: Number of processes the chromosomes are split across
+    :type workers: int > 0
+    :param threads: Number of decompression threads per process
+    :type threads: int > 0
+    :param cram_reference: File path to the fasta reference of a cram file
+    :type cram_reference: str
+    :returns:  None
+    """
+    ensure_index(bam_file, threads)
+    os.makedirs(output_dir, exist_ok=True)
+    if is_fragment_store(output_dir):
+        os.remove(os.path.join(output_dir, METADATA_FILE))
+    bam = BAM(bam_file, cram_reference=cram_reference)
+    chroms = list(bam.bam_file.references)
+    mapped_chroms = [
+        stats.contig for stats in bam.bam_file.get_index_statistics() if stats.mapped
+    ]
+    extract_func = partial(
+        _extract_chromosome,
+        bam_file,
+        output_dir,
+        chroms,
+        mapq=mapq,
+        threads=threads,
+        cram_reference=cram_reference,
+    )
+    if workers <= 1:
+        results = list(map(extract_func, mapped_chroms))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(extract_func, mapped_chroms))
+
+    report = Report(bam_file)
+    max_span = dict()
+    n_fragments = dict()
+    for chrom, chrom_report, chrom_max_span, chrom_n_fragments in results:
+        report.merge(chrom_report)
+        max_span[chrom] = chrom_max_span
+        n_fragments[chrom] = chrom_n_fragments
+    add_report(report)
+    metadata = {
+        "version": STORE_VERSION,
+        "bam_file": bam_file,
+        "mapq": mapq,
+        "chromosomes": chroms,
+        "n_fragments": n_fragments,
+        "max_span": max_span,
+        "report": report.counters(),
+    }
+    # The metadata is written last, so an interrupted extraction is not
+    # mistaken for a store
+    with open(os.path.join(output_dir, METADATA_FILE), "w") as fp:
+        json.dump(metadata, fp, indent=2)
+    logger.info(str(report))
+
+
+def _extract_chromosome(
+    bam_file, output_dir, chroms, chrom, mapq, threads, cram_reference
+):
+    logger.info(f"Extracting fragments from {chrom}")
+    bam = BAM(bam_file, threads, cram_reference)
+    batches = list(bam.pair_batches(chrom, None, None, mapq))
+    fragments = np.concatenate(batches) if batches else np.empty(0, FRAGMENT_DTYPE)
+    fragments = fragments[np.argsort(fragments["start"], kind="stable")]
+
+    stored = np.empty(len(fragments), dtype=STORE_DTYPE)
+    stored["start"] = fragments["start"]
+    stored["end"] = fragments["end"]
+    stored["length"] = np.minimum(fragments["length"], MAX_STORED_LENGTH)
+    stored["flags"] = np.where(fragments["start_is_first"], START_IS_FIRST, 0)
+    stored["forward_end"] = fragments["forward_end"]
+    stored["reverse_start"] = fragments["reverse_start"]
+    np.save(os.path.join(output_dir, f"{chroms.index(chrom)}.npy"), stored)
+
+    spans = fragments["end"] - fragments["start"]
+    max_span = int(spans.max()) if len(spans) else 0
+    return chrom, bam.report, max_span, len(stored)
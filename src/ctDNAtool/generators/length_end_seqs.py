@@ -1,18 +1,34 @@
 import numpy as np
-from scipy.sparse import dok_matrix, csr_matrix
 import logging
+from functools import partial
 
 from .bed import load_bed_file
-from .bam import BAM
-from .utils import seq_to_index, fetch_seq
+from .fragment_store import open_fragments
+from .parallel import map_region_chunks, merge_reports
+from .regions import region_batches
+from .reference import ReferenceCache
+from .sparse_counts import SparseCounter
+from .utils import countable_fragments
 from ..data import Data
-from ..py2bit_context import Py2bitContext
+from ..kmers import encode_kmers
+from ..manipulations.region_sum import sparse_sum
 
 logger = logging.getLogger()
 
 
 def length_end_seqs(
-    bam_file, bed_file, ref_genome_file, output_file, max_length=500, flank=1, mapq=20
+    bam_file,
+    bed_file,
+    ref_genome_file,
+    output_file,
+    max_length=500,
+    flank=1,
+    mapq=20,
+    workers=1,
+    sweep=False,
+    threads=1,
+    cram_reference=None,
+    checkpoint=None,
 ):
     """Create a tensor where the first dim. represents a region from the bed file,
     the second dim. represent read lengths from 1 to max_length and the third dim.
@@ -20,7 +36,7 @@ def length_end_seqs(
     from the reference genome, endcoded as an index. Then length of an end sequence
     is 2 times the flank parameter.
 
-    :param bam_file: File path to the bam sample file
+    :param bam_file: File path to the bam sample file or a fragment store
     :type bam_file: str
     :param bed_file: File path to the bed file, which can be compiled by the preprocessing function
     :type bed_file: str
@@ -34,30 +50,124 @@ def length_end_seqs(
     type flank: Int
     :param mapq: map quality. Ignores all reads below the threshold.
     :type mapq: Int
+    :param workers: Number of processes the regions are split across
+    :type workers: int > 0
+    :param sweep: Read each chromosome once and assign the fragments to all
+                  regions they overlap, instead of fetching each region
+    :type sweep: bool
+    :param threads: Number of decompression threads per process
+    :type threads: int > 0
+    :param cram_reference: File path to the fasta reference of a cram file
+    :type cram_reference: str
+    :param checkpoint: Keep the counted regions in blocks, to resume from
+    :type checkpoint: Checkpoint
     :returns:  None
     """
-    region_lst = load_bed_file(bed_file)
-    bam = BAM(bam_file)
-    id_lst = list()
-    tensor = np.empty((len(region_lst),), dtype=np.object)
+    data = length_end_seqs_data(
+        bam_file,
+        load_bed_file(bed_file),
+        ref_genome_file,
+        max_length,
+        flank,
+        mapq,
+        workers,
+        sweep,
+        threads,
+        cram_reference,
+        checkpoint=checkpoint,
+    )
+    Data.write(data, output_file)
+    if checkpoint is not None:
+        checkpoint.remove()
+
+
+def length_end_seqs_data(
+    bam_file,
+    region_lst,
+    ref_genome_file,
+    max_length=500,
+    flank=1,
+    mapq=20,
+    workers=1,
+    sweep=False,
+    threads=1,
+    cram_reference=None,
+    collapse=False,
+    checkpoint=None,
+):
+    """Count the read lengths and end sequences of the given regions like
+    length_end_seqs, and return the tensor as a Data object instead of
+    writing it.
+
+    With collapse all regions are counted into one matrix, the same as
+    summing the regions of the tensor with region_sum.
+
+    :param bam_file: File path to the bam sample file or a fragment store
+    :type bam_file: str
+    :param region_lst: The regions to count
+    :type region_lst: List[BED]
+    :param ref_genome_file: File path to the reference genome given as a 2bit file.
+    :type ref_genome_file: str
+    :param collapse: Count all regions into one matrix
+    :type collapse: bool
+    :param checkpoint: Keep the counted regions in blocks, to resume from
+    :type checkpoint: Checkpoint
+    :returns: Data
+    """
+    count_func = partial(
+        _length_end_seqs_chunk,
+        bam_file,
+        ref_genome_file=ref_genome_file,
+        collapse=collapse,
+        max_length=max_length,
+        flank=flank,
+        mapq=mapq,
+        sweep=sweep,
+        threads=threads,
+        cram_reference=cram_reference,
+    )
+    results = map_region_chunks(
+        count_func, bam_file, region_lst, workers, sweep, threads, checkpoint
+    )
+    tensor = np.concatenate([chunk_tensor for chunk_tensor, _ in results])
+    report = merge_reports((chunk_report for _, chunk_report in results), bam_file)
+    logger.info(str(report))
+    if collapse:
+        return Data(sparse_sum(tensor), ["region_sum"], report)
+    id_lst = [region.region_id for region in region_lst]
+    return Data(tensor, id_lst, report)
+
+
+def _length_end_seqs_chunk(
+    bam_file,
+    region_lst,
+    ref_genome_file,
+    max_length,
+    flank,
+    mapq,
+    sweep,
+    threads,
+    cram_reference,
+    collapse,
+):
+    bam = open_fragments(bam_file, threads, cram_reference)
     N_seqs = 4 ** (4 * flank) + 1  # the last bin is for sequences containing N
+    n_rows = 1 if collapse else len(region_lst)
+    counter = SparseCounter((n_rows, max_length, N_seqs))
 
-    with Py2bitContext(ref_genome_file) as tb:
-        chroms_lengths = tb.chroms()
-        for i, region in enumerate(region_lst):
-            matrix = dok_matrix((max_length, N_seqs), dtype=np.uint32)
-            for read in bam.pair_generator(
-                region.chrom, region.start, region.end, mapq
-            ):
-                length = read.length
-                if (
-                    length <= max_length
-                    and chroms_lengths[region.chrom] >= (read.end + flank)
-                    and 0 <= (read.start - flank)
-                ):
-                    seq = fetch_seq(tb, region.chrom, read.start, read.end, flank)
-                    matrix[length - 1, seq_to_index(seq)] += 1
-            tensor[i] = csr_matrix(matrix)
-            id_lst.append(region.region_id)
-        logger.info(str(bam))
-        Data.write(Data(tensor, id_lst, bam.report), output_file)
+    with ReferenceCache(ref_genome_file) as reference:
+        for region_index, batch in region_batches(bam, region_lst, mapq, sweep):
+            if len(batch) == 0:
+                continue
+            chrom, region_index, batch = countable_fragments(
+                reference, region_lst, region_index, batch, max_length, flank
+            )
+            motifs = reference.end_motifs(chrom, batch["start"], batch["end"], flank)
+            if collapse:
+                region_index = np.zeros_like(region_index)
+            counter.add(
+                region_index,
+                batch["length"] - 1,
+                encode_kmers(motifs, n_index=N_seqs - 1),
+            )
+    return counter.to_csr_list(), bam.report
@@ -1,26 +1,48 @@
 import numpy as np
 import logging
+from functools import partial
 
 from .bed import load_bed_file
-from .bam import BAM
-from .utils import fetch_seq
+from .fragment_store import open_fragments
+from .parallel import map_region_chunks, merge_reports
+from .regions import region_batches
+from .reference import ReferenceCache
+from .sparse_counts import SparseCounter
+from .utils import countable_fragments
 from ..data import Data
-from ..py2bit_context import Py2bitContext
+from ..kmers import NUCLEOTIDES, n_mask
 
 logger = logging.getLogger()
 
 base_pair_offset = {"A": 0, "T": 1, "C": 2, "G": 3}
+# Offset of each nucleotide code within the four columns of a position
+code_to_offset = np.array([base_pair_offset[base_pair] for base_pair in NUCLEOTIDES])
 
 
 def length_end_seqs_marginal(
-    bam_file, bed_file, ref_genome_file, output_file, max_length=500, flank=3, mapq=20
+    bam_file,
+    bed_file,
+    ref_genome_file,
+    output_file,
+    max_length=500,
+    flank=3,
+    mapq=20,
+    workers=1,
+    sweep=False,
+    threads=1,
+    cram_reference=None,
+    dense=False,
+    checkpoint=None,
 ):
     """Create a tensor where the first dim. represents a region from the bed file,
     the second dim. represent read lengths from 1 to max_length and the third dim.
     represents the the marginal end sequence count at the fragment ends, taken
     from the reference genome.
 
-    :param bam_file: File path to the bam sample file
+    The tensor is stored as an array with a sparse matrix per region, as most
+    cells are zero, unless dense is given.
+
+    :param bam_file: File path to the bam sample file or a fragment store
     :type bam_file: str
     :param bed_file: File path to the bed file, which can be compiled by the preprocessing function
     :type bed_file: str
@@ -34,48 +56,86 @@ def length_end_seqs_marginal(
     type flank: Int
     :param mapq: map quality. Ignores all reads below the threshold.
     :type mapq: Int
+    :param workers: Number of processes the regions are split across
+    :type workers: int > 0
+    :param sweep: Read each chromosome once and assign the fragments to all
+                  regions they overlap, instead of fetching each region
+    :type sweep: bool
+    :param threads: Number of decompression threads per process
+    :type threads: int > 0
+    :param cram_reference: File path to the fasta reference of a cram file
+    :type cram_reference: str
+    :param dense: Whether to store the tensor as a dense 3-dimensional array
+    :type dense: bool
+    :param checkpoint: Keep the counted regions in blocks, to resume from
+    :type checkpoint: Checkpoint
     :returns:  None
     """
     region_lst = load_bed_file(bed_file)
-    bam = BAM(bam_file)
-    id_lst = list()
-    flanks_size = flank * 2 * 2 * 4
-    tensor = np.zeros((len(region_lst), max_length, flanks_size), dtype=np.uint32)
-
-    with Py2bitContext(ref_genome_file) as tb:
-        chromosome_lengths = tb.chroms()
-        for region_index, region in enumerate(region_lst):
-            id_lst.append(region.region_id)
-            for read in bam.pair_generator(
-                region.chrom, region.start, region.end, mapq
-            ):
-                length = read.length
-                if (
-                    length <= max_length
-                    and chromosome_lengths[region.chrom] >= (read.end + flank)
-                    and 0 <= (read.start - flank)
-                ):
-                    seq = fetch_seq(tb, region.chrom, read.start, read.end, flank)
-                    if "N" in seq:
-                        continue
+    count_func = partial(
+        _length_end_seqs_marginal_chunk,
+        bam_file,
+        ref_genome_file=ref_genome_file,
+        max_length=max_length,
+        flank=flank,
+        mapq=mapq,
+        sweep=sweep,
+        threads=threads,
+        cram_reference=cram_reference,
+    )
+    results = map_region_chunks(
+        count_func, bam_file, region_lst, workers, sweep, threads, checkpoint
+    )
+    tensor = np.concatenate([chunk_tensor for chunk_tensor, _ in results])
+    if dense:
+        tensor = np.array([matrix.toarray() for matrix in tensor], dtype=np.uint32)
+    report = merge_reports((chunk_report for _, chunk_report in results), bam_file)
+    id_lst = [region.region_id for region in region_lst]
+    Data.write(Data(tensor, id_lst, report), output_file)
+    if checkpoint is not None:
+        checkpoint.remove()
 
-                    _read_sequence_to_tensor(length, region_index, seq, tensor)
-                    _log_current_position(length, region_index, seq, tensor)
 
-        Data.write(Data(tensor, id_lst, bam.report), output_file)
+def _length_end_seqs_marginal_chunk(
+    bam_file,
+    region_lst,
+    ref_genome_file,
+    max_length,
+    flank,
+    mapq,
+    sweep,
+    threads,
+    cram_reference,
+):
+    bam = open_fragments(bam_file, threads, cram_reference)
+    flanks_size = flank * 2 * 2 * 4
+    counter = SparseCounter((len(region_lst), max_length, flanks_size))
 
+    with ReferenceCache(ref_genome_file) as reference:
+        for region_index, batch in region_batches(bam, region_lst, mapq, sweep):
+            if len(batch) == 0:
+                continue
+            chrom, region_index, batch = countable_fragments(
+                reference, region_lst, region_index, batch, max_length, flank
+            )
+            motifs = reference.end_motifs(chrom, batch["start"], batch["end"], flank)
+            without_n = ~n_mask(motifs)
+            _read_sequences_to_tensor(
+                batch["length"][without_n],
+                region_index[without_n],
+                motifs[without_n],
+                counter,
+            )
 
-def _read_sequence_to_tensor(length, region_index, seq, tensor):
-    for bp_index, base_pair in enumerate(seq):
-        offset = bp_index * 4 + base_pair_offset[base_pair]
-        tensor[region_index][length - 1][offset] += 1
+    return counter.to_csr_list(), bam.report
 
 
-def _log_current_position(length, region_index, seq, tensor):
-    logger.debug(f"region index {region_index}")
-    logger.debug(f"length {length}")
-    logger.debug(
-        f"shape of tensor at region and size {tensor[region_index][length - 1].shape}"
+def _read_sequences_to_tensor(lengths, region_indices, motifs, counter):
+    n, seq_length = motifs.shape
+    offsets = np.arange(seq_length) * 4 + code_to_offset[motifs]
+    counter.add(
+        np.repeat(region_indices, seq_length),
+        np.repeat(lengths - 1, seq_length),
+        offsets.ravel(),
     )
-    logger.debug(f"content {tensor[region_index][length - 1]}")
-    logger.debug(f"sequence {seq}")
+    logger.debug(f"Added {n} end sequences to the tensor")
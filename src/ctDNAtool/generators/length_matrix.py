@@ -1,15 +1,28 @@
 import numpy as np
-import math
 import logging
+from functools import partial
 
-from .bam import BAM
+from .fragment_store import open_fragments
 from .bed import load_bed_file
+from .parallel import map_region_chunks, merge_reports
+from .regions import region_batches
 from ..data import Data
 
 logger = logging.getLogger()
 
 
-def length_matrix(bam_file, bed_file, output_file, max_length=500, mapq=20):
+def length_matrix(
+    bam_file,
+    bed_file,
+    output_file,
+    max_length=500,
+    mapq=20,
+    workers=1,
+    sweep=False,
+    threads=1,
+    cram_reference=None,
+    checkpoint=None,
+):
     """Creates a matrix where each row represents a region from the bed file
     and the columns are read lengths from 1 to max_length.
     The size of the matrix is (n x max_length) where n is the number of regions
@@ -18,7 +31,7 @@ def length_matrix(bam_file, bed_file, output_file, max_length=500, mapq=20):
     with length j.
     Only reads that meet the minimum map quality is generated.
 
-    :param bam_file: File path to the bam sample file
+    :param bam_file: File path to the bam sample file or a fragment store
     :type bam_file: str
     :param bed_file: File path to the bed file, which can be compiled by the preprocessing function
     :type bed_file: str
@@ -28,28 +41,100 @@ def length_matrix(bam_file, bed_file, output_file, max_length=500, mapq=20):
     :type max_length: int > 0
     param mapq: map quality. Ignores all reads below the threshold.
     type mapq: Int
+    :param workers: Number of processes the regions are split across
+    :type workers: int > 0
+    :param sweep: Read each chromosome once and assign the fragments to all
+                  regions they overlap, instead of fetching each region
+    :type sweep: bool
+    :param threads: Number of decompression threads per process
+    :type threads: int > 0
+    :param cram_reference: File path to the fasta reference of a cram file
+    :type cram_reference: str
+    :param checkpoint: Keep the counted regions in blocks, to resume from
+    :type checkpoint: Checkpoint
     :returns:  None
     """
-    region_lst = load_bed_file(bed_file)
-    matrix = np.zeros((len(region_lst), max_length), dtype=np.uint32)
-    bam = BAM(bam_file)
-    id_lst = list()
-    for i, region in enumerate(region_lst):
-        log_progress(i, region_lst)
-        for read in bam.pair_generator(region.chrom, region.start, region.end, mapq):
-            length = read.length
-            if length <= max_length:
-                matrix[i, length - 1] += 1
-        id_lst.append(region.region_id)
-    logger.info(str(bam))
-    Data.write(Data(matrix, id_lst, bam.report), output_file)
-
-
-def log_progress(i, region_lst):
-    percentage_steps = 10
-    if i % (int(len(region_lst) / percentage_steps)) == 0:
-        percentage = (i / len(region_lst)) * 100
-        percentage_rounded = int(
-            math.ceil(percentage / percentage_steps) * percentage_steps
-        )
-        logger.info("Creating length matrix {}%".format(percentage_rounded))
+    data = length_matrix_data(
+        bam_file,
+        load_bed_file(bed_file),
+        max_length,
+        mapq,
+        workers,
+        sweep,
+        threads,
+        cram_reference,
+        checkpoint=checkpoint,
+    )
+    Data.write(data, output_file)
+    if checkpoint is not None:
+        checkpoint.remove()
+
+
+def length_matrix_data(
+    bam_file,
+    region_lst,
+    max_length=500,
+    mapq=20,
+    workers=1,
+    sweep=False,
+    threads=1,
+    cram_reference=None,
+    collapse=False,
+    checkpoint=None,
+):
+    """Count the read lengths of the given regions like length_matrix, and
+    return the matrix as a Data object instead of writing it.
+
+    With collapse the lengths of all regions are counted into one histogram,
+    the same as summing the regions of the matrix with region_sum, without
+    allocating a row per region.
+
+    :param bam_file: File path to the bam sample file or a fragment store
+    :type bam_file: str
+    :param region_lst: The regions to count
+    :type region_lst: List[BED]
+    :param collapse: Count all regions into one histogram
+    :type collapse: bool
+    :param checkpoint: Keep the counted regions in blocks, to resume from
+    :type checkpoint: Checkpoint
+    :returns: Data
+    """
+    count_func = partial(
+        _length_matrix_chunk,
+        bam_file,
+        max_length=max_length,
+        collapse=collapse,
+        mapq=mapq,
+        sweep=sweep,
+        threads=threads,
+        cram_reference=cram_reference,
+    )
+    results = map_region_chunks(
+        count_func, bam_file, region_lst, workers, sweep, threads, checkpoint
+    )
+    report = merge_reports((chunk_report for _, chunk_report in results), bam_file)
+    logger.info(str(report))
+    if collapse:
+        matrix = np.sum([chunk_matrix[0] for chunk_matrix, _ in results], axis=0)
+        return Data(matrix.astype(np.uint64), ["region_sum"], report)
+    matrix = np.concatenate([chunk_matrix for chunk_matrix, _ in results])
+    id_lst = [region.region_id for region in region_lst]
+    return Data(matrix, id_lst, report)
+
+
+def _length_matrix_chunk(
+    bam_file, region_lst, max_length, mapq, sweep, threads, cram_reference, collapse
+):
+    n_rows = 1 if collapse else len(region_lst)
+    matrix = np.zeros((n_rows, max_length), dtype=np.uint32)
+    bam = open_fragments(bam_file, threads, cram_reference)
+    for region_index, batch in region_batches(bam, region_lst, mapq, sweep):
+        lengths = batch["length"]
+        counted = lengths <= max_length
+        if collapse:
+            matrix[0] += np.bincount(lengths[counted] - 1, minlength=max_length).astype(
+                np.uint32
+            )
+        else:
+            np.add.at(matrix, (region_index[counted], lengths[counted] - 1), 1)
+    return matrix, bam.report
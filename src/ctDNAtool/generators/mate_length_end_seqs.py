@@ -1,17 +1,32 @@
 import numpy as np
-import py2bit
 import logging
+from functools import partial
 
 from .bed import load_bed_file
-from .bam import BAM
-from .utils import seq_to_index, fetch_seqs
+from .fragment_store import open_fragments
+from .parallel import map_region_chunks, merge_reports
+from .regions import region_batches
+from .reference import ReferenceCache
+from .utils import countable_fragments
 from ..data import Data
+from ..kmers import encode_kmers
 
 logger = logging.getLogger()
 
 
 def mate_length_end_seqs(
-    bam_file, bed_file, ref_genome_file, output_file, max_length=500, flank=1, mapq=20
+    bam_file,
+    bed_file,
+    ref_genome_file,
+    output_file,
+    max_length=500,
+    flank=1,
+    mapq=20,
+    workers=1,
+    sweep=False,
+    threads=1,
+    cram_reference=None,
+    checkpoint=None,
 ):
     """Create a tensor where the first dim. represents a whether a read came from
     the first or the second mate, the second dim. represent read lengths from 0 to
@@ -19,7 +34,7 @@ def mate_length_end_seqs(
     at the fragment ends, taken from the reference genome, endcoded as an index.
     Then length of an end sequence is 2 times the flank parameter.
 
-    :param bam_file: File path to the bam sample file
+    :param bam_file: File path to the bam sample file or a fragment store
     :type bam_file: str
     :param bed_file: File path to the bed file, which can be compiled by the preprocessing function
     :type bed_file: str
@@ -33,33 +48,72 @@ def mate_length_end_seqs(
     type flank: Int
     param mapq: map quality. Ignores all reads below the threshold.
     type mapq: Int
+    :param workers: Number of processes the regions are split across
+    :type workers: int > 0
+    :param sweep: Read each chromosome once and assign the fragments to all
+                  regions they overlap, instead of fetching each region
+    :type sweep: bool
+    :param threads: Number of decompression threads per process
+    :type threads: int > 0
+    :param cram_reference: File path to the fasta reference of a cram file
+    :type cram_reference: str
+    :param checkpoint: Keep the counted regions in blocks, to resume from
+    :type checkpoint: Checkpoint
     :returns:  None
     """
     region_lst = load_bed_file(bed_file)
-    bam = BAM(bam_file)
     id_lst = ["first_mate", "second_mate"]
+    count_func = partial(
+        _mate_length_end_seqs_chunk,
+        bam_file,
+        ref_genome_file=ref_genome_file,
+        max_length=max_length,
+        flank=flank,
+        mapq=mapq,
+        sweep=sweep,
+        threads=threads,
+        cram_reference=cram_reference,
+    )
+    results = map_region_chunks(
+        count_func, bam_file, region_lst, workers, sweep, threads, checkpoint
+    )
+    T = sum(chunk_T for chunk_T, _ in results)
+    report = merge_reports((chunk_report for _, chunk_report in results), bam_file)
+    logger.info(str(report))
+    Data.write(Data(T, id_lst, report), output_file)
+    if checkpoint is not None:
+        checkpoint.remove()
+
+
+def _mate_length_end_seqs_chunk(
+    bam_file,
+    region_lst,
+    ref_genome_file,
+    max_length,
+    flank,
+    mapq,
+    sweep,
+    threads,
+    cram_reference,
+):
+    bam = open_fragments(bam_file, threads, cram_reference)
     N_seqs = 4 ** (2 * flank) + 1  # the last bin is for sequences containing N
     T = np.zeros((2, max_length, N_seqs), dtype=np.uint32)
-    try:
-        tb = py2bit.open(ref_genome_file)
-        chroms_lengths = tb.chroms()
-        for i, region in enumerate(region_lst):
-            for read in bam.pair_generator(
-                region.chrom, region.start, region.end, mapq
-            ):
-                length = read.length
-                if (
-                    length <= max_length
-                    and chroms_lengths[region.chrom] >= (read.end + flank)
-                    and 0 <= (read.start - flank)
-                ):
-                    start_seq, end_seq = fetch_seqs(
-                        tb, region.chrom, read.start, read.end, flank
-                    )
-                    start_mate, end_mate = (0, 1) if read.start_is_first else (1, 0)
-                    T[start_mate, length - 1, seq_to_index(start_seq)] += 1
-                    T[end_mate, length - 1, seq_to_index(end_seq)] += 1
-        logger.info(str(bam))
-        Data.write(Data(T, id_lst, bam.report), output_file)
-    finally:
-        tb.close()
+    with ReferenceCache(ref_genome_file) as reference:
+        for region_index, batch in region_batches(bam, region_lst, mapq, sweep):
+            if len(batch) == 0:
+                continue
+            chrom, region_index, batch = countable_fragments(
+                reference, region_lst, region_index, batch, max_length, flank
+            )
+            motifs = reference.end_motifs(chrom, batch["start"], batch["end"], flank)
+            start_mate = np.where(batch["start_is_first"], 0, 1)
+            end_mate = 1 - start_mate
+            length_index = batch["length"] - 1
+            np.add.at(
+                T, (start_mate, length_index, encode_kmers(motifs[:, : 2 * flank])), 1
+            )
+            np.add.at(
+                T, (end_mate, length_index, encode_kmers(motifs[:, 2 * flank :])), 1
+            )
+    return T, bam.report
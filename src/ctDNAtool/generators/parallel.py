@@ -0,0 +1,103 @@
+from concurrent.futures import ProcessPoolExecutor
+import logging
+
+from .bam import ensure_index
+from .fragment_store import FragmentStore, is_fragment_store
+from .regions import chromosome_runs
+from ..telemetry import add_report, stage
+
+logger = logging.getLogger()
+
+CHUNKS_PER_WORKER = 4
+
+
+def split_regions(region_lst, n_chunks):
+    """Split the region list into at most n_chunks contiguous chunks of
+    (close to) equal size, preserving the order of the regions"""
+    n_chunks = max(1, min(n_chunks, len(region_lst)))
+    chunk_size, remainder = divmod(len(region_lst), n_chunks)
+    chunks = list()
+    start = 0
+    for i in range(n_chunks):
+        end = start + chunk_size + (1 if i < remainder else 0)
+        chunks.append(region_lst[start:end])
+        start = end
+    return chunks
+
+
+def split_chromosome_runs(region_lst, n_chunks):
+    """Split the region list into at most n_chunks contiguous chunks without
+    splitting a run of regions on the same chromosome, so that each chromosome
+    is only swept by one worker"""
+    runs = chromosome_runs(region_lst)
+    chunk_size = len(region_lst) / max(1, min(n_chunks, len(runs)))
+    chunks = list()
+    for run in runs:
+        if chunks and len(chunks[-1]) + len(run) / 2 <= chunk_size:
+            chunks[-1] += run
+        else:
+            chunks.append(list(run))
+    return chunks
+
+
+def map_region_chunks(
+    count_func, bam_file, region_lst, workers=1, sweep=False, threads=1, checkpoint=None
+):
+    """Apply count_func to contiguous chunks of the region list and return
+    the results in region order.
+
+    count_func is called as count_func(region_chunk) and must be picklable
+    when workers > 1. Each worker process is expected to open its own handle
+    to the bam file, so the bam file is indexed up front to avoid the workers
+    racing to create the index.
+
+    :param count_func: Function counting the fragments of a list of regions
+    :type count_func: Callable
+    :param bam_file: File path to the bam sample file or a fragment store
+    :type bam_file: str
+    :param region_lst: List of regions
+    :type region_lst: List[BED]
+    :param workers: Number of worker processes, 1 runs in the current process
+    :type workers: int > 0
+    :param sweep: Whether the chunks should keep chromosomes together
+    :type sweep: bool
+    :param threads: Number of threads used if the bam file must be indexed
+    :type threads: int > 0
+    :param checkpoint: Count the regions in blocks kept by the checkpoint
+    :type checkpoint: Checkpoint
+    :returns: List of the results of count_func, one per chunk
+    """
+    with stage("count"):
+        if workers > 1 and not is_fragment_store(bam_file):
+            ensure_index(bam_file, threads)
+        if checkpoint is not None:
+            return checkpoint.map(count_func, region_lst, workers, sweep)
+        if workers <= 1:
+            return [count_func(region_lst)]
+        if sweep:
+            chunks = split_chromosome_runs(region_lst, workers * CHUNKS_PER_WORKER)
+        else:
+            chunks = split_regions(region_lst, workers * CHUNKS_PER_WORKER)
+        logger.info(f"Counting {len(region_lst)} regions in {len(chunks)} chunks")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(count_func, chunks))
+
+
+def merge_reports(reports, bam_file=None):
+    """Merge the reports of the chunks into one report. If the fragments were
+    read from a fragment store, the report of its extraction is returned
+    instead, with the read counters and file name of the bam file.
+
+    :param reports: Reports of the chunks
+    :type reports: Iterable[Report]
+    :param bam_file: File path to the bam sample file or a fragment store
+    :type bam_file: str
+    """
+    reports = iter(reports)
+    report = next(reports)
+    for other in reports:
+        report.merge(other)
+    if bam_file is not None and is_fragment_store(bam_file):
+        report = FragmentStore(bam_file).extraction_report(report)
+    add_report(report)
+    return report
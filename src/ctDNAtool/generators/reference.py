@@ -0,0 +1,70 @@
+from collections import OrderedDict
+import logging
+import numpy as np
+import py2bit
+
+from ..kmers import ASCII_TO_CODE
+
+logger = logging.getLogger()
+
+LOAD_BLOCK_SIZE = 1 << 24
+
+
+class ReferenceCache:
+    """Reference genome from a 2bit file, where chromosomes are loaded on
+    demand as arrays of nucleotide codes, so the end sequences of a whole
+    batch of fragments can be looked up by fancy indexing.
+
+    Only the max_chroms most recently used chromosomes are kept in memory, as
+    the regions are usually processed one chromosome at a time.
+    """
+
+    def __init__(self, ref_genome_file, max_chroms=1):
+        self.tb = py2bit.open(ref_genome_file)
+        self.chroms_lengths = self.tb.chroms()
+        self.max_chroms = max_chroms
+        self._codes = OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._codes.clear()
+        self.tb.close()
+
+    def codes(self, chrom):
+        """Return the chromosome as an array of nucleotide codes"""
+        if chrom in self._codes:
+            self._codes.move_to_end(chrom)
+            return self._codes[chrom]
+        while len(self._codes) >= self.max_chroms:
+            self._codes.popitem(last=False)
+        length = self.chroms_lengths[chrom]
+        logger.debug(f"Loading {chrom} ({length} bp) from the reference genome")
+        codes = np.empty(length, dtype=np.uint8)
+        for start in range(0, length, LOAD_BLOCK_SIZE):
+            end = min(start + LOAD_BLOCK_SIZE, length)
+            seq = self.tb.sequence(chrom, start, end).encode("ascii")
+            codes[start:end] = ASCII_TO_CODE[np.frombuffer(seq, dtype=np.uint8)]
+        self._codes[chrom] = codes
+        return codes
+
+    def in_bounds(self, chrom, starts, ends, flank):
+        """Return a mask of the fragments whose end sequences lie within the
+        chromosome"""
+        return (starts - flank >= 0) & (ends + flank <= self.chroms_lengths[chrom])
+
+    def end_motifs(self, chrom, starts, ends, flank):
+        """Return the sequences of flank base pairs on each side of the
+        fragment starts and ends, as an array of shape (n, 4 * flank) of
+        nucleotide codes. The first 2 * flank columns are the start sequence
+        and the last 2 * flank columns the end sequence. All fragments must
+        be in bounds."""
+        offsets = np.arange(-flank, flank)
+        positions = np.concatenate(
+            (starts[:, None] + offsets, ends[:, None] + offsets), axis=1
+        )
+        return self.codes(chrom)[positions]
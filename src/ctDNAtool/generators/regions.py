@@ -0,0 +1,159 @@
+import numpy as np
+import math
+import logging
+from time import perf_counter
+
+from .bam import BATCH_SIZE
+from ..telemetry import bytes_read, peak_rss
+
+logger = logging.getLogger()
+
+# Fragments of up to this length are paired, even when one of the reads lies
+# outside the window spanned by the regions of a chromosome
+SWEEP_PADDING = 1000
+
+
+class RegionIndex:
+    """Sorted interval index over a list of regions, used to find every
+    region a fragment overlaps.
+
+    Regions are grouped by chromosome and sorted by start position. Together
+    with the running maximum of the end positions, this bounds the candidate
+    regions of a fragment by two binary searches, also when regions overlap
+    or are nested.
+    """
+
+    def __init__(self, region_lst):
+        by_chrom = dict()
+        for i, region in enumerate(region_lst):
+            by_chrom.setdefault(region.chrom, list()).append(
+                (region.start, region.end, i)
+            )
+        self.chroms = list(by_chrom.keys())
+        self.index = dict()
+        for chrom, intervals in by_chrom.items():
+            starts, ends, ids = np.array(sorted(intervals), dtype=np.int64).T
+            max_ends = np.maximum.accumulate(ends)
+            self.index[chrom] = (starts, ends, ids, max_ends)
+
+    def span(self, chrom, padding=0):
+        """Return the smallest window covering all regions of the chromosome,
+        extended by padding in both ends"""
+        starts, _, _, max_ends = self.index[chrom]
+        return max(0, int(starts[0]) - padding), int(max_ends[-1]) + padding
+
+    def overlapping(self, chrom, start, end):
+        """Return the indices of the regions overlapping [start, end)"""
+        _, region_ids = self.overlapping_batch(
+            chrom, np.array([start]), np.array([end])
+        )
+        return region_ids.tolist()
+
+    def overlapping_batch(self, chrom, starts, ends):
+        """Find all overlaps between the intervals [starts, ends) and the
+        regions of the chromosome.
+
+        :returns: Pair of arrays with the interval index and the region index
+                  of each overlap
+        """
+        region_starts, region_ends, region_ids, max_ends = self.index[chrom]
+        hi = np.searchsorted(region_starts, ends, side="left")
+        lo = np.searchsorted(max_ends, starts, side="right")
+        n_candidates = np.maximum(hi - lo, 0)
+        interval_index = np.repeat(np.arange(len(starts)), n_candidates)
+        offsets = np.arange(len(interval_index)) - np.repeat(
+            np.cumsum(n_candidates) - n_candidates, n_candidates
+        )
+        candidates = np.repeat(lo, n_candidates) + offsets
+        overlaps = region_ends[candidates] > starts[interval_index]
+        return interval_index[overlaps], region_ids[candidates[overlaps]]
+
+
+def region_batches(bam, region_lst, mapq=20, sweep=False, batch_size=BATCH_SIZE):
+    """Yield pairs of a region index array and a fragment batch, with the
+    columns of FRAGMENT_DTYPE, for the regions of the list. The region index
+    array holds the index into region_lst of each fragment in the batch.
+
+    By default the bam file is fetched once per region, and a fragment is
+    counted in a region when both of its reads are fetched for the region.
+    With sweep, each chromosome is read once in coordinate order over the
+    window spanned by its regions, and every fragment is dispatched to all
+    regions it overlaps. The sweep also pairs reads whose mate lies outside
+    a region, so counts can differ slightly from the per-region mode.
+
+    :param bam: Opened bam file
+    :type bam: BAM
+    :param region_lst: List of regions
+    :type region_lst: List[BED]
+    :param mapq: map quality. Ignores all reads below the threshold.
+    :type mapq: Int
+    :param sweep: Whether to read each chromosome once instead of once per region
+    :type sweep: bool
+    :param batch_size: Maximum number of fragments read from the bam file per batch
+    :type batch_size: int > 0
+    """
+    # The time spent by the caller on the batches is added to the count time
+    # of the report, and the time of each region, or of each chromosome when
+    # sweeping, is kept for the slowest regions
+    report = bam.report
+    start_bytes_read = bytes_read()
+    try:
+        if not sweep:
+            for i, region in enumerate(region_lst):
+                log_progress(i, region_lst)
+                region_start = perf_counter()
+                n_fragments = 0
+                for batch in bam.pair_batches(
+                    region.chrom, region.start, region.end, mapq, batch_size
+                ):
+                    n_fragments += len(batch)
+                    count_start = perf_counter()
+                    yield np.full(len(batch), i), batch
+                    report.count_seconds += perf_counter() - count_start
+                report.add_region_time(
+                    region.region_id, perf_counter() - region_start, n_fragments
+                )
+            return
+
+        region_index = RegionIndex(region_lst)
+        for chrom in region_index.chroms:
+            start, end = region_index.span(chrom, SWEEP_PADDING)
+            logger.info(f"Sweeping {chrom}:{start}-{end}")
+            chrom_start = perf_counter()
+            n_fragments = 0
+            for batch in bam.pair_batches(chrom, start, end, mapq, batch_size):
+                fragment_index, region_ids = region_index.overlapping_batch(
+                    chrom, batch["start"], batch["end"]
+                )
+                n_fragments += len(batch)
+                count_start = perf_counter()
+                yield region_ids, batch[fragment_index]
+                report.count_seconds += perf_counter() - count_start
+            report.add_region_time(
+                f"{chrom}:{start}-{end}", perf_counter() - chrom_start, n_fragments
+            )
+    finally:
+        report.peak_rss = max(report.peak_rss, peak_rss())
+        report.bytes_read += bytes_read() - start_bytes_read
+
+
+def log_progress(i, region_lst):
+    percentage_steps = 10
+    if i % max(1, int(len(region_lst) / percentage_steps)) == 0:
+        percentage = (i / len(region_lst)) * 100
+        percentage_rounded = int(
+            math.ceil(percentage / percentage_steps) * percentage_steps
+        )
+        logger.info("Counting fragments {}%".format(percentage_rounded))
+
+
+def chromosome_runs(region_lst):
+    """Split the region list into runs of consecutive regions on the same
+    chromosome"""
+    runs = list()
+    for region in region_lst:
+        if runs and runs[-1][-1].chrom == region.chrom:
+            runs[-1].append(region)
+        else:
+            runs.append([region])
+    return runs
@@ -0,0 +1,69 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+
+# Number of pending increments collected before they are merged into the counts
+COMPACT_SIZE = 1 << 22
+
+
+class SparseCounter:
+    """Counts of a tensor of shape (regions, rows, columns), accumulated from
+    batches of cell indices and returned as one sparse matrix per region.
+
+    Each cell is encoded as a flat index into the tensor. Increments are
+    collected as arrays and merged into the sorted unique cells and their
+    counts once COMPACT_SIZE are pending, so memory grows with the number of
+    non-zero cells rather than with the tensor or the number of fragments.
+    """
+
+    def __init__(self, shape, dtype=np.uint32):
+        self.shape = shape
+        self.dtype = dtype
+        self.cells = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+        self._pending = list()
+        self._n_pending = 0
+
+    def add(self, region_index, rows, columns):
+        """Increment the cells given by the index arrays by one"""
+        _, n_rows, n_columns = self.shape
+        cells = (
+            np.asarray(region_index, dtype=np.int64) * n_rows
+            + np.asarray(rows, dtype=np.int64)
+        ) * n_columns + np.asarray(columns, dtype=np.int64)
+        self._pending.append(cells)
+        self._n_pending += len(cells)
+        if self._n_pending >= COMPACT_SIZE:
+            self._compact()
+
+    def _compact(self):
+        if not self._pending:
+            return
+        cells = np.concatenate([self.cells] + self._pending)
+        counts = np.concatenate([self.counts, np.ones(self._n_pending, dtype=np.int64)])
+        self.cells, inverse = np.unique(cells, return_inverse=True)
+        self.counts = np.bincount(
+            inverse.ravel(), weights=counts, minlength=len(self.cells)
+        ).astype(np.int64)
+        self._pending = list()
+        self._n_pending = 0
+
+    def to_csr_list(self):
+        """Return the counts as an object array with a csr_matrix of shape
+        (rows, columns) per region"""
+        self._compact()
+        n_regions, n_rows, n_columns = self.shape
+        region_size = n_rows * n_columns
+        bounds = np.searchsorted(
+            self.cells, np.arange(n_regions + 1, dtype=np.int64) * region_size
+        )
+        tensor = np.empty((n_regions,), dtype=object)
+        for i in range(n_regions):
+            cells = self.cells[bounds[i] : bounds[i + 1]] - i * region_size
+            tensor[i] = csr_matrix(
+                (
+                    self.counts[bounds[i] : bounds[i + 1]].astype(self.dtype),
+                    (cells // n_columns, cells % n_columns),
+                ),
+                shape=(n_rows, n_columns),
+            )
+        return tensor
@@ -1,23 +1,19 @@
-from functools import reduce
-from operator import add
-
-nucleotide_to_digit = {"A": "0", "T": "1", "G": "2", "C": "3"}
+from ..kmers import encode_kmers, seq_to_codes
 
 
 def seq_to_index(seq):
-    if "N" in seq:
-        return -1
-    else:
-        return int(reduce(add, map(nucleotide_to_digit.get, seq)), base=4)
-
+    """Encode a nucleotide string as its k-mer index, or -1 if it contains N"""
+    return int(encode_kmers(seq_to_codes(seq)[None])[0])
 
-def fetch_seq(tb, chrom, start, end, flank):
-    start_seq = tb.sequence(chrom, start - flank, start + flank)
-    end_seq = tb.sequence(chrom, end - flank, end + flank)
-    return (start_seq + end_seq).upper()
 
+def countable_fragments(reference, region_lst, region_index, batch, max_length, flank):
+    """Filter a batch of fragments from one chromosome to those not longer
+    than max_length, with end sequences inside the chromosome.
 
-def fetch_seqs(tb, chrom, start, end, flank):
-    start_seq = tb.sequence(chrom, start - flank, start + flank).upper()
-    end_seq = tb.sequence(chrom, end - flank, end + flank).upper()
-    return (start_seq, end_seq)
+    :returns: The chromosome name and the filtered region index and batch
+    """
+    chrom = region_lst[region_index[0]].chrom
+    counted = (batch["length"] <= max_length) & reference.in_bounds(
+        chrom, batch["start"], batch["end"], flank
+    )
+    return chrom, region_index[counted], batch[counted]
@@ -0,0 +1,67 @@
+import numpy as np
+
+# Nucleotides are encoded by their base 4 digit in the k-mer index, and
+# everything else, like N, as N_CODE
+NUCLEOTIDES = "ATGC"
+NUCLEOTIDE_CODES = {nucleotide: code for code, nucleotide in enumerate(NUCLEOTIDES)}
+N_CODE = 4
+
+
+def _ascii_to_code_table():
+    table = np.full(256, N_CODE, dtype=np.uint8)
+    for nucleotide, code in NUCLEOTIDE_CODES.items():
+        table[ord(nucleotide)] = code
+        table[ord(nucleotide.lower())] = code
+    return table
+
+
+ASCII_TO_CODE = _ascii_to_code_table()
+
+
+def seq_to_codes(seq):
+    """Convert a nucleotide string to an array of nucleotide codes"""
+    return ASCII_TO_CODE[np.frombuffer(seq.encode("ascii"), dtype=np.uint8)]
+
+
+def n_mask(codes):
+    """Return a mask of the k-mers, the rows of codes, containing N"""
+    return (np.asarray(codes) == N_CODE).any(axis=-1)
+
+
+def encode_kmers(codes, n_index=-1):
+    """Encode k-mers of nucleotide codes as indices, reading the codes as the
+    digits of a base 4 number with the first nucleotide as the most
+    significant digit. K-mers containing N are given n_index.
+
+    :param codes: Nucleotide codes with one k-mer per row
+    :type codes: numpy.ndarray of shape (n, k)
+    :param n_index: Index given to k-mers containing N
+    :type n_index: int
+    :returns: numpy.ndarray of shape (n,) with dtype int64
+    """
+    codes = np.asarray(codes)
+    k = codes.shape[-1]
+    digit_values = 4 ** np.arange(k - 1, -1, -1, dtype=np.int64)
+    index = codes.astype(np.int64) @ digit_values
+    index[n_mask(codes)] = n_index
+    return index
+
+
+def decode_kmers(indices, k):
+    """Decode k-mer indices to nucleotide codes, the inverse of encode_kmers.
+    Indices outside [0, 4**k) have no k-mer and must be masked beforehand.
+
+    :param indices: K-mer indices
+    :type indices: numpy.ndarray of shape (n,)
+    :param k: Length of the k-mers
+    :type k: int
+    :returns: numpy.ndarray of shape (n, k) with dtype uint8
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    digit_values = 4 ** np.arange(k - 1, -1, -1, dtype=np.int64)
+    return ((indices[:, None] // digit_values) % 4).astype(np.uint8)
+
+
+def codes_to_seq(codes):
+    """Convert an array of nucleotide codes to a nucleotide string"""
+    return "".join(np.array(list(NUCLEOTIDES + "N"))[codes])
@@ -1,10 +1,10 @@
 from .binning import binning, stride_binning
 from .pick_subset import pick_subset
 from .sample_sum import sample_sum
-from .region_sum import region_sum
-from .summaries import summaries
+from .region_sum import region_sum, sum_regions
+from .summaries import summaries, summaries_table
 from .summaries_data import summaries_data
-from .convert_to_tsv import convert_to_tsv_length
+from .convert_to_tsv import convert_to_tsv_length, write_tsv_length
 from .combine_data import combine_data
 from ..data import Data
 from ..combined_data import CombinedData
@@ -15,9 +15,12 @@ __all__ = [
     "sample_sum",
     "stride_binning",
     "region_sum",
+    "sum_regions",
     "summaries",
+    "summaries_table",
     "summaries_data",
     "convert_to_tsv_length",
+    "write_tsv_length",
     "combine_data",
     "Data",
     "CombinedData",
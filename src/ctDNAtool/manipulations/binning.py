@@ -1,7 +1,9 @@
 import math
 import numpy as np
 import logging
+from scipy.sparse import csr_matrix, issparse
 
+from .utils import sparse_elements
 from ..data import Data
 
 logger = logging.getLogger()
@@ -15,17 +17,76 @@ def calc_number_of_strides(n, bin_size, stride):
 
 
 def stride_binning(X, bin_size, stride):
-    n, m = X.shape
-    n_bins = calc_number_of_strides(n, bin_size, stride)
-    if (n - bin_size) % stride != 0:
-        logger.warning("last bin is smaller than the given bin size")
-    R = np.zeros((n_bins, m))
-    for i in range(n_bins):
-        start = i * stride
-        end = start + bin_size
-        R[i] = np.sum(
-            X[start:end], axis=0
-        )  # numpy caps indexing if end exceeds length of array
+    """Sum the rows of X in bins of bin_size rows, starting every stride
+    rows. Bins are computed as differences of the cumulative sum of the
+    rows, so the cost does not depend on the bin size. The bins are summed
+    in 64 bits of the kind of X, uint64, int64 or float64, so the sums of
+    many rows can not overflow. X can also be an array of sparse matrices,
+    which are binned as the rows of a tensor.
+    """
+    if len(X) and issparse(X[0]):
+        return _sparse_stride_binning(X, bin_size, stride)
+    n = X.shape[0]
+    starts, ends = _bin_bounds(n, bin_size, stride)
+    accumulator = _accumulator(X.dtype)
+    prefix_sums = np.zeros((n + 1,) + X.shape[1:], dtype=accumulator)
+    np.cumsum(X, axis=0, dtype=accumulator, out=prefix_sums[1:])
+    return prefix_sums[ends] - prefix_sums[starts]
+
+
+def _accumulator(dtype):
+    return {"f": np.float64, "u": np.uint64}.get(dtype.kind, np.int64)
+
+
+def _bin_bounds(n, bin_size, stride):
+    if n == 0:
+        n_bins = 0
+    elif bin_size > n:
+        # A bin size beyond the array gives one bin of the whole array
+        logger.warning("bin size is larger than the number of regions")
+        n_bins = 1
+    else:
+        n_bins = calc_number_of_strides(n, bin_size, stride)
+        if (n - bin_size) % stride != 0:
+            logger.warning("last bin is smaller than the given bin size")
+    starts = np.arange(n_bins) * stride
+    # The last bins are cut at the end of the array
+    ends = np.minimum(starts + bin_size, n)
+    return starts, ends
+
+
+def _sparse_stride_binning(X, bin_size, stride):
+    """Bin an array of sparse matrices by multiplying a sparse (bins, regions)
+    matrix of bin memberships with the matrices flattened to rows"""
+    n_rows, n_columns = X[0].shape
+    dtype = _accumulator(X[0].dtype)
+    starts, ends = _bin_bounds(len(X), bin_size, stride)
+    bin_lengths = ends - starts
+    # The regions of each bin are consecutive, so the membership matrix is
+    # given directly in csr form
+    membership = csr_matrix(
+        (
+            np.ones(bin_lengths.sum(), dtype=dtype),
+            np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)]),
+            np.concatenate(([0], np.cumsum(bin_lengths))),
+        ),
+        shape=(len(starts), len(X)),
+    )
+    regions, rows, columns, values = sparse_elements(X)
+    flattened = csr_matrix(
+        (values, (regions, rows * n_columns + columns)),
+        shape=(len(X), n_rows * n_columns),
+    )
+    binned = membership @ flattened
+    R = np.empty(len(starts), dtype=object)
+    for i in range(len(starts)):
+        elements = slice(binned.indptr[i], binned.indptr[i + 1])
+        bin_rows, bin_columns = np.divmod(binned.indices[elements], n_columns)
+        R[i] = csr_matrix(
+            (binned.data[elements], (bin_rows, bin_columns)),
+            shape=(n_rows, n_columns),
+            dtype=dtype,
+        )
     return R
 
 
@@ -36,7 +97,7 @@ def binning_update_ids(region_ids, stride, n_bins):
 def binning(sample_file, output_file, bin_size, stride):
     """This function will given a sample make an additive binning in the first axis.
     The binning is a sliding window where the bin size and a stride parameter
-    can be set.
+    can be set. The sample can be dense or an array of sparse matrices.
 
     :param sample_file: File path to the matrix/tensor
     :type sample_file:  str
@@ -47,7 +108,6 @@ def binning(sample_file, output_file, bin_size, stride):
     :param stride:      The step size of the sliding window
     :type stride:       Integer
     """
-    # TODO: Also implement for sparse tensors or ndarray containing scipy sparse matrices
     sample = Data.read(sample_file)
     R = stride_binning(sample.data, bin_size, stride)
     new_region_ids = binning_update_ids(sample.region_ids, stride, R.shape[0])
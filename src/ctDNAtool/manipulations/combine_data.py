@@ -1,5 +1,6 @@
-import numpy as np
+import os
 import logging
+import numpy as np
 
 from ..data import Data
 from ..combined_data import CombinedData
@@ -8,32 +9,58 @@ logger = logging.getLogger()
 
 
 def combine_data(output_file, pickle_files):
-    """Takes a collection of pickle files containing data and combines them into one .picke file"""
-    IDs = np.empty(len(pickle_files), dtype=object)
-    result = []
-
-    tmp_data = Data.read(pickle_files[0])
-    IDs[0] = _get_id_from_file_path(pickle_files[0])
-    region_ids = tmp_data.region_ids
-    data_shape = tmp_data.data.shape
-    is_sparse = tmp_data.is_sparse
-    result.append(tmp_data.data)
-
-    for index, file in enumerate(pickle_files[1:], 1):
-        logger.debug(f"Combining data from file {file}")
-
-        IDs[index] = _get_id_from_file_path(file)
-        tmp_data = Data.read(file)
-        result.append(tmp_data.data)
-
-        assert (
-            tmp_data.region_ids == region_ids
-        ), "Region IDs does not match for all samples"
-        assert tmp_data.data.shape == data_shape, "Shape of data does not match"
-        assert tmp_data.is_sparse == is_sparse, "Data is_sparse does not match"
-
-    combined_data = CombinedData(IDs, region_ids, np.array(result))
-    CombinedData.write(combined_data, output_file)
+    """Takes a collection of data files and combines them into one file.
+
+    The samples are read and validated one at a time and streamed into the
+    output file, so only one sample is held in memory. Dense samples are
+    stored uncompressed, so CombinedData.read can memory-map them, with the
+    dtype the dtypes of all samples promote to. The dtypes of container files
+    are read from their metadata up front. Legacy pickle files are only read
+    once, so when one of them needs a wider dtype, the samples already
+    written are copied to a wider array.
+    """
+    first_sample = Data.read(pickle_files[0])
+    region_ids = first_sample.region_ids
+    data_shape = first_sample.data.shape
+    is_sparse = first_sample.is_sparse
+    dtype = first_sample.dtype
+    if not is_sparse:
+        dtypes = [Data.read_dtype(file) for file in pickle_files[1:]]
+        dtype = np.result_type(dtype, *(t for t in dtypes if t is not None))
+
+    try:
+        with CombinedData.writer(
+            output_file,
+            len(pickle_files),
+            region_ids,
+            data_shape,
+            dtype,
+            is_sparse,
+        ) as writer:
+            for index, file in enumerate(pickle_files):
+                logger.debug(f"Combining data from file {file}")
+                tmp_data = first_sample if index == 0 else Data.read(file)
+
+                assert (
+                    tmp_data.region_ids == region_ids
+                ), f"Region IDs of {file} does not match the other samples"
+                assert (
+                    tmp_data.data.shape == data_shape
+                ), f"Shape of data in {file} does not match the other samples"
+                assert (
+                    tmp_data.is_sparse == is_sparse
+                ), f"Data is_sparse of {file} does not match the other samples"
+
+                if not is_sparse:
+                    dtype = np.result_type(dtype, tmp_data.dtype)
+                    writer.widen(dtype)
+                writer.add(_get_id_from_file_path(file), tmp_data.data)
+                # Release the sample before the next one is read
+                first_sample = tmp_data = None
+    except BaseException:
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        raise
     logger.debug(f"Data was combined into file {output_file}")
 
 
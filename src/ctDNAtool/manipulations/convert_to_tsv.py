@@ -1,53 +1,141 @@
+import gzip
+import pysam
+import numpy as np
 from ..data import Data
 import logging
-from ..utils import tsv_writer
 
 logger = logging.getLogger()
 
+COMPRESSIONS = ("gzip", "bgzip")
+# Number of cells formatted at a time
+TSV_CHUNK_CELLS = 1 << 18
 
-def convert_to_tsv_length(pickle_file, output_file, min_length=None, max_length=None):
+
+def convert_to_tsv_length(
+    pickle_file,
+    output_file,
+    min_length=None,
+    max_length=None,
+    compression=None,
+    long_format=False,
+):
     """This function takes a pickle file containing containing length data and writes the contents to a tsv file.
 
+    Rows are formatted a block at a time. In the long format each line holds
+    a region id, a length and a count, and zero counts are left out.
+
     param: pickle_file: Pickle file to convert.
     type: str
     param: output_file: Output file.
     type: str
     param: min_length: Determines the minimum length to include in output.
-    Must be positive.
+    Must be positive. Defaults to 1.
     type: int
     param: max_length: Determines the maximum length to include in output.
     Must be equal to or larger than min_length.
     type: int
+    param: compression: Compress the output with gzip or bgzip
+    type: str
+    param: long_format: Write one line per non-zero count
+    type: bool
     returns: None
     """
-    data = Data.read(pickle_file)
-    if data.data.ndim == 1:
-        data.data = [data.data]
+    write_tsv_length(
+        Data.read(pickle_file, mmap=True),
+        output_file,
+        min_length,
+        max_length,
+        compression,
+        long_format,
+    )
+
+
+def write_tsv_length(
+    data,
+    output_file,
+    min_length=None,
+    max_length=None,
+    compression=None,
+    long_format=False,
+):
+    """Write the length data of a Data object to a tsv file, like
+    convert_to_tsv_length does for a data file.
+
+    param: data: Length data to write.
+    type: Data
+    param: output_file: Output file.
+    type: str
+    returns: None
+    """
+    matrix = data.data
+    if matrix.ndim == 1:
+        matrix = matrix[None]
 
     if min_length is None:
-        min_length = 0
+        min_length = 1
 
     if max_length is None:
-        max_length = len(data.data[0])
+        max_length = matrix.shape[1]
 
-    assert max_length > min_length, "max_length should be higher than min_length"
-    assert len(data.data[0]) >= max_length, "max_length out of range"
+    assert min_length >= 1, "min_length should be positive"
+    assert max_length >= min_length, "max_length should not be lower than min_length"
+    assert matrix.shape[1] >= max_length, "max_length out of range"
 
-    with open(output_file, "w") as fp:
-        writer = tsv_writer(fp)
+    columns = matrix[:, min_length - 1 : max_length]
+    region_ids = np.asarray(data.region_ids[: len(matrix)]).astype(str)
+    chunk_rows = max(1, TSV_CHUNK_CELLS // columns.shape[1])
+    with _open_output(output_file, compression) as fp:
         logger.debug(f"Writing data to {output_file}")
+        if long_format:
+            fp.write(b"Region ID\tLength\tCount\n")
+        else:
+            lengths = generate_lengths(min_length, max_length)
+            fp.write("\t".join(["Region ID"] + lengths).encode() + b"\n")
+
+        for start in range(0, len(columns), chunk_rows):
+            block = np.asarray(columns[start : start + chunk_rows])
+            block_ids = region_ids[start : start + chunk_rows]
+            if long_format:
+                text = _format_long_block(block_ids, block, min_length)
+            else:
+                text = _format_block(block_ids, block)
+            fp.write(text.encode())
+
+
+def _format_block(region_ids, block):
+    if block.dtype.kind in "iub":
+        # printf-style formatting of Python ints is faster than astype(str)
+        row_format = "\t".join(["%d"] * block.shape[1]) + "\n"
+        return "".join(
+            region_id + "\t" + row_format % tuple(row)
+            for region_id, row in zip(region_ids.tolist(), block.tolist())
+        )
+    return "".join(
+        region_id + "\t" + "\t".join(row) + "\n"
+        for region_id, row in zip(region_ids.tolist(), block.astype(str).tolist())
+    )
 
-        lengths = generate_lengths(min_length, max_length)
-        writer.writerow(["Region ID"] + lengths)
 
-        for region_id, row in zip(data.region_ids, data.data):
-            row_from_range = _get_row_from_range(row, min_length, max_length)
-            writer.writerow([region_id] + row_from_range)
+def _format_long_block(region_ids, block, min_length):
+    rows, columns = np.nonzero(block)
+    lines = zip(
+        region_ids[rows].tolist(),
+        (columns + min_length).tolist(),
+        block[rows, columns].tolist(),
+    )
+    return "".join("%s\t%d\t%s\n" % line for line in lines)
 
 
-def _get_row_from_range(row, min_length, max_length):
-    return list(map(str, row[min_length - 1 : max_length]))
+def _open_output(output_file, compression):
+    """Open the output file for writing bytes, optionally compressed"""
+    if compression is None:
+        return open(output_file, "wb")
+    if compression == "gzip":
+        return gzip.open(output_file, "wb", compresslevel=6)
+    if compression == "bgzip":
+        return pysam.BGZFile(output_file, "wb")
+    raise ValueError(f"compression must be one of {', '.join(COMPRESSIONS)}")
 
 
 def generate_lengths(min_length, max_length):
-    return list(map(str, range(min_length, max_length)))
+    return list(map(str, range(min_length, max_length + 1)))
@@ -1,24 +1,83 @@
 import numpy as np
+from scipy.sparse import coo_matrix
 
+from .utils import sparse_elements
 from ..data import Data
 
+# The axes of a sample, in order, which can be summed over
+AXES = ("region", "length", "kmer")
 
-def region_sum(sample_file, output_file):
+
+def region_sum(sample_file, output_file, axis="region"):
     """Given s sample file this function will sum the data
     across the first axis, so that all the regions are collapsed
     into one
 
+    Another axis can be collapsed instead: "length" sums the fragment
+    lengths of each region and "kmer" sums the end sequences of each
+    region and length. Sparse data is summed in one pass over the non-zero
+    elements of all regions.
+
     :param sample_file: File path to the sample file
     :type sample_file: str
     :param output_file: File path to the output file
     :type output_file: str
+    :param axis: The axis to sum over, one of AXES
+    :type axis: str
+    """
+    Data.write(sum_regions(Data.read(sample_file), axis), output_file)
+
+
+def sum_regions(sample, axis="region"):
+    """Sum a sample over the given axis like region_sum, and return the sum
+    as a Data object instead of writing it.
+
+    :param sample: The sample to sum
+    :type sample: Data
+    :param axis: The axis to sum over, one of AXES
+    :type axis: str
+    :returns: Data
     """
-    sample = Data.read(sample_file)
+    if axis not in AXES:
+        raise ValueError(f"axis must be one of {', '.join(AXES)}, not {axis}")
+    axis_index = AXES.index(axis)
     if sample.is_sparse:
-        result = sample.data[0]
-        for matrix in sample.data[1:]:
-            if matrix.count_nonzero() != 0:
-                result += matrix
+        result = sparse_sum(sample.data, axis_index)
     else:
-        result = np.sum(sample.data, axis=0)
-    Data.write(Data(result, ["region_sum"], sample.bam_report), output_file)
+        if axis_index >= sample.data.ndim:
+            raise ValueError(f"The sample has no {axis} axis")
+        result = np.sum(sample.data, axis=axis_index)
+    region_ids = ["region_sum"] if axis == "region" else sample.region_ids
+    return Data(result, region_ids, sample.bam_report)
+
+
+def sparse_sum(matrices, axis=0):
+    """Sum an array of sparse matrices of the same shape, seen as a tensor of
+    shape (regions, rows, columns), over the given axis. The input is not
+    modified.
+
+    :param matrices: Array of sparse matrices
+    :type matrices: numpy.ndarray
+    :param axis: The axis to sum over
+    :type axis: int
+    :returns: A csr_matrix when summing over regions or rows, and a dense
+              (regions, rows) array when summing over columns
+    """
+    n_regions = len(matrices)
+    n_rows, n_columns = matrices[0].shape
+    dtype = matrices[0].dtype
+    regions, rows, columns, values = sparse_elements(matrices)
+    if axis == 0:
+        return coo_matrix(
+            (values, (rows, columns)), shape=(n_rows, n_columns), dtype=dtype
+        ).tocsr()
+    if axis == 1:
+        return coo_matrix(
+            (values, (regions, columns)), shape=(n_regions, n_columns), dtype=dtype
+        ).tocsr()
+    if axis == 2:
+        sums = np.bincount(
+            regions * n_rows + rows, weights=values, minlength=n_regions * n_rows
+        )
+        return sums.astype(dtype).reshape((n_regions, n_rows))
+    raise ValueError(f"Sparse data has no axis {axis}")
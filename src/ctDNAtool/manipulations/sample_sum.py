@@ -1,4 +1,5 @@
-from functools import reduce, partial
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
 import numpy as np
 import logging
 
@@ -6,32 +7,109 @@ from ..data import Data, astype
 
 logger = logging.getLogger()
 
+FAN_IN = 8
+# Number of groups queued per worker, bounding the partial sums held at once
+TASKS_PER_WORKER = 2
+
 
 def add_if_eq_region(x, y):
     if x.region_ids != y.region_ids:
-        # TODO: There should be some exception handling
-        logger.warning("region ids does not match!")
-    else:
-        x.data += y.data
-        return x
+        raise ValueError("region ids does not match!")
+    x.data += y.data
+    return x
 
 
-def sample_sum(sample_files, output_file, uint32=False):
+def sample_sum(sample_files, output_file, uint32=False, workers=1, fan_in=FAN_IN):
     """This function will given a list of sample files, load in the
     samples one by one and collapse them upon each other value by value.
     The final sample will be stored in the output file.
 
+    The sum is a tree reduction: the first sample is the start of the sum,
+    and groups of fan_in of the other files are read and summed by the worker
+    processes, while the partial sums are added up as they are done. Only a
+    bounded number of groups are queued at a time. Samples whose region ids
+    or shape do not match the first sample are skipped, and the skipped files
+    are reported.
+
     :param sample_files: List of sample files paths
     :type sample_files: List(str)
     :param output_file: File path to the output file
     :type output_file: str
     :param uint32: If False numpy.dtype will be preserved, if True numpy.dtype will be changed to uint32
     :type uint32: boolean
+    :param workers: Number of worker processes reading and summing samples
+    :type workers: int > 0
+    :param fan_in: Number of samples summed per task
+    :type fan_in: int > 0
     :returns:  None
     """
     first_sample = Data.read(sample_files[0])
-    astype_func = partial(astype, np.uint32 if uint32 else first_sample.dtype)
-    summary_sample = reduce(
-        add_if_eq_region, map(astype_func, map(Data.read, sample_files))
+    dtype = np.uint32 if uint32 else first_sample.dtype
+    sum_func = partial(
+        _sum_samples,
+        region_ids=first_sample.region_ids,
+        shape=first_sample.data.shape,
+        dtype=dtype,
     )
+    bam_report = first_sample.bam_report
+    summary_sample = astype(dtype, first_sample)
+    first_sample = None
+    groups = (sample_files[i : i + fan_in] for i in range(1, len(sample_files), fan_in))
+
+    mismatches = list()
+    for group_sum, group_mismatches in _map_unordered(sum_func, groups, workers):
+        mismatches += group_mismatches
+        if group_sum is not None:
+            summary_sample = add_if_eq_region(summary_sample, group_sum)
+
+    if mismatches:
+        logger.warning(
+            f"Skipped {len(mismatches)} of {len(sample_files)} samples not "
+            f"matching {sample_files[0]}: {', '.join(mismatches)}"
+        )
+    summary_sample.bam_report = bam_report
     Data.write(summary_sample, output_file)
+
+
+def _sum_samples(sample_files, region_ids, shape, dtype):
+    """Sum the samples matching the region ids and shape, and return the sum
+    and the list of files not matching"""
+    summary_sample = None
+    mismatches = list()
+    for file in sample_files:
+        sample = Data.read(file)
+        if sample.region_ids != region_ids:
+            logger.warning(f"Region ids of {file} does not match")
+            mismatches.append(file)
+        elif sample.data.shape != shape:
+            logger.warning(f"Shape {sample.data.shape} of {file} does not match")
+            mismatches.append(file)
+        elif summary_sample is None:
+            summary_sample = astype(dtype, sample)
+        else:
+            summary_sample = add_if_eq_region(summary_sample, astype(dtype, sample))
+    return summary_sample, mismatches
+
+
+def _map_unordered(func, items, workers):
+    """Yield the results of func applied to the items, in the order they are
+    done when running in worker processes. At most workers * TASKS_PER_WORKER
+    items are submitted at a time, and a result is dropped once it is
+    yielded."""
+    if workers <= 1:
+        yield from map(func, items)
+        return
+    items = iter(items)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        while True:
+            while len(pending) < workers * TASKS_PER_WORKER:
+                item = next(items, None)
+                if item is None:
+                    break
+                pending.add(executor.submit(func, item))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            while done:
+                yield done.pop().result()
@@ -1,5 +1,10 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
 from ..manipulations.summaries_data import summaries_data
+from ..manipulations.region_sum import sparse_sum
 from ..data import Data
+from ..kmers import NUCLEOTIDES
 
 
 def summaries(sample_file, flank):
@@ -12,7 +17,49 @@ def summaries(sample_file, flank):
     :type flank Integer
     """
     sample_id = sample_file.split("/")[-1].replace(".pickle", "")
-    data = Data.read(sample_file).data.sum(axis=0)
+    sample = Data.read(sample_file)
+    if sample.is_sparse and sample.data.ndim == 1:
+        data = sparse_sum(sample.data)
+    else:
+        data = sample.data.sum(axis=0)
 
     counts, freqs = summaries_data(data, flank)
     return sample_id, counts, freqs
+
+
+def summaries_table(sample_files, output_file, flank, workers=1):
+    """Summarize the end sequences of many samples, in parallel, and write
+    the counts and frequencies of each nucleotide in each position of the end
+    sequences to one tsv file, with a line per sample, position and
+    nucleotide. Positions are numbered from 1 to 2 * flank.
+
+    :param sample_files: List of sample file paths
+    :type sample_files: List[str]
+    :param output_file: File path to the output tsv file
+    :type output_file: str
+    :param flank: amount of base pairs on each end of the sample
+    :type flank: Integer
+    :param workers: Number of worker processes
+    :type workers: int > 0
+    """
+    summaries_func = partial(summaries, flank=flank)
+    with open(output_file, "w") as fp:
+        fp.write("Sample ID\tPosition\tNucleotide\tCount\tFrequency\n")
+        if workers <= 1:
+            results = map(summaries_func, sample_files)
+            _write_summaries(fp, results, flank)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = executor.map(summaries_func, sample_files)
+                _write_summaries(fp, results, flank)
+
+
+def _write_summaries(fp, results, flank):
+    for sample_id, counts, freqs in results:
+        for position in range(2 * flank):
+            for nucleotide, count, freq in zip(
+                NUCLEOTIDES, counts[:, position], freqs[:, position]
+            ):
+                fp.write(
+                    f"{sample_id}\t{position + 1}\t{nucleotide}\t{int(count)}\t{freq}\n"
+                )
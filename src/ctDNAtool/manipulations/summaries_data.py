@@ -1,28 +1,40 @@
 import numpy as np
+from scipy.sparse import issparse
+
+from ..kmers import decode_kmers
 
 
 def summaries_data(data, flank):
     """This function will given a numpy array and flank find flank amount of base pairs on each end of the sample
     and return count of each base pair and frequency of each base pair
 
+    The columns of data are k-mer indices of the start and end sequences, as
+    made by encode_kmers. The column after the last k-mer, counting sequences
+    with N, is ignored.
+
     :param data instance containing data
     :type Data
     :param flank amount of base pairs on each end of the sample
     :type flank Integer
     """
-    nonzero = data.nonzero()
-    seq_pairs = zip(np.array(data[nonzero])[0], nonzero[1])
-    counts = np.zeros((4, 2 * flank))
-    for n, kmer in seq_pairs:
-        # End sequence
-        for i in reversed(range(2 * flank)):
-            nucl = kmer % 4
-            counts[nucl, i] += n
-            kmer //= 4
-        # Start sequence
-        for i in reversed(range(2 * flank)):
-            nucl = kmer % 4
-            counts[nucl, i] += n
-            kmer //= 4
+    k = 4 * flank
+    if issparse(data):
+        data = data.tocoo()
+        kmers, n = data.col, data.data
+    else:
+        data = np.asarray(data)
+        nonzero = np.nonzero(data)
+        kmers, n = nonzero[-1], data[nonzero]
+    without_n = kmers < 1 << (2 * k)
+    digits = decode_kmers(kmers[without_n], k)
+    # Start and end sequences are counted in the same positions, so each
+    # digit is counted in the cell nucleotide * 2 * flank + position
+    positions = np.arange(k) % (2 * flank)
+    cells = digits.astype(np.int64) * (2 * flank) + positions
+    counts = np.bincount(
+        cells.ravel(),
+        weights=np.repeat(n[without_n].astype(np.float64), k),
+        minlength=8 * flank,
+    ).reshape((4, 2 * flank))
     freqs = counts / counts.sum(axis=0)
     return counts, freqs
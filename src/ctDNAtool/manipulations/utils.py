@@ -1,25 +1,22 @@
-from itertools import tee, count
+from itertools import count
 import numpy as np
+from scipy.sparse import csr_matrix
 
 
 def create_index_map(index_lst):
     return dict(zip(index_lst, count()))
 
 
-def unzip_pair_iter(it):
-    it1, it2 = tee(it)
-    first_it = (a for a, b in it1)
-    second_it = (b for a, b in it2)
-    return (first_it, second_it)
-
-
-def pick_subset_by_row_index(X, index_pairs, n):
-    is_tensor = len(X.shape) == 1
-    if is_tensor:
-        A = np.zeros(n, dtype=object)
-    else:
-        _, m = X.shape
-        A = np.zeros((n, m), dtype=X.dtype)
-    for i, j in index_pairs:
-        A[i] = X[j]
-    return A
+def sparse_elements(matrices):
+    """Return the region, row, column and value of each non-zero element of
+    an array of sparse matrices of the same shape, seen as a tensor of shape
+    (regions, rows, columns)"""
+    matrices = [csr_matrix(matrix) for matrix in matrices]
+    n_rows = matrices[0].shape[0]
+    row_nnz = np.concatenate([np.diff(matrix.indptr) for matrix in matrices])
+    regions, rows = np.divmod(
+        np.repeat(np.arange(len(matrices) * n_rows), row_nnz), n_rows
+    )
+    columns = np.concatenate([matrix.indices for matrix in matrices])
+    values = np.concatenate([matrix.data for matrix in matrices])
+    return regions, rows, columns, values
@@ -1,4 +1,15 @@
 from .find_tss import find_tss
-from .bin_genome import bin_genome_Mbp, bin_genome_chromosome
+from .bin_genome import (
+    bin_genome_Mbp,
+    bin_genome_chromosome,
+    chromosome_regions,
+    mbp_regions,
+)
 
-__all__ = ["find_tss", "bin_genome_Mbp", "bin_genome_chromosome"]
+__all__ = [
+    "find_tss",
+    "bin_genome_Mbp",
+    "bin_genome_chromosome",
+    "chromosome_regions",
+    "mbp_regions",
+]
@@ -33,6 +33,19 @@ def bin_genome_chromosome(
     :param chromosomes: Choose wich chromosomes to include in bed file.
     :type Chromosomes:
     """
+    write_bed_file(output_file, chromosome_regions(genome_ref_file, chromosomes))
+    return output_file
+
+
+def chromosome_regions(genome_ref_file, chromosomes=Chromosomes.AUTOSOMES):
+    """Return the bins of bin_genome_chromosome as a list of BED objects
+
+    :param genome_ref_file: File path to a .2bit file
+    :type genome_ref_file: str
+    :param chromosomes: Choose wich chromosomes to include.
+    :type Chromosomes:
+    :returns: List[BED]
+    """
     tb = py2bit.open(genome_ref_file)
     try:
         chroms = tb.chroms()
@@ -51,9 +64,7 @@ def bin_genome_chromosome(
                     strand="+",
                 )
             )
-
-        write_bed_file(output_file, beds)
-        return output_file
+        return beds
     finally:
         tb.close()
 
@@ -77,6 +88,21 @@ def bin_genome_Mbp(
     :param chromosomes: Choose wich chromosomes to include in bed file.
     :type Chromosomes:
     """
+    write_bed_file(output_file, mbp_regions(genome_ref_file, mbp, chromosomes))
+    return output_file
+
+
+def mbp_regions(genome_ref_file, mbp=1.0, chromosomes=Chromosomes.AUTOSOMES):
+    """Return the bins of bin_genome_Mbp as a list of BED objects
+
+    :param genome_ref_file: File path to a .2bit file
+    :type genome_ref_file: str
+    :param mbp: Bin size in Mbp.
+    :type mbp:
+    :param chromosomes: Choose wich chromosomes to include.
+    :type Chromosomes:
+    :returns: List[BED]
+    """
     tb = py2bit.open(genome_ref_file)
     bin_size = int(mbp * 10 ** 6)
     try:
@@ -100,7 +126,6 @@ def bin_genome_Mbp(
                         strand="+",
                     )
                 )
-        write_bed_file(output_file, beds)
-        return output_file
+        return beds
     finally:
         tb.close()
@@ -1,5 +1,4 @@
-import attr
-
+from .gff3 import read_transcripts
 from .transcript_annotation import (
     pull_tx_id,
     pull_ensemble_gene_id,
@@ -11,28 +10,8 @@ from .utils import is_autosome
 from ..utils import tsv_writer
 
 
-@attr.s
-class Tx_annotation:
-    chrom = attr.ib()
-    start = attr.ib()
-    end = attr.ib()
-    strand = attr.ib()
-    additionals = attr.ib()
-
-
-def get_transcript_annotations(file_path):
-    with open(file_path, "r") as file_obj:
-        for line in file_obj:
-            if line[0] == "#":  # line is comment
-                continue
-            anno = line.replace("\n", "").split()
-            if anno[2] != "transcript":  # line is not a transcript
-                continue
-            if is_autosome(anno[0]):
-                anno_obj = Tx_annotation(
-                    anno[0], int(anno[3]), int(anno[4]), anno[6], anno[8]
-                )
-                yield anno_obj
+def get_transcript_annotations(file_path, workers=1):
+    return read_transcripts(file_path, is_autosome, workers)
 
 
 def determine_TSS_and_format_data(tx_anno):
@@ -55,13 +34,14 @@ def determine_TSS_and_format_data(tx_anno):
     )
 
 
-def find_tss(annotation_file, region_size, bed_output_file, tss_output_file):
+def find_tss(annotation_file, region_size, bed_output_file, tss_output_file, workers=1):
     """This function will given a gencode annotation file, find all transcripts
     and determine the Transcription Start Site (TSS) for the transcript.
     Information about the TSS will be stored in the tss file with metadata
     and a bed file which can be used as input for the generator.
 
-    :param annotation_file: File path to the gencode annotation file
+    :param annotation_file: File path to the gencode annotation file, which
+                            can be gzip compressed
     :type annotation_file: str
     :param region_size: Size of the region with the TSS in the center which
                         should be stored in the bed file
@@ -70,9 +50,11 @@ def find_tss(annotation_file, region_size, bed_output_file, tss_output_file):
     :type bed_output_file: str
     :param tss_output_file: File path to the tss file
     :type tss_output_file: str
+    :param workers: Number of processes parsing an uncompressed annotation file
+    :type workers: int > 0
     :returns:  None
     """
-    tx_annotations = get_transcript_annotations(annotation_file)
+    tx_annotations = get_transcript_annotations(annotation_file, workers)
     TSS_dict = dict()
     for tx_anno in tx_annotations:
         tss = determine_TSS_and_format_data(tx_anno)
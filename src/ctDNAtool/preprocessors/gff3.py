@@ -0,0 +1,102 @@
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from functools import partial
+import logging
+import os
+import re
+
+from .transcript_annotation import Tx_annotation
+from .utils import is_autosome, is_gzipped, open_annotation
+
+logger = logging.getLogger()
+
+# Columns of a transcript line. The attribute column is kept as a string and
+# only split when an attribute is pulled from it.
+TRANSCRIPT_LINE = re.compile(
+    r"([^\t]+)\t[^\t]*\ttranscript\t(\d+)\t(\d+)\t[^\t]*\t([^\t])\t[^\t]*\t([^\t\n]*)"
+)
+# Size of the byte ranges parsed by the workers, and the number of ranges
+# queued per worker, which bound the memory of a parallel parse
+RANGE_BYTES = 4 * 2**20
+RANGES_PER_WORKER = 2
+
+
+def read_transcripts(file_path, chrom_filter=is_autosome, workers=1):
+    """Yield the transcripts of a GFF3 file, like a gencode annotation, as
+    Tx_annotation objects in file order. The file is streamed line by line
+    and can be gzip compressed.
+
+    Lines are first checked for their chromosome, whose filter result is
+    cached, and for the transcript type, so only transcript lines on the
+    wanted chromosomes are matched by the regular expression.
+
+    :param file_path: File path to the annotation file
+    :type file_path: str
+    :param chrom_filter: Predicate selecting the chromosomes to include
+    :type chrom_filter: Callable[[str], bool]
+    :param workers: Number of processes parsing byte ranges of RANGE_BYTES
+                    of the file in parallel. Only used for uncompressed files.
+    :type workers: int > 0
+    """
+    if workers > 1 and not is_gzipped(file_path):
+        yield from _read_transcripts_parallel(file_path, chrom_filter, workers)
+        return
+    with open_annotation(file_path) as fp:
+        yield from _parse_lines(fp, chrom_filter)
+
+
+def _parse_lines(lines, chrom_filter):
+    included = dict()
+    for line in lines:
+        chrom, sep, rest = line.partition("\t")
+        if not sep or line[0] == "#":
+            continue
+        keep = included.get(chrom)
+        if keep is None:
+            keep = included[chrom] = chrom_filter(chrom)
+        if not keep or "\ttranscript\t" not in rest:
+            continue
+        match = TRANSCRIPT_LINE.match(line)
+        if match is None:
+            continue
+        chrom, start, end, strand, attributes = match.groups()
+        yield Tx_annotation(chrom, int(start), int(end), strand, attributes)
+
+
+def _read_transcripts_parallel(file_path, chrom_filter, workers):
+    """Parse the file in byte ranges of RANGE_BYTES, with at most
+    workers * RANGES_PER_WORKER ranges pending, and yield the transcripts of
+    the ranges in file order"""
+    size = os.path.getsize(file_path)
+    bounds = range(0, size, RANGE_BYTES)
+    parse_func = partial(_parse_byte_range, file_path, chrom_filter)
+    logger.debug(f"Parsing {file_path} in {len(bounds)} byte ranges")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for start in bounds:
+            if len(pending) >= workers * RANGES_PER_WORKER:
+                yield from pending.popleft().result()
+            pending.append(
+                executor.submit(parse_func, start, min(start + RANGE_BYTES, size))
+            )
+        while pending:
+            yield from pending.popleft().result()
+
+
+def _parse_byte_range(file_path, chrom_filter, start, end):
+    """Parse the lines starting within the byte range [start, end)"""
+    with open(file_path, "rb") as fp:
+        if start > 0:
+            # A line starting before the range belongs to the previous range
+            fp.seek(start - 1)
+            fp.readline()
+        return list(_parse_lines(_read_lines(fp, end), chrom_filter))
+
+
+def _read_lines(fp, end):
+    """Yield the decoded lines of the binary file starting before end"""
+    while fp.tell() < end:
+        line = fp.readline()
+        if not line:
+            return
+        yield line.decode()
@@ -1,6 +1,6 @@
 import attr
 
-from .utils import is_autosome
+from .utils import is_autosome, open_annotation
 
 
 @attr.s
@@ -34,10 +34,10 @@ def pull_tx_type(anno_obj):
 
 
 def load_transcript_annotations_iter(annotation_path):
-    with open(annotation_path, "r") as fp:
-        for line in fp.read().split("\n"):
-            if line != "":
-                anno = line.split()
+    with open_annotation(annotation_path) as fp:
+        for line in fp:
+            anno = line.split()
+            if anno:
                 anno_obj = Tx_annotation(
                     anno[0], int(anno[3]), int(anno[4]), anno[6], anno[8]
                 )
@@ -46,15 +46,7 @@ def load_transcript_annotations_iter(annotation_path):
 
 
 def load_transcript_annotations(annotation_path):
-    annotations = dict()
-    with open(annotation_path, "r") as fp:
-        for line in fp.read().split("\n"):
-            if line != "":
-                anno = line.split()
-                anno_obj = Tx_annotation(
-                    anno[0], int(anno[3]), int(anno[4]), anno[6], anno[8]
-                )
-                if is_autosome(anno_obj.chrom):  # Filter out none autosomes
-                    tx_id = pull_tx_id(anno_obj)
-                    annotations[tx_id] = anno_obj
-    return annotations
+    return {
+        pull_tx_id(anno_obj): anno_obj
+        for anno_obj in load_transcript_annotations_iter(annotation_path)
+    }
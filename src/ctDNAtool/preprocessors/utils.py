@@ -1,5 +1,8 @@
+import gzip
 import re
 
+GZIP_MAGIC = b"\x1f\x8b"
+
 
 def is_autosome(chrom):
     return re.match(r"chr[3-9]$|chr1[0-9]?$|chr2[0-2]?$", chrom) is not None
@@ -7,3 +10,15 @@ def is_autosome(chrom):
 
 def is_autosome_or_x(chrom):
     return re.match(r"chr[3-9]$|chr1[0-9]?$|chr2[0-2]?$|chrX$", chrom) is not None
+
+
+def is_gzipped(file_path):
+    with open(file_path, "rb") as fp:
+        return fp.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+
+
+def open_annotation(file_path):
+    """Open a plain or gzip compressed annotation file for reading text"""
+    if is_gzipped(file_path):
+        return gzip.open(file_path, "rt")
+    return open(file_path, "r")
@@ -0,0 +1,130 @@
+import os
+import signal
+import cProfile
+import logging
+from collections import Counter
+
+logger = logging.getLogger()
+
+# Seconds of CPU time between the samples of the stack
+SAMPLE_INTERVAL = 0.005
+# Number of frames kept of each sampled stack
+MAX_DEPTH = 64
+# Number of entries in each table of the hot path summary
+SUMMARY_ENTRIES = 25
+
+
+class Profiler:
+    """Profiles the current process with cProfile, while sampling the stack
+    of the main thread on SIGPROF, which fires per SAMPLE_INTERVAL of CPU
+    time. Worker processes are not profiled.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.profile = cProfile.Profile()
+        self.samples = Counter()
+        self._previous_handler = None
+
+    def start(self):
+        try:
+            self._previous_handler = signal.signal(signal.SIGPROF, self._sample)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        except (AttributeError, ValueError):
+            # No SIGPROF on this platform, or not in the main thread
+            logger.warning("Stack sampling is not available, only using cProfile")
+            self._previous_handler = None
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        if self._previous_handler is not None:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, self._previous_handler)
+            self._previous_handler = None
+
+    def _sample(self, signum, frame):
+        stack = list()
+        while frame is not None and len(stack) < MAX_DEPTH:
+            code = frame.f_code
+            stack.append((code.co_filename, frame.f_lineno, code.co_name))
+            frame = frame.f_back
+        self.samples[tuple(stack)] += 1
+
+    def write(self, prefix):
+        """Write the cProfile statistics to prefix.prof, which can be loaded
+        with pstats, and the summary of the sampled stacks to prefix.hot.txt
+
+        :param prefix: File path of the output files, without extension
+        :type prefix: str
+        """
+        self.profile.dump_stats(f"{prefix}.prof")
+        with open(f"{prefix}.hot.txt", "w") as fp:
+            fp.write(self.summary())
+
+    def summary(self):
+        """Summarize the sampled stacks as the functions most often on top of
+        the stack, the functions most often anywhere on the stack and the
+        most frequent stacks"""
+        n_samples = sum(self.samples.values())
+        own = Counter()
+        total = Counter()
+        for stack, count in self.samples.items():
+            own[_function(stack[0])] += count
+            for function in set(map(_function, stack)):
+                total[function] += count
+
+        lines = [
+            f"{n_samples} samples, one per {self.interval * 1000:g} ms of CPU time",
+            "",
+            "Functions on top of the stack:",
+        ]
+        lines += _table(own, n_samples)
+        lines += ["", "Functions on the stack:"]
+        lines += _table(total, n_samples)
+        lines += ["", "Hot paths, innermost frame first:"]
+        for stack, count in self.samples.most_common(SUMMARY_ENTRIES):
+            lines.append(f"{_percentage(count, n_samples)} {count} samples")
+            lines += [
+                f"    {name} {filename}:{lineno}" for filename, lineno, name in stack
+            ]
+        return "\n".join(lines) + "\n"
+
+
+def _function(frame):
+    filename, _, name = frame
+    return f"{name} {filename}"
+
+
+def _percentage(count, n_samples):
+    return f"{100 * count / max(n_samples, 1):6.2f}%"
+
+
+def _table(counter, n_samples):
+    return [
+        f"{_percentage(count, n_samples)} {count:>8} {function}"
+        for function, count in counter.most_common(SUMMARY_ENTRIES)
+    ]
+
+
+def profile_subcommand(ctx, directory):
+    """Profile the sub-command invoked by the group of the click context,
+    and write the profile to the directory when the context closes, as
+    <group>-<sub-command>.prof and <group>-<sub-command>.hot.txt
+
+    :param ctx: Context of a click group
+    :type ctx: click.Context
+    :param directory: Directory of the profiles
+    :type directory: str
+    """
+    os.makedirs(directory, exist_ok=True)
+    prefix = os.path.join(directory, f"{ctx.info_name}-{ctx.invoked_subcommand}")
+    profiler = Profiler()
+
+    def write_profile():
+        profiler.stop()
+        profiler.write(prefix)
+        logger.info(f"Profile written to {prefix}.prof and {prefix}.hot.txt")
+
+    profiler.start()
+    ctx.call_on_close(write_profile)
@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import resource
+import logging
+import functools
+from contextlib import contextmanager
+
+logger = logging.getLogger()
+
+# Number of slowest regions kept in a report
+SLOWEST_REGIONS = 10
+SIDECAR_SUFFIX = ".telemetry.json"
+
+# The telemetry of the running command, if it is recorded
+_current = None
+
+
+class Telemetry:
+    """Collects the wall time of the stages of a command, and the reports
+    of the generators it runs"""
+
+    def __init__(self, command):
+        self.command = command
+        self.stages = dict()
+        self.active_stages = set()
+        self.reports = list()
+        self.start_time = time.perf_counter()
+        self.start_bytes_read = bytes_read()
+
+    def to_dict(self):
+        wall_seconds = time.perf_counter() - self.start_time
+        result = {
+            "command": self.command,
+            "wall_seconds": wall_seconds,
+            "stages": dict(self.stages),
+            "peak_rss": max(
+                [peak_rss()] + [report.peak_rss for report in self.reports]
+            ),
+            "bytes_read": bytes_read() - self.start_bytes_read,
+        }
+        if self.reports:
+            result["reports"] = [
+                _report_to_dict(report, self.stages.get("count", wall_seconds))
+                for report in self.reports
+            ]
+        return result
+
+
+def _report_to_dict(report, count_seconds):
+    fragments = report.paired_reads_yielded // 2
+    return {
+        "counters": report.counters(),
+        "fetch_seconds": report.fetch_seconds,
+        "pair_seconds": report.pair_seconds,
+        "count_seconds": report.count_seconds,
+        "reads_per_second": report.fetched_reads / max(count_seconds, 1e-9),
+        "fragments_per_second": fragments / max(count_seconds, 1e-9),
+        "slowest_regions": [
+            {"region_id": region_id, "seconds": seconds, "fragments": n_fragments}
+            for seconds, region_id, n_fragments in sorted(
+                report.slowest_regions, reverse=True
+            )
+        ],
+        "bytes_read": report.bytes_read,
+    }
+
+
+@contextmanager
+def record(command, sidecar_file):
+    """Record the telemetry of the command and write it as JSON to the
+    sidecar file, when the command succeeds
+
+    :param command: Name of the command
+    :type command: str
+    :param sidecar_file: File path to the JSON file
+    :type sidecar_file: str
+    """
+    global _current
+    _current = Telemetry(command)
+    try:
+        yield _current
+        with open(sidecar_file, "w") as fp:
+            json.dump(_current.to_dict(), fp, indent=2)
+        logger.info(f"Telemetry written to {sidecar_file}")
+    finally:
+        _current = None
+
+
+@contextmanager
+def stage(name):
+    """Add the wall time of the block to the stage, if telemetry is recorded.
+    A block nested in a block of the same stage is not counted twice."""
+    telemetry = _current
+    if telemetry is None or name in telemetry.active_stages:
+        yield
+        return
+    telemetry.active_stages.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        telemetry.stages[name] = telemetry.stages.get(name, 0.0) + seconds
+        telemetry.active_stages.discard(name)
+
+
+def timed(name):
+    """Decorator adding the wall time of the calls to the stage"""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def add_report(report):
+    """Add the report of a generator run, if telemetry is recorded"""
+    if _current is not None:
+        _current.reports.append(report)
+
+
+def peak_rss():
+    """Peak resident set size in bytes of this process and its finished
+    child processes"""
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+def bytes_read():
+    """Number of bytes this process has read, or 0 if it is not known"""
+    try:
+        with open("/proc/self/io") as fp:
+            for line in fp:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
@@ -1,6 +1,8 @@
+import pstats
 from click.testing import CliRunner
 
 import ctDNAtool.cli as cli
+from .test_generators import _generate_test_files
 
 
 class Test_cli:
@@ -8,3 +10,22 @@ class Test_cli:
         runner = CliRunner()
         result = runner.invoke(cli.cli)
         assert result.exit_code == 0
+
+
+class Test_profile:
+    def test_profile(self):
+        bam_file, bed_file, _ = _generate_test_files(n_pairs=4000)
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            result = runner.invoke(
+                cli.cli,
+                ["--profile", "profiles", "generate-length", bam_file, bed_file],
+            )
+            assert result.exit_code == 0, result.output
+            stats = pstats.Stats("profiles/cli-generate-length.prof")
+            with open("profiles/cli-generate-length.hot.txt") as fp:
+                summary = fp.read()
+
+        functions = {name for _, _, name in stats.stats}
+        assert "pair_batches" in functions
+        assert "Hot paths" in summary
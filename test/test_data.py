@@ -0,0 +1,135 @@
+import numpy as np
+import pickle
+import tempfile
+from scipy.sparse import csr_matrix
+
+import ctDNAtool.container as container
+import ctDNAtool.data as data
+import ctDNAtool.combined_data as combined_data
+from ctDNAtool.generators.bam import Report
+from ctDNAtool.manipulations.region_sum import region_sum
+
+
+class Test_container:
+    def test_dense_round_trip(self):
+        X = np.arange(60, dtype=np.uint32).reshape((3, 20))
+        report = Report("sample.bam", fetched_reads=10)
+        file = tempfile.NamedTemporaryFile().name
+
+        data.Data.write(data.Data(X, ["a", "b", "c"], report), file)
+        sample = data.Data.read(file)
+
+        assert container.is_complete(file)
+        assert np.array_equal(sample.data, X)
+        assert sample.data.dtype == X.dtype
+        assert sample.region_ids == ["a", "b", "c"]
+        assert sample.bam_report == report
+
+    def test_sparse_round_trip(self):
+        X = np.empty(3, dtype=object)
+        for i in range(3):
+            M = np.zeros((10, 7), dtype=np.uint32)
+            M[i, i + 1] = i + 1
+            X[i] = csr_matrix(M)
+        file = tempfile.NamedTemporaryFile().name
+
+        data.Data.write(data.Data(X, ["a", "b", "c"], None), file)
+        sample = data.Data.read(file)
+
+        assert sample.is_sparse
+        assert sample.dtype == np.uint32
+        assert sample.bam_report is None
+        for i in range(3):
+            assert np.array_equal(sample.data[i].toarray(), X[i].toarray())
+
+    def test_sparse_matrix_round_trip(self):
+        X = csr_matrix(np.eye(5, dtype=np.uint32))
+        file = tempfile.NamedTemporaryFile().name
+
+        data.Data.write(data.Data(X, ["region_sum"], None), file)
+        sample = data.Data.read(file)
+
+        assert sample.is_sparse
+        assert np.array_equal(sample.data.toarray(), X.toarray())
+
+    def test_combined_data_round_trip(self):
+        X = np.arange(24).reshape((2, 3, 4))
+        file = tempfile.NamedTemporaryFile().name
+
+        combined_data.CombinedData.write(
+            combined_data.CombinedData(
+                np.array(["s1", "s2"], dtype=object), [1, 2, 3], X
+            ),
+            file,
+        )
+        combined = combined_data.CombinedData.read(file)
+
+        assert list(combined.IDs) == ["s1", "s2"]
+        assert combined.region_ids == [1, 2, 3]
+        assert np.array_equal(combined.data, X)
+
+    def test_legacy_pickle(self):
+        sample = data.Data(np.ones((2, 3)), ["a", "b"], None)
+        file = tempfile.NamedTemporaryFile().name
+        with open(file, "wb") as fp:
+            pickle.dump(sample, fp)
+
+        assert not container.is_container(file)
+        assert np.array_equal(data.Data.read(file).data, sample.data)
+
+    def test_legacy_pickle_report(self):
+        """Test a pickle with a report of earlier versions, which lacks the
+        fields added since, can be read, written and summed"""
+        report = Report("sample.bam", fetched_reads=10, paired_reads_yielded=4)
+        # Earlier versions had only the first six fields
+        for name in list(report.__dict__)[6:]:
+            del report.__dict__[name]
+        sample = data.Data(np.ones((2, 3), dtype=np.uint32), ["a", "b"], report)
+        file = tempfile.NamedTemporaryFile().name
+        out_file = tempfile.NamedTemporaryFile().name
+        sum_file = tempfile.NamedTemporaryFile().name
+        with open(file, "wb") as fp:
+            pickle.dump(sample, fp)
+
+        legacy = data.Data.read(file)
+        data.Data.write(legacy, out_file)
+        region_sum(file, sum_file)
+
+        expected = Report("sample.bam", fetched_reads=10, paired_reads_yielded=4)
+        assert legacy.bam_report == expected
+        assert legacy.bam_report.slowest_regions == []
+        assert "Orphan reads" in str(legacy.bam_report)
+        assert data.Data.read(out_file).bam_report == expected
+        summed = data.Data.read(sum_file)
+        assert np.array_equal(summed.data, [2, 2, 2])
+        assert summed.bam_report == expected
+
+    def test_chunks_and_mmap(self, monkeypatch):
+        """Test reading row ranges spanning several compressed chunks, and
+        memory mapping uncompressed values"""
+        monkeypatch.setattr(container, "CHUNK_BYTES", 64)
+        X = np.arange(400, dtype=np.int64).reshape((100, 4))
+        file = tempfile.NamedTemporaryFile().name
+        raw_file = tempfile.NamedTemporaryFile().name
+
+        data.Data.write(data.Data(X, list(range(100)), None), file)
+        data.Data.write(data.Data(X, list(range(100)), None), raw_file, compress=False)
+
+        with container.ContainerReader(file) as reader:
+            assert len(reader.arrays["values"]["chunks"]) == 50
+            assert np.array_equal(reader.read_range("values", 3, 17), X[3:17])
+        mapped = data.Data.read(raw_file, mmap=True)
+        assert isinstance(mapped.data, np.memmap)
+        assert np.array_equal(mapped.data, X)
+
+    def test_incomplete(self):
+        X = np.ones((4, 4))
+        file = tempfile.NamedTemporaryFile().name
+        data.Data.write(data.Data(X, list(range(4)), None), file)
+        with open(file, "rb") as fp:
+            content = fp.read()
+        with open(file, "wb") as fp:
+            fp.write(content[:-4])
+
+        assert container.is_container(file)
+        assert not container.is_complete(file)
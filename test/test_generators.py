@@ -0,0 +1,709 @@
+import os
+import json
+import numpy as np
+import pysam
+import pytest
+import struct
+import tempfile
+
+import ctDNAtool.generators as gen
+import ctDNAtool.data as data
+import ctDNAtool.combined_data as combined_data
+import ctDNAtool.flows as flows
+import ctDNAtool.cli as cli
+import ctDNAtool.telemetry as telemetry
+from ctDNAtool.manipulations import sum_regions
+from click.testing import CliRunner
+from ctDNAtool.cli_flow import cli_flow
+from ctDNAtool.generators.bed import BED, load_bed_file, write_bed_file
+from ctDNAtool.generators.regions import RegionIndex
+from ctDNAtool.generators.reference import ReferenceCache
+from ctDNAtool.generators import sparse_counts
+from ctDNAtool.generators.checkpoint import Checkpoint
+from ctDNAtool.generators.utils import seq_to_index
+from ctDNAtool.kmers import encode_kmers, decode_kmers, seq_to_codes, codes_to_seq
+
+CHROM_LENGTHS = {"chr1": 6000, "chr2": 4000}
+
+
+class Test_parallel_generators:
+    def test_length_matrix_workers(self):
+        """Test that splitting the regions across workers gives the same
+        result as a serial run"""
+        bam_file, bed_file, _ = _generate_test_files()
+
+        serial = _run(gen.length_matrix, bam_file, bed_file)
+        parallel = _run(gen.length_matrix, bam_file, bed_file, workers=3)
+
+        assert serial.data.sum() > 0
+        assert np.array_equal(serial.data, parallel.data)
+        assert serial.region_ids == parallel.region_ids
+        assert serial.bam_report == parallel.bam_report
+
+    def test_length_end_seqs_workers(self):
+        bam_file, bed_file, ref_file = _generate_test_files()
+
+        serial = _run(gen.length_end_seqs, bam_file, bed_file, ref_file)
+        parallel = _run(gen.length_end_seqs, bam_file, bed_file, ref_file, workers=3)
+
+        assert len(serial.data) == len(parallel.data)
+        for serial_matrix, parallel_matrix in zip(serial.data, parallel.data):
+            assert (serial_matrix != parallel_matrix).nnz == 0
+        assert serial.bam_report == parallel.bam_report
+
+    def test_length_end_seqs_marginal_workers(self):
+        bam_file, bed_file, ref_file = _generate_test_files()
+
+        serial = _run(gen.length_end_seqs_marginal, bam_file, bed_file, ref_file)
+        parallel = _run(
+            gen.length_end_seqs_marginal, bam_file, bed_file, ref_file, workers=3
+        )
+
+        assert len(serial.data) == len(parallel.data)
+        for serial_matrix, parallel_matrix in zip(serial.data, parallel.data):
+            assert (serial_matrix != parallel_matrix).nnz == 0
+        assert serial.bam_report == parallel.bam_report
+
+    def test_length_end_seqs_marginal_dense(self):
+        """Test that the sparse matrices hold the same counts as the dense
+        tensor"""
+        bam_file, bed_file, ref_file = _generate_test_files()
+
+        sparse = _run(gen.length_end_seqs_marginal, bam_file, bed_file, ref_file)
+        dense = _run(
+            gen.length_end_seqs_marginal, bam_file, bed_file, ref_file, dense=True
+        )
+
+        assert sparse.is_sparse and not dense.is_sparse
+        assert dense.data.shape == (len(sparse.data), 500, 48)
+        assert dense.data.sum() > 0
+        for i, matrix in enumerate(sparse.data):
+            assert np.array_equal(matrix.toarray(), dense.data[i])
+
+    def test_mate_length_end_seqs_workers(self):
+        bam_file, bed_file, ref_file = _generate_test_files()
+
+        serial = _run(gen.mate_length_end_seqs, bam_file, bed_file, ref_file)
+        parallel = _run(
+            gen.mate_length_end_seqs, bam_file, bed_file, ref_file, workers=3
+        )
+
+        assert serial.data.sum() > 0
+        assert np.array_equal(serial.data, parallel.data)
+        assert serial.bam_report == parallel.bam_report
+
+
+class Test_pair_generator:
+    def test_unpaired_reads_are_accounted(self):
+        """Test that every read passing the quality check is either paired,
+        an orphan or evicted, also when mates lie outside the region"""
+        bam_file, _, _ = _generate_test_files()
+        bam = gen.BAM(bam_file)
+
+        pairs = list(bam.pair_generator("chr1", 1000, 3000))
+
+        report = bam.report
+        assert len(pairs) > 0
+        assert report.evicted_reads > 0
+        assert (
+            report.paired_reads + report.orphan_reads + report.evicted_reads
+            == report.reads_passed_qual_check
+        )
+
+    def test_pair_batches(self):
+        """Test that the batches hold the same fragments as the ReadPairs"""
+        bam_file, _, _ = _generate_test_files()
+
+        pairs = list(gen.BAM(bam_file).pair_generator("chr2", 0, 4000))
+        batches = list(gen.BAM(bam_file).pair_batches("chr2", 0, 4000, batch_size=7))
+
+        assert all(len(batch) <= 7 for batch in batches)
+        fragments = np.concatenate(batches)
+        assert len(fragments) == len(pairs)
+        assert (fragments["chrom_id"] == 1).all()
+        for fragment, pair in zip(fragments, pairs):
+            assert fragment["start"] == pair.start
+            assert fragment["end"] == pair.end
+            assert fragment["length"] == pair.length
+            assert fragment["start_is_first"] == pair.start_is_first
+
+
+class Test_single_sweep:
+    def test_length_matrix_sweep(self):
+        """Test that the sweep assigns each fragment to every region it overlaps"""
+        bam_file, bed_file, _ = _generate_test_files()
+        regions = load_bed_file(bed_file)
+        bam = gen.BAM(bam_file)
+        fragments = [
+            read
+            for chrom, length in CHROM_LENGTHS.items()
+            for read in bam.pair_generator(chrom, 0, length)
+        ]
+
+        result = _run(gen.length_matrix, bam_file, bed_file, sweep=True)
+
+        for i, region in enumerate(regions):
+            expected = np.zeros(500, dtype=np.uint32)
+            for read in fragments:
+                if (
+                    read.ref_name == region.chrom
+                    and read.start < region.end
+                    and read.end > region.start
+                ):
+                    expected[read.length - 1] += 1
+            assert np.array_equal(result.data[i], expected)
+
+    def test_sweep_workers(self):
+        bam_file, bed_file, ref_file = _generate_test_files()
+
+        serial = _run(gen.length_end_seqs, bam_file, bed_file, ref_file, sweep=True)
+        parallel = _run(
+            gen.length_end_seqs, bam_file, bed_file, ref_file, sweep=True, workers=2
+        )
+
+        for serial_matrix, parallel_matrix in zip(serial.data, parallel.data):
+            assert (serial_matrix != parallel_matrix).nnz == 0
+        assert serial.bam_report == parallel.bam_report
+
+    def test_region_index_nested(self):
+        regions = [
+            BED("chr1", 0, 1000, "a", 0, "+"),
+            BED("chr1", 100, 200, "b", 0, "+"),
+            BED("chr1", 300, 400, "c", 0, "+"),
+            BED("chr2", 0, 50, "d", 0, "+"),
+        ]
+        index = RegionIndex(regions)
+
+        assert sorted(index.overlapping("chr1", 150, 350)) == [0, 1, 2]
+        assert sorted(index.overlapping("chr1", 250, 300)) == [0]
+        assert index.overlapping("chr1", 1000, 1100) == []
+        assert index.overlapping("chr2", 40, 60) == [3]
+
+
+class Test_fragment_store:
+    def test_store_in_place_of_bam(self):
+        """Test that generators give the same result from a fragment store
+        as from the bam file, both per region and with a single sweep"""
+        bam_file, bed_file, ref_file = _generate_test_files()
+        store = tempfile.mkdtemp()
+        gen.extract_fragments(bam_file, store, workers=2)
+
+        from_bam = _run(gen.length_matrix, bam_file, bed_file)
+        from_store = _run(gen.length_matrix, store, bed_file)
+        from_bam_sweep = _run(gen.length_matrix, bam_file, bed_file, sweep=True)
+        from_store_sweep = _run(gen.length_matrix, store, bed_file, sweep=True)
+
+        assert from_bam.data.sum() > 0
+        assert from_bam.data.sum() < from_bam_sweep.data.sum()
+        assert np.array_equal(from_bam.data, from_store.data)
+        assert np.array_equal(from_bam_sweep.data, from_store_sweep.data)
+        assert from_store.bam_report == gen.FragmentStore(store).bam_report
+        assert from_store.bam_report.file_name == bam_file
+
+        for sweep in (False, True):
+            from_bam = _run(
+                gen.mate_length_end_seqs, bam_file, bed_file, ref_file, sweep=sweep
+            )
+            from_store = _run(
+                gen.mate_length_end_seqs,
+                store,
+                bed_file,
+                ref_file,
+                workers=2,
+                sweep=sweep,
+            )
+            assert np.array_equal(from_bam.data, from_store.data)
+
+    def test_store_report_and_mapq(self):
+        bam_file, _, _ = _generate_test_files()
+        store = tempfile.mkdtemp()
+        gen.extract_fragments(bam_file, store, mapq=30)
+
+        fragment_store = gen.FragmentStore(store)
+        bam = gen.BAM(bam_file)
+        for chrom, length in CHROM_LENGTHS.items():
+            list(bam.pair_generator(chrom, 0, length, mapq=30))
+
+        assert fragment_store.bam_report == bam.report
+        with pytest.raises(ValueError):
+            list(fragment_store.pair_batches("chr1", 0, 1000, mapq=20))
+
+
+class Test_reference_cache:
+    def test_end_motifs(self):
+        """Test that the end sequences and their indices match those fetched
+        through py2bit one fragment at a time"""
+        _, _, ref_file = _generate_test_files()
+        starts = np.array([2, 2990, 3040, 100])
+        ends = np.array([60, 3020, 3100, 5999])
+        flank = 2
+
+        with ReferenceCache(ref_file) as reference:
+            in_bounds = reference.in_bounds("chr1", starts, ends, flank)
+            motifs = reference.end_motifs(
+                "chr1", starts[in_bounds], ends[in_bounds], flank
+            )
+            indices = encode_kmers(motifs)
+            tb = reference.tb
+            fragments = zip(starts[in_bounds].tolist(), ends[in_bounds].tolist())
+            for i, (start, end) in enumerate(fragments):
+                seq = (
+                    tb.sequence("chr1", start - flank, start + flank)
+                    + tb.sequence("chr1", end - flank, end + flank)
+                ).upper()
+                assert indices[i] == seq_to_index(seq)
+
+        assert in_bounds.tolist() == [True, True, True, False]
+        assert indices[1] == -1
+
+
+class Test_kmers:
+    def test_encode_matches_seq_to_index(self):
+        """Test that the vectorized encoding gives the indices of the string
+        based encoding it replaced"""
+        digits = {"A": "0", "T": "1", "G": "2", "C": "3"}
+        rng = np.random.default_rng(0)
+        seqs = ["".join(rng.choice(list("ATGC"), 6)) for _ in range(50)]
+        codes = np.array([seq_to_codes(seq) for seq in seqs])
+
+        indices = encode_kmers(codes)
+
+        for seq, index in zip(seqs, indices):
+            assert index == int("".join(digits[n] for n in seq), base=4)
+            assert index == seq_to_index(seq)
+
+    def test_n_mask(self):
+        codes = np.array([seq_to_codes("ACGT"), seq_to_codes("ANGT")])
+
+        assert encode_kmers(codes).tolist() == [seq_to_index("ACGT"), -1]
+        assert encode_kmers(codes, n_index=256).tolist()[1] == 256
+        assert seq_to_index("ANGT") == -1
+
+    def test_decode(self):
+        indices = np.arange(256)
+
+        codes = decode_kmers(indices, 4)
+
+        assert np.array_equal(encode_kmers(codes), indices)
+        assert codes_to_seq(codes[seq_to_index("GATC")]) == "GATC"
+
+
+class Test_sparse_counter:
+    def test_counts(self, monkeypatch):
+        """Test that the counts match a dense tensor, also when the pending
+        increments are merged in between batches"""
+        monkeypatch.setattr(sparse_counts, "COMPACT_SIZE", 100)
+        shape = (5, 20, 7)
+        rng = np.random.default_rng(1)
+        T = np.zeros(shape, dtype=np.uint32)
+        counter = sparse_counts.SparseCounter(shape)
+        for _ in range(10):
+            index = tuple(rng.integers(0, n, 60) for n in shape)
+            np.add.at(T, index, 1)
+            counter.add(*index)
+
+        tensor = counter.to_csr_list()
+
+        assert len(tensor) == shape[0]
+        for i in range(shape[0]):
+            assert tensor[i].dtype == np.uint32
+            assert np.array_equal(tensor[i].toarray(), T[i])
+
+
+class Test_alignment_formats:
+    def test_cram(self):
+        bam_file, bed_file, ref_file = _generate_test_files()
+        cram_file = tempfile.NamedTemporaryFile(suffix=".cram").name
+        pysam.view(
+            "-C", "-T", f"{ref_file}.fa", "-o", cram_file, bam_file, catch_stdout=False
+        )
+
+        from_bam = _run(gen.length_matrix, bam_file, bed_file)
+        from_cram = _run(
+            gen.length_matrix,
+            cram_file,
+            bed_file,
+            threads=2,
+            cram_reference=f"{ref_file}.fa",
+        )
+
+        assert os.path.exists(f"{cram_file}.crai")
+        assert np.array_equal(from_bam.data, from_cram.data)
+
+    def test_csi_index_for_long_contigs(self):
+        """Test that a .csi index is built when a contig is too long for .bai"""
+        bam_file = tempfile.NamedTemporaryFile(suffix=".bam").name
+        _write_bam(
+            bam_file, np.random.RandomState(1), 50, index=False, extra_contig=1073741824
+        )
+
+        bam = gen.BAM(bam_file, threads=2)
+
+        assert os.path.exists(f"{bam_file}.csi")
+        assert not os.path.exists(f"{bam_file}.bai")
+        assert len(list(bam.pair_generator("chr1", 0, 6000))) > 0
+
+
+class Test_flows:
+    def test_length_data(self):
+        """Test that the in-memory flow gives the same result as writing and
+        reading each step"""
+        bam_file, _, ref_file = _generate_test_files()
+        bin_file = tempfile.NamedTemporaryFile(suffix=".bed").name
+        chrom_file = tempfile.NamedTemporaryFile(suffix=".bed").name
+        write_bed_file(bin_file, flows.genome_regions(ref_file, mbp=0.001))
+        write_bed_file(chrom_file, flows.genome_regions(ref_file))
+
+        binned = flows.length_data(ref_file, bam_file, mbp=0.001)
+        collapsed = flows.length_data(ref_file, bam_file, collapse=True)
+        expected_binned = _run(gen.length_matrix, bam_file, bin_file)
+        expected_chroms = _run(gen.length_matrix, bam_file, chrom_file)
+
+        assert binned.region_ids == expected_binned.region_ids
+        assert np.array_equal(binned.data, expected_binned.data)
+        assert collapsed.region_ids == ["region_sum"]
+        assert np.array_equal(collapsed.data, expected_chroms.data.sum(axis=0))
+
+    def test_collapse(self):
+        """Test that counting the regions into one histogram gives the same
+        result as summing the regions"""
+        bam_file, bed_file, ref_file = _generate_test_files()
+        region_lst = load_bed_file(bed_file)
+        matrix = gen.length_matrix_data(bam_file, region_lst)
+        tensor = gen.length_end_seqs_data(bam_file, region_lst, ref_file, flank=2)
+
+        collapsed_matrix = gen.length_matrix_data(
+            bam_file, region_lst, workers=3, collapse=True
+        )
+        collapsed_tensor = gen.length_end_seqs_data(
+            bam_file, region_lst, ref_file, flank=2, workers=3, collapse=True
+        )
+
+        expected_matrix = sum_regions(matrix)
+        assert collapsed_matrix.region_ids == expected_matrix.region_ids
+        assert collapsed_matrix.dtype == expected_matrix.dtype
+        assert np.array_equal(collapsed_matrix.data, expected_matrix.data)
+        expected_tensor = sum_regions(tensor)
+        assert collapsed_tensor.data.dtype == expected_tensor.data.dtype
+        assert (collapsed_tensor.data != expected_tensor.data).nnz == 0
+
+    def test_cli_flow(self):
+        bam_file, _, ref_file = _generate_test_files()
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            result = runner.invoke(
+                cli_flow, ["length-data", ref_file, bam_file, "-o", "lengths.tsv"]
+            )
+            assert result.exit_code == 0, result.output
+            result = runner.invoke(
+                cli_flow,
+                ["length-seq-data-chr-bin", ref_file, bam_file, "-o", "seqs.pickle"],
+            )
+            assert result.exit_code == 0, result.output
+
+            assert sorted(os.listdir(".")) == ["lengths.tsv", "seqs.pickle"]
+            with open("lengths.tsv") as fp:
+                lines = fp.read().splitlines()
+            seqs = data.Data.read("seqs.pickle")
+
+        assert len(lines) == 2
+        assert lines[1].startswith("region_sum\t")
+        assert seqs.region_ids == ["chr1", "chr2"]
+
+
+class Test_checkpoint:
+    def test_resume(self, monkeypatch):
+        """Test that resuming an interrupted run gives the same result as an
+        uninterrupted run, without counting the completed blocks again"""
+        bam_file, bed_file, ref_file = _generate_test_files()
+        output_file = tempfile.NamedTemporaryFile().name
+        expected = _run(gen.length_end_seqs, bam_file, bed_file, ref_file, flank=2)
+
+        write_block = Checkpoint._write_block
+        written = list()
+
+        def interrupted_write_block(self, i, values, report):
+            if len(written) == 2:
+                raise KeyboardInterrupt
+            written.append(i)
+            write_block(self, i, values, report)
+
+        monkeypatch.setattr(Checkpoint, "_write_block", interrupted_write_block)
+        checkpoint = Checkpoint.for_output(output_file, block_size=3)
+        with pytest.raises(KeyboardInterrupt):
+            gen.length_end_seqs(
+                bam_file,
+                bed_file,
+                ref_file,
+                output_file,
+                flank=2,
+                checkpoint=checkpoint,
+            )
+        assert not os.path.exists(output_file)
+        monkeypatch.setattr(Checkpoint, "_write_block", write_block)
+
+        with pytest.raises(ValueError):
+            gen.length_end_seqs(
+                bam_file,
+                bed_file,
+                ref_file,
+                output_file,
+                flank=1,
+                checkpoint=Checkpoint.for_output(output_file, resume=True),
+            )
+        counted = list()
+
+        def counting_write_block(self, i, values, report):
+            counted.append(i)
+            write_block(self, i, values, report)
+
+        monkeypatch.setattr(Checkpoint, "_write_block", counting_write_block)
+        gen.length_end_seqs(
+            bam_file,
+            bed_file,
+            ref_file,
+            output_file,
+            flank=2,
+            checkpoint=Checkpoint.for_output(output_file, resume=True),
+        )
+        resumed = data.Data.read(output_file)
+
+        assert written == [0, 1]
+        assert counted[0] == 2 and 0 not in counted and 1 not in counted
+        assert resumed.region_ids == expected.region_ids
+        assert resumed.bam_report == expected.bam_report
+        for matrix, expected_matrix in zip(resumed.data, expected.data):
+            assert (matrix != expected_matrix).nnz == 0
+        assert not os.path.exists(checkpoint.directory)
+
+    def test_workers(self):
+        bam_file, bed_file, _ = _generate_test_files()
+        output_file = tempfile.NamedTemporaryFile().name
+        expected = _run(gen.length_matrix, bam_file, bed_file)
+
+        gen.length_matrix(
+            bam_file,
+            bed_file,
+            output_file,
+            workers=3,
+            checkpoint=Checkpoint.for_output(output_file, block_size=2),
+        )
+        result = data.Data.read(output_file)
+
+        assert np.array_equal(result.data, expected.data)
+        assert result.bam_report == expected.bam_report
+
+
+class Test_telemetry:
+    def test_sidecar(self):
+        bam_file, bed_file, _ = _generate_test_files()
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            result = runner.invoke(
+                cli.cli,
+                ["generate-length", bam_file, bed_file, "-o", "lengths.pickle"]
+                + ["--workers", "2", "--telemetry"],
+            )
+            assert result.exit_code == 0, result.output
+            with open("lengths.pickle.telemetry.json") as fp:
+                sidecar = json.load(fp)
+            sample = data.Data.read("lengths.pickle")
+
+        assert sidecar["command"] == "generate-length"
+        assert set(sidecar["stages"]) == {"count", "write"}
+        assert sidecar["peak_rss"] > 0
+        (report,) = sidecar["reports"]
+        assert report["counters"] == data.report_to_dict(sample.bam_report)
+        assert report["fetch_seconds"] > 0
+        assert report["fragments_per_second"] > 0
+        seconds = [region["seconds"] for region in report["slowest_regions"]]
+        assert len(seconds) == telemetry.SLOWEST_REGIONS
+        assert seconds == sorted(seconds, reverse=True)
+
+    def test_report_merge(self):
+        first, second = gen.bam.Report("a.bam", 2), gen.bam.Report("a.bam", 3)
+        first.peak_rss, second.peak_rss = 10, 20
+        for i in range(telemetry.SLOWEST_REGIONS):
+            first.add_region_time(f"a{i}", i, 1)
+            second.add_region_time(f"b{i}", i + 0.5, 1)
+        second.fetch_seconds = 1.0
+
+        assert first == gen.bam.Report("a.bam", 2)
+        first.merge(second)
+
+        assert first.fetched_reads == 5
+        assert first.peak_rss == 20
+        assert first.fetch_seconds == 1.0
+        assert len(first.slowest_regions) == telemetry.SLOWEST_REGIONS
+        assert min(first.slowest_regions)[0] == 5
+        assert "fetch_seconds" not in data.report_to_dict(first)
+
+
+class Test_cohort:
+    def test_generate_cohort(self):
+        """Test that the samples of a cohort are generated like single runs,
+        and that complete samples are skipped when running again"""
+        bam_file, bed_file, _ = _generate_test_files()
+        other_bam_file, _, _ = _generate_test_files(seed=1)
+        output_dir = tempfile.mkdtemp()
+        combined_file = os.path.join(output_dir, "combined.pickle")
+
+        output_files = gen.generate_cohort(
+            [bam_file, other_bam_file],
+            bed_file,
+            output_dir,
+            workers=2,
+            combined_file=combined_file,
+        )
+
+        for sample_bam, output_file in zip([bam_file, other_bam_file], output_files):
+            expected = _run(gen.length_matrix, sample_bam, bed_file)
+            assert np.array_equal(data.Data.read(output_file).data, expected.data)
+        combined = combined_data.CombinedData.read(combined_file)
+        assert list(combined.IDs) == [
+            gen.cohort.sample_id(bam_file),
+            gen.cohort.sample_id(other_bam_file),
+        ]
+
+        modified = os.path.getmtime(output_files[0])
+        with open(output_files[1], "r+b") as fp:
+            fp.truncate(100)
+        gen.generate_cohort([bam_file, other_bam_file], bed_file, output_dir)
+
+        assert os.path.getmtime(output_files[0]) == modified
+        assert np.array_equal(
+            data.Data.read(output_files[1]).data,
+            _run(gen.length_matrix, other_bam_file, bed_file).data,
+        )
+
+
+def _run(generator, bam_file, bed_file, *args, **kwargs):
+    output_file = tempfile.NamedTemporaryFile().name
+    generator(bam_file, bed_file, *args, output_file, **kwargs)
+    return data.Data.read(output_file)
+
+
+def _generate_test_files(n_pairs=400, seed=0):
+    """Write a small sorted and indexed bam file with random read pairs,
+    a bed file with overlapping regions and a matching 2bit reference genome"""
+    rng = np.random.RandomState(seed)
+    sequences = {
+        chrom: "".join(rng.choice(list("ACGTacgt"), size=length))
+        for chrom, length in CHROM_LENGTHS.items()
+    }
+    # Add a stretch of N's, so fragments ending in unknown sequence are tested
+    sequences["chr1"] = sequences["chr1"][:3000] + "N" * 50 + sequences["chr1"][3050:]
+
+    ref_file = tempfile.NamedTemporaryFile(suffix=".2bit").name
+    _write_2bit(ref_file, sequences)
+    with open(f"{ref_file}.fa", "w") as fp:
+        for chrom, seq in sequences.items():
+            fp.write(f">{chrom}\n{seq}\n")
+
+    bam_file = tempfile.NamedTemporaryFile(suffix=".bam").name
+    _write_bam(bam_file, rng, n_pairs)
+
+    bed_file = tempfile.NamedTemporaryFile(suffix=".bed").name
+    beds = [
+        BED(chrom, start, start + 1000, f"{chrom}_{start}", 0, "+")
+        for chrom, length in CHROM_LENGTHS.items()
+        for start in range(0, length - 1000, 500)
+    ]
+    write_bed_file(bed_file, beds)
+    return bam_file, bed_file, ref_file
+
+
+def _write_bam(bam_file, rng, n_pairs, read_length=50, index=True, extra_contig=None):
+    names = list(CHROM_LENGTHS.keys())
+    header = {
+        "HD": {"VN": "1.6", "SO": "coordinate"},
+        "SQ": [{"SN": chrom, "LN": CHROM_LENGTHS[chrom]} for chrom in names],
+    }
+    if extra_contig is not None:
+        header["SQ"].append({"SN": "chrLong", "LN": extra_contig})
+    reads = list()
+    for i in range(n_pairs):
+        chrom_id = rng.randint(len(names))
+        length = rng.randint(read_length + 10, 400)
+        start = rng.randint(0, CHROM_LENGTHS[names[chrom_id]] - length)
+        first_is_forward = rng.rand() < 0.5
+        mapq = 60 if rng.rand() < 0.9 else 5
+        for is_forward in (True, False):
+            is_read1 = is_forward == first_is_forward
+            read = pysam.AlignedSegment()
+            read.query_name = f"pair{i}"
+            read.flag = (
+                0x1
+                | 0x2
+                | (0x40 if is_read1 else 0x80)
+                | (0x20 if is_forward else 0x10)
+            )
+            read.reference_id = chrom_id
+            read.reference_start = start if is_forward else start + length - read_length
+            read.mapping_quality = mapq
+            read.cigar = [(0, read_length)]
+            read.next_reference_id = chrom_id
+            read.next_reference_start = (
+                start + length - read_length if is_forward else start
+            )
+            read.template_length = length if is_forward else -length
+            read.query_sequence = "A" * read_length
+            read.query_qualities = pysam.qualitystring_to_array("F" * read_length)
+            reads.append(read)
+    reads.sort(key=lambda read: (read.reference_id, read.reference_start))
+    with pysam.AlignmentFile(bam_file, "wb", header=header) as fp:
+        for read in reads:
+            fp.write(read)
+    if index:
+        pysam.index(bam_file)
+
+
+def _write_2bit(file_path, sequences):
+    """Minimal writer for the UCSC 2bit format, storing N blocks and
+    soft-masked (lower case) blocks"""
+    base_codes = {"T": 0, "C": 1, "A": 2, "G": 3, "N": 0}
+    names = list(sequences.keys())
+    index_size = sum(1 + len(name) + 4 for name in names)
+    offset = 16 + index_size
+    records = list()
+    for name in names:
+        seq = sequences[name]
+        n_blocks = _blocks(seq, lambda base: base in "Nn")
+        mask_blocks = _blocks(seq, str.islower)
+        record = struct.pack("<I", len(seq))
+        for blocks in (n_blocks, mask_blocks):
+            record += struct.pack("<I", len(blocks))
+            record += b"".join(struct.pack("<I", start) for start, _ in blocks)
+            record += b"".join(struct.pack("<I", size) for _, size in blocks)
+        record += struct.pack("<I", 0)
+        padded = seq.upper() + "T" * (-len(seq) % 4)
+        record += bytes(
+            (base_codes[padded[i]] << 6)
+            | (base_codes[padded[i + 1]] << 4)
+            | (base_codes[padded[i + 2]] << 2)
+            | base_codes[padded[i + 3]]
+            for i in range(0, len(padded), 4)
+        )
+        records.append((name, offset, record))
+        offset += len(record)
+    with open(file_path, "wb") as fp:
+        fp.write(struct.pack("<IIII", 0x1A412743, 0, len(names), 0))
+        for name, record_offset, _ in records:
+            fp.write(struct.pack("<B", len(name)) + name.encode())
+            fp.write(struct.pack("<I", record_offset))
+        for _, _, record in records:
+            fp.write(record)
+
+
+def _blocks(seq, test):
+    blocks = list()
+    start = None
+    for i, base in enumerate(seq):
+        if test(base) and start is None:
+            start = i
+        elif not test(base) and start is not None:
+            blocks.append((start, i - start))
+            start = None
+    if start is not None:
+        blocks.append((start, len(seq) - start))
+    return blocks
@@ -1,3 +1,9 @@
+import os
+import gzip
+import pickle
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
 import numpy as np
 from scipy.sparse import csr_matrix
 import tempfile
@@ -5,6 +11,8 @@ import pytest
 
 import ctDNAtool.manipulations as mut
 import ctDNAtool.combined_data as combined_data
+import ctDNAtool.container as container
+import ctDNAtool.manipulations.convert_to_tsv as convert_to_tsv
 import ctDNAtool.data as data
 
 
@@ -75,6 +83,60 @@ class Test_stride_binning:
         ).reshape((5, 5))
         assert np.array_equal(R, T) is True
 
+    def test_integer_dtype(self):
+        """Test that integer counts are summed as 64 bit integers of their
+        kind"""
+        X = np.arange(40, dtype=np.uint32).reshape((20, 2))
+
+        R = mut.stride_binning(X, 3, 2)
+
+        T = np.array([X[i : i + 3].sum(axis=0) for i in range(0, 19, 2)])
+        assert R.dtype == np.uint64
+        assert np.array_equal(R, T)
+        assert mut.stride_binning(X.astype(np.int16), 3, 2).dtype == np.int64
+
+    def test_overflow(self):
+        """Test that bin sums beyond the range of the input dtype do not wrap,
+        for both dense and sparse samples"""
+        X = np.full((4, 1), 2**31, dtype=np.uint32)
+        X_sparse = np.empty(4, dtype=object)
+        for i in range(4):
+            X_sparse[i] = csr_matrix(X[i : i + 1])
+
+        assert mut.stride_binning(X, 4, 4).tolist() == [[2**33]]
+        assert mut.stride_binning(X_sparse, 4, 4)[0].toarray().tolist() == [[2**33]]
+        small = np.full((2, 1), 200, dtype=np.uint8)
+        assert mut.stride_binning(small, 2, 2).tolist() == [[400]]
+
+    def test_sparse(self):
+        """Test binning an array of sparse matrices as a tensor"""
+        T = np.arange(7 * 4 * 3, dtype=np.uint32).reshape((7, 4, 3)) % 5
+        X = np.empty(7, dtype=object)
+        for i in range(7):
+            X[i] = csr_matrix(T[i])
+
+        R = mut.stride_binning(X, 3, 2)
+
+        assert len(R) == 3
+        for r, expected in zip(R, mut.stride_binning(T, 3, 2)):
+            assert r.dtype == np.uint64
+            assert np.array_equal(r.toarray(), expected)
+
+    def test_binsize_exceeds_array(self):
+        """Test that a bin size larger than the array gives one bin of the
+        whole array, for both dense and sparse samples"""
+        T = np.arange(3 * 4 * 2, dtype=np.uint32).reshape((3, 4, 2))
+        X = np.empty(3, dtype=object)
+        for i in range(3):
+            X[i] = csr_matrix(T[i])
+
+        R = mut.stride_binning(T, 10, 2)
+        R_sparse = mut.stride_binning(X, 10, 2)
+
+        assert np.array_equal(R, T.sum(axis=0, keepdims=True))
+        assert len(R_sparse) == 1
+        assert np.array_equal(R_sparse[0].toarray(), R[0])
+
 
 class Test_combine_data:
     def test_combine_data_2dim(self):
@@ -166,6 +228,82 @@ class Test_combine_data:
         with pytest.raises(AssertionError):
             mut.combine_data(output_file, [data1_file, data2_file])
 
+    def test_combine_data_dtype(self):
+        """Test that the samples are combined with the dtype they all promote
+        to"""
+        ids = ["chr1", "chr2"]
+        data1_file = _write_temp_data_file(
+            data.Data(np.ones((2, 2), dtype=np.uint32), ids, None)
+        )
+        data2_file = _write_temp_data_file(
+            data.Data(np.full((2, 2), 2**33 + 5, dtype=np.uint64), ids, None)
+        )
+        output_file = tempfile.NamedTemporaryFile().name
+
+        mut.combine_data(output_file, [data1_file, data2_file])
+        data_combined = combined_data.CombinedData.read(output_file)
+
+        assert data_combined.data.dtype == np.uint64
+        assert (data_combined.data[1] == 2**33 + 5).all()
+
+    def test_combine_data_legacy_dtype(self, monkeypatch):
+        """Test that a legacy pickle is read once, and widens the samples
+        written before it"""
+        ids = ["chr1", "chr2"]
+        data1_file = _write_temp_data_file(
+            data.Data(np.full((2, 2), 7, dtype=np.uint32), ids, None)
+        )
+        legacy_file = tempfile.NamedTemporaryFile().name
+        with open(legacy_file, "wb") as fp:
+            pickle.dump(
+                data.Data(np.full((2, 2), 2**33 + 5, dtype=np.uint64), ids, None), fp
+            )
+        output_file = tempfile.NamedTemporaryFile().name
+        reads = Counter()
+        read = data.Data.read
+
+        def counting_read(file_path, mmap=False):
+            reads[file_path] += 1
+            return read(file_path, mmap)
+
+        monkeypatch.setattr(data.Data, "read", staticmethod(counting_read))
+        mut.combine_data(output_file, [data1_file, legacy_file, data1_file])
+        data_combined = combined_data.CombinedData.read(output_file)
+
+        assert reads[legacy_file] == 1
+        assert data_combined.data.dtype == np.uint64
+        assert data_combined.data[:, 0, 0].tolist() == [7, 2**33 + 5, 7]
+
+    def test_combine_data_narrowing(self):
+        """Test that the writer refuses values it would have to narrow"""
+        ids = ["chr1", "chr2"]
+        output_file = tempfile.NamedTemporaryFile().name
+
+        with pytest.raises(ValueError, match="sample"):
+            with combined_data.CombinedData.writer(
+                output_file, 1, ids, (2, 2), np.uint32, False
+            ) as writer:
+                writer.add("sample", np.ones((2, 2), dtype=np.uint64))
+
+    def test_combine_data_streamed(self):
+        """Test that the combined dense samples can be memory-mapped, and
+        that no output is left when a sample does not match"""
+        _, data1_file, _, data2_file, output_file = self._generate_test_data_2dim()
+        data3_file = _write_temp_data_file(
+            data.Data(np.ones((3, 2)), ["chr1", "chr2", "chr4"], None)
+        )
+
+        mut.combine_data(output_file, [data1_file, data2_file, data1_file])
+        data_combined = combined_data.CombinedData.read(output_file, mmap=True)
+
+        assert isinstance(data_combined.data, np.memmap)
+        assert data_combined.data.shape == (3, 3, 2)
+        assert (data_combined.data[2] == data_combined.data[0]).all()
+
+        with pytest.raises(AssertionError, match="Region IDs"):
+            mut.combine_data(output_file, [data1_file, data3_file])
+        assert not os.path.exists(output_file)
+
     @staticmethod
     def _generate_test_data_2dim():
         data1 = data.Data(
@@ -278,6 +416,227 @@ class Test_region_sum:
         assert (data_regions_summed.data[0] == np.array([600, 604])).all()
         assert data_regions_summed.data.shape == (2, 2)
 
+    def test_region_sum_sparse(self):
+        """Test summing sparse data over each axis, leaving the input as is"""
+        T = np.arange(60, dtype=np.uint32).reshape((3, 4, 5)) % 7
+        X = np.empty(3, dtype=object)
+        for i in range(3):
+            X[i] = csr_matrix(T[i])
+        data1_file = _write_temp_data_file(data.Data(X, ["a", "b", "c"], None))
+        output_file = tempfile.NamedTemporaryFile().name
+
+        for axis, name in enumerate(["region", "length", "kmer"]):
+            mut.region_sum(data1_file, output_file, axis=name)
+            summed = data.Data.read(output_file)
+            result = summed.data.toarray() if axis < 2 else summed.data
+
+            assert np.array_equal(result, T.sum(axis=axis))
+            assert result.dtype == np.uint32
+        assert summed.region_ids == ["a", "b", "c"]
+        for i in range(3):
+            assert np.array_equal(X[i].toarray(), T[i])
+
+
+class Test_pick_subset:
+    def test_dense(self, monkeypatch):
+        monkeypatch.setattr(container, "CHUNK_BYTES", 100)
+        X = np.arange(300).reshape((100, 3))
+        region_ids = [f"region_{i}" for i in range(100)]
+        sample_file = _write_temp_data_file(data.Data(X, region_ids, None))
+        output_file = tempfile.NamedTemporaryFile().name
+        ids = ["region_70", "region_3", "region_42"]
+
+        mut.pick_subset(sample_file, output_file, ids)
+        subset = data.Data.read(output_file)
+
+        assert subset.region_ids == ids
+        assert np.array_equal(subset.data, X[[70, 3, 42]])
+
+    def test_sparse(self):
+        X = np.empty(20, dtype=object)
+        for i in range(20):
+            X[i] = csr_matrix(np.arange(12).reshape((4, 3)) * i)
+        sample_file = _write_temp_data_file(data.Data(X, list(range(20)), None))
+        output_file = tempfile.NamedTemporaryFile().name
+
+        mut.pick_subset(sample_file, output_file, [5, 0, 19])
+        subset = data.Data.read(output_file)
+
+        assert subset.region_ids == [5, 0, 19]
+        for matrix, i in zip(subset.data, [5, 0, 19]):
+            assert np.array_equal(matrix.toarray(), X[i].toarray())
+
+    def test_missing_id(self):
+        sample_file = _write_temp_data_file(
+            data.Data(np.ones((2, 2)), ["a", "b"], None)
+        )
+
+        with pytest.raises(KeyError):
+            data.Data.read_rows(sample_file, ["a", "c"])
+
+
+class Test_sample_sum:
+    def test_dense(self):
+        samples = [
+            data.Data(np.full((3, 4), i, dtype=np.uint16), ["a", "b", "c"], None)
+            for i in range(1, 8)
+        ]
+        sample_files = [_write_temp_data_file(sample) for sample in samples]
+        output_file = tempfile.NamedTemporaryFile().name
+
+        mut.sample_sum(sample_files, output_file, workers=2, fan_in=2)
+        summed = data.Data.read(output_file)
+
+        assert summed.dtype == np.uint16
+        assert (summed.data == 28).all()
+        assert summed.region_ids == ["a", "b", "c"]
+
+    def test_sparse(self):
+        sample_files = list()
+        for i in range(1, 4):
+            X = np.empty(2, dtype=object)
+            X[0] = csr_matrix(np.eye(3, dtype=np.uint32) * i)
+            X[1] = csr_matrix(np.ones((3, 3), dtype=np.uint32))
+            sample_files.append(_write_temp_data_file(data.Data(X, ["a", "b"], None)))
+        output_file = tempfile.NamedTemporaryFile().name
+
+        mut.sample_sum(sample_files, output_file, fan_in=2)
+        summed = data.Data.read(output_file)
+
+        assert np.array_equal(summed.data[0].toarray(), np.eye(3) * 6)
+        assert np.array_equal(summed.data[1].toarray(), np.full((3, 3), 3))
+
+    def test_mismatch(self, caplog):
+        """Test that samples with other region ids are skipped and reported"""
+        sample_files = [
+            _write_temp_data_file(data.Data(np.ones((2, 2)), region_ids, None))
+            for region_ids in (["a", "b"], ["a", "x"], ["a", "b"])
+        ]
+        output_file = tempfile.NamedTemporaryFile().name
+
+        mut.sample_sum(sample_files, output_file, uint32=True)
+        summed = data.Data.read(output_file)
+
+        assert summed.dtype == np.uint32
+        assert (summed.data == 2).all()
+        assert sample_files[1] in caplog.text
+
+    def test_bounded(self, monkeypatch):
+        """Test that each file is read once and only a bounded number of
+        group sums are submitted and not yet added at a time"""
+        sample_sum = import_module("ctDNAtool.manipulations.sample_sum")
+        reads = Counter()
+        pending = list()
+        read = data.Data.read
+
+        def counting_read(file_path, mmap=False):
+            reads[file_path] += 1
+            return read(file_path, mmap)
+
+        class Executor(ThreadPoolExecutor):
+            def submit(self, *args):
+                future = super().submit(*args)
+                result = future.result
+
+                def consume():
+                    pending.append(-1)
+                    return result()
+
+                future.result = consume
+                pending.append(1)
+                return future
+
+        monkeypatch.setattr(data.Data, "read", staticmethod(counting_read))
+        monkeypatch.setattr(sample_sum, "ProcessPoolExecutor", Executor)
+        sample_files = [
+            _write_temp_data_file(data.Data(np.ones((2, 2)), ["a", "b"], None))
+            for _ in range(21)
+        ]
+        output_file = tempfile.NamedTemporaryFile().name
+
+        mut.sample_sum(sample_files, output_file, workers=2, fan_in=2)
+
+        assert set(reads.values()) == {1}
+        assert max(np.cumsum(pending)) <= 2 * sample_sum.TASKS_PER_WORKER
+        assert (data.Data.read(output_file).data == 21).all()
+
+
+class Test_convert_to_tsv_length:
+    def test_length_range(self):
+        """Test that min_length and max_length are inclusive"""
+        X = np.arange(20, dtype=np.uint32).reshape((2, 10))
+        sample_file = _write_temp_data_file(data.Data(X, ["a", "b"], None))
+        output_file = tempfile.NamedTemporaryFile().name
+
+        mut.convert_to_tsv_length(sample_file, output_file, 2, 4)
+
+        with open(output_file) as fp:
+            lines = [line.rstrip("\n").split("\t") for line in fp]
+        assert lines == [
+            ["Region ID", "2", "3", "4"],
+            ["a", "1", "2", "3"],
+            ["b", "11", "12", "13"],
+        ]
+
+    def test_long_format_gzip(self, monkeypatch):
+        monkeypatch.setattr(convert_to_tsv, "TSV_CHUNK_CELLS", 4)
+        X = np.zeros((3, 5), dtype=np.uint32)
+        X[0, 0] = 7
+        X[2, 4] = 9
+        sample_file = _write_temp_data_file(data.Data(X, ["a", "b", "c"], None))
+        output_file = tempfile.NamedTemporaryFile(suffix=".gz").name
+
+        mut.convert_to_tsv_length(
+            sample_file, output_file, compression="gzip", long_format=True
+        )
+
+        with gzip.open(output_file, "rt") as fp:
+            lines = [line.rstrip("\n").split("\t") for line in fp]
+        assert lines == [
+            ["Region ID", "Length", "Count"],
+            ["a", "1", "7"],
+            ["c", "5", "9"],
+        ]
+
+
+class Test_summaries_data:
+    def test_counts(self):
+        """Test the nucleotide counts of flank 1, where the start sequence AT
+        and end sequence GC is k-mer 0123 in base 4"""
+        flank = 1
+        X = csr_matrix((3, 257))
+        X[0, int("0123", base=4)] = 2
+        X[2, int("3333", base=4)] = 1
+        X[1, 256] = 5
+
+        counts, freqs = mut.summaries_data(X, flank)
+
+        T = np.array([[2, 0], [0, 2], [2, 0], [2, 4]])
+        assert np.array_equal(counts, T)
+        assert np.array_equal(counts, mut.summaries_data(X.toarray(), flank)[0])
+        assert np.allclose(freqs.sum(axis=0), 1)
+
+    def test_summaries_table(self):
+        """Test the table of nucleotide counts of several samples"""
+        sample_files = list()
+        for n in (1, 3):
+            X = np.empty(2, dtype=object)
+            X[0] = csr_matrix((3, 257), dtype=np.uint32)
+            X[0][0, int("0123", base=4)] = n
+            X[1] = csr_matrix((3, 257), dtype=np.uint32)
+            sample_files.append(_write_temp_data_file(data.Data(X, ["a", "b"], None)))
+        output_file = tempfile.NamedTemporaryFile().name
+
+        mut.summaries_table(sample_files, output_file, 1, workers=2)
+
+        with open(output_file) as fp:
+            lines = [line.rstrip("\n").split("\t") for line in fp]
+        assert lines[0] == ["Sample ID", "Position", "Nucleotide", "Count", "Frequency"]
+        assert len(lines) == 1 + 2 * 2 * 4
+        sample_id = sample_files[1].split("/")[-1]
+        assert [sample_id, "1", "G", "3", "0.5"] in lines
+        assert [sample_id, "2", "C", "3", "0.5"] in lines
+
 
 def _write_temp_data_file(data1):
     file = tempfile.NamedTemporaryFile().name
@@ -0,0 +1,108 @@
+import os
+import gzip
+import tempfile
+
+from ctDNAtool.preprocessors import find_tss
+import ctDNAtool.preprocessors.gff3 as gff3
+from ctDNAtool.preprocessors.gff3 import read_transcripts
+from ctDNAtool.preprocessors.transcript_annotation import pull_ccds_id, pull_tx_id
+
+GFF3_LINES = [
+    "##gff-version 3",
+    "#description: test annotation",
+    "chr1\tHAVANA\tgene\t100\t500\t.\t+\t.\tID=ENSG1.1;gene_id=ENSG1.1",
+    "chr1\tHAVANA\ttranscript\t100\t500\t.\t+\t.\t"
+    "ID=ENST1.1;Parent=ENSG1.1;gene_id=ENSG1.1;transcript_id=ENST1.1;"
+    "gene_type=protein_coding;gene_name=A;transcript_type=protein_coding;"
+    "transcript_name=A-1;level=2;ccdsid=CCDS1.1",
+    "chr1\tHAVANA\texon\t100\t200\t.\t+\t.\tID=exon:ENST1.1:1;Parent=ENST1.1",
+    "chrX\tHAVANA\ttranscript\t100\t500\t.\t+\t.\t"
+    "ID=ENST2.1;Parent=ENSG2.1;gene_id=ENSG2.1;transcript_id=ENST2.1;"
+    "gene_type=protein_coding;gene_name=B;transcript_type=protein_coding;"
+    "transcript_name=B-1;level=2",
+    "chr2\tHAVANA\ttranscript\t3000\t4000\t.\t-\t.\t"
+    "ID=ENST3.1;Parent=ENSG3.1;gene_id=ENSG3.1;transcript_id=ENST3.1;"
+    "gene_type=lncRNA;gene_name=C;transcript_type=lncRNA;"
+    "transcript_name=C-1;level=2",
+]
+
+
+def write_gff3(directory, compressed=False):
+    text = "\n".join(GFF3_LINES) + "\n"
+    if compressed:
+        file_path = os.path.join(directory, "test.gff3.gz")
+        with gzip.open(file_path, "wt") as fp:
+            fp.write(text)
+    else:
+        file_path = os.path.join(directory, "test.gff3")
+        with open(file_path, "w") as fp:
+            fp.write(text)
+    return file_path
+
+
+def as_tuples(transcripts):
+    return [(t.chrom, t.start, t.end, t.strand, pull_tx_id(t)) for t in transcripts]
+
+
+class Test_read_transcripts:
+    def test_autosome_transcripts(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            transcripts = list(read_transcripts(write_gff3(tmp_dir)))
+
+        assert as_tuples(transcripts) == [
+            ("chr1", 100, 500, "+", "ENST1"),
+            ("chr2", 3000, 4000, "-", "ENST3"),
+        ]
+        assert pull_ccds_id(transcripts[0]) == "CCDS1.1"
+        assert pull_ccds_id(transcripts[1]) is None
+
+    def test_gzip_and_workers(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            plain = as_tuples(read_transcripts(write_gff3(tmp_dir)))
+            compressed = as_tuples(
+                read_transcripts(write_gff3(tmp_dir, compressed=True))
+            )
+            parallel = as_tuples(read_transcripts(write_gff3(tmp_dir), workers=3))
+
+        assert compressed == plain
+        assert parallel == plain
+
+    def test_byte_ranges(self, monkeypatch):
+        """Test that parsing many small byte ranges, with lines cut at the
+        range bounds and more ranges than can be pending, gives the transcripts
+        of a serial parse in file order"""
+        monkeypatch.setattr(gff3, "RANGE_BYTES", 97)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, "test.gff3")
+            with open(file_path, "w") as fp:
+                fp.write(GFF3_LINES[0] + "\n")
+                for i in range(200):
+                    fp.write(
+                        f"chr{i % 3 + 1}\tHAVANA\ttranscript\t{i}\t{i + 50}\t.\t+\t.\t"
+                        f"ID=ENST{i}.1;transcript_id=ENST{i}.1\n"
+                    )
+            n_ranges = os.path.getsize(file_path) // gff3.RANGE_BYTES
+            serial = as_tuples(read_transcripts(file_path))
+            parallel = as_tuples(read_transcripts(file_path, workers=2))
+
+        assert n_ranges > 2 * gff3.RANGES_PER_WORKER
+        assert len(serial) == 200
+        assert parallel == serial
+
+
+class Test_find_tss:
+    def test_find_tss(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bed_file = os.path.join(tmp_dir, "tss.bed")
+            tss_file = os.path.join(tmp_dir, "tss.tsv")
+            find_tss(write_gff3(tmp_dir, compressed=True), 50, bed_file, tss_file)
+            with open(bed_file) as fp:
+                bed_lines = fp.read().splitlines()
+            with open(tss_file) as fp:
+                tss_lines = fp.read().splitlines()
+
+        assert bed_lines[1:] == [
+            "chr1\t75\t125\tchr1_100\t0\t+",
+            "chr2\t3975\t4025\tchr2_4000\t0\t-",
+        ]
+        assert len(tss_lines) == 3